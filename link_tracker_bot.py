@@ -4,12 +4,32 @@ import sys
 import csv
 import io
 import re
+import math
+import gzip
+import hashlib
+import struct
+import zlib
+from array import array
+from collections import OrderedDict, deque
+import zipfile
+import tempfile
+import shutil
+import json
+import asyncio
+import threading
+import itertools
+import functools
+import time
 import logging
 import sqlite3
+from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # Impor pihak ketiga
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle, raw, utils
+from pyrogram.enums import ChatMemberStatus
+from pyrogram.errors import FloodWait, RPCError
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
 
@@ -24,20 +44,188 @@ BOT_USERNAME = os.getenv("BOT_USERNAME", "YourBotUsername")
 DB_PATH = os.getenv("DB_PATH", "link_tracker.db")
 DATA_DB_PATH = os.getenv("DATA_DB_PATH", "data.db")
 
+# Konfigurasi export: kompresi (gzip | zip | none), ukuran maksimum per part
+# (batas dokumen bot Telegram 50 MB) dan jumlah baris per batch dari cursor
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "gzip").lower()
+EXPORT_PART_SIZE = int(os.getenv("EXPORT_PART_SIZE", str(45 * 1024 * 1024)))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Antrian job export: jumlah worker paralel dan interval update progres (detik)
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_PROGRESS_INTERVAL = float(os.getenv("EXPORT_PROGRESS_INTERVAL", "3"))
+
+# Snapshot analitik read-only untuk export/aktivitas (0 = baca langsung dari DB live).
+# Setiap refresh menyalin seluruh link_tracker.db (dibaca dan ditulis sebesar ukuran DB), jadi
+# interval latar belakangnya dibuat panjang; refresh dilewati selama DB live tidak berubah sejak
+# snapshot terakhir. Bacaan interaktif (/search, /topposts, /stats, /activity) yang menemukan
+# snapshot lebih tua dari SNAPSHOT_MAX_AGE detik menunggu refresh dulu (0 = tidak pernah), jadi
+# data yang ditampilkan paling lama sebesar itu dan salinan penuh hanya terjadi saat ada yang membaca.
+ANALYTICS_DB_PATH = os.getenv("ANALYTICS_DB_PATH", "analytics.db")
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "3600"))
+SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", "300"))
+SNAPSHOT_STEP_PAGES = int(os.getenv("SNAPSHOT_STEP_PAGES", "256"))
+
+# Sketch heavy-hitter (top sumber / user paling aktif): interval simpan ke DB (detik), jumlah maksimum
+# sketch di memori (~64 KB per sketch) dan detik tanpa pemakaian sebelum sketch dibuang dari memori
+HEAVY_HITTERS_PERSIST_INTERVAL = int(os.getenv("HEAVY_HITTERS_PERSIST_INTERVAL", "60"))
+HEAVY_HITTERS_CACHE_SIZE = int(os.getenv("HEAVY_HITTERS_CACHE_SIZE", "1000"))
+HEAVY_HITTERS_IDLE_TTL = int(os.getenv("HEAVY_HITTERS_IDLE_TTL", "3600"))
+
+# Konversi klik -> join: jendela atribusi (hari), ukuran batch dan interval flush (detik)
+CONVERSION_WINDOW_DAYS = int(os.getenv("CONVERSION_WINDOW_DAYS", "30"))
+CONVERSION_BATCH_SIZE = int(os.getenv("CONVERSION_BATCH_SIZE", "500"))
+CONVERSION_FLUSH_INTERVAL = float(os.getenv("CONVERSION_FLUSH_INTERVAL", "2"))
+
+# Penghapusan latar belakang: interval reaper (detik), baris per batch, jeda antar batch (detik),
+# interval GC orphan (detik) dan halaman per langkah incremental vacuum
+REAPER_INTERVAL = int(os.getenv("REAPER_INTERVAL", "30"))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "2000"))
+REAPER_PAUSE = float(os.getenv("REAPER_PAUSE", "0.05"))
+GC_INTERVAL = int(os.getenv("GC_INTERVAL", str(6 * 3600)))
+VACUUM_STEP_PAGES = int(os.getenv("VACUUM_STEP_PAGES", "1024"))
+
+# Monitoring grup pasif (prioritas rendah): kapasitas antrean, backlog saat mulai sampling/shedding,
+# dan 1 dari N pesan yang tetap memperbarui users/members selama sampling
+PASSIVE_QUEUE_SIZE = int(os.getenv("PASSIVE_QUEUE_SIZE", "5000"))
+PASSIVE_SHED_THRESHOLD = int(os.getenv("PASSIVE_SHED_THRESHOLD", "1000"))
+PASSIVE_SAMPLE_RATE = int(os.getenv("PASSIVE_SAMPLE_RATE", "10"))
+# Batas tunggu lock tulis (detik) untuk transaksi monitoring pasif; pesan yang tidak mendapat lock
+# dalam batas ini dicoba ulang hingga PASSIVE_BUSY_RETRIES kali dengan jeda mundur eksponensial
+# mulai PASSIVE_BUSY_BACKOFF detik, baru dibuang (dicetak & passive_stats['busy_dropped'])
+PASSIVE_DB_TIMEOUT = float(os.getenv("PASSIVE_DB_TIMEOUT", "0.5"))
+PASSIVE_BUSY_RETRIES = int(os.getenv("PASSIVE_BUSY_RETRIES", "5"))
+PASSIVE_BUSY_BACKOFF = float(os.getenv("PASSIVE_BUSY_BACKOFF", "0.2"))
+
+# Sesi Pyrogram berbasis file (auth key & cache peer bertahan antar restart), default di samping DB_PATH.
+# Nama default memuat id bot dari token agar ganti token tidak memakai sesi bot lama.
+SESSION_DIR = os.getenv("SESSION_DIR", os.path.dirname(os.path.abspath(DB_PATH)))
+SESSION_NAME = os.getenv("SESSION_NAME", f"link_tracker_bot_{(BOT_TOKEN or '').split(':')[0]}")
+# Pemanasan peer saat start: chat per panggilan GetChannels/GetChats dan jeda antar resolve username (detik)
+PEER_WARMUP_BATCH = int(os.getenv("PEER_WARMUP_BATCH", "100"))
+PEER_WARMUP_PAUSE = float(os.getenv("PEER_WARMUP_PAUSE", "0.5"))
+
+# Jumlah worker dispatcher Pyrogram. Update dari user yang sama tetap diproses berurutan
+# (lihat serialize_per_user), jadi nilai ini aman dinaikkan untuk melayani banyak user paralel.
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "32"))
+
+# Admission control per user (token bucket): kapasitas burst dan detik per token baru untuk tiap
+# kelas perintah (klik deep link, menu/callback biasa termasuk grafik /stats dan kirim ulang export
+# dari cache, export yang benar-benar membangun file). Burst 0 = tanpa batas.
+RATE_CLICK_BURST = int(os.getenv("RATE_CLICK_BURST", "5"))
+RATE_CLICK_REFILL = float(os.getenv("RATE_CLICK_REFILL", "3"))
+RATE_MENU_BURST = int(os.getenv("RATE_MENU_BURST", "30"))
+RATE_MENU_REFILL = float(os.getenv("RATE_MENU_REFILL", "1"))
+RATE_EXPORT_BURST = int(os.getenv("RATE_EXPORT_BURST", "3"))
+RATE_EXPORT_REFILL = float(os.getenv("RATE_EXPORT_REFILL", "120"))
+# Interval (detik) pembersihan bucket user yang sudah penuh kembali (idle)
+RATE_SWEEP_INTERVAL = int(os.getenv("RATE_SWEEP_INTERVAL", "60"))
+
+# Jurnal klik append-only (jalur cepat /start): direktori segmen, ukuran segmen sebelum rotasi (byte),
+# interval fsync batch (detik), interval penerapan ke SQLite (detik) dan klik per transaksi penerapan
+CLICK_JOURNAL_DIR = os.getenv("CLICK_JOURNAL_DIR", os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "click_journal"))
+CLICK_JOURNAL_SEGMENT_SIZE = int(os.getenv("CLICK_JOURNAL_SEGMENT_SIZE", str(4 * 1024 * 1024)))
+CLICK_JOURNAL_FSYNC_INTERVAL = float(os.getenv("CLICK_JOURNAL_FSYNC_INTERVAL", "0.05"))
+CLICK_JOURNAL_APPLY_INTERVAL = float(os.getenv("CLICK_JOURNAL_APPLY_INTERVAL", "1"))
+CLICK_JOURNAL_BATCH_SIZE = int(os.getenv("CLICK_JOURNAL_BATCH_SIZE", "2000"))
+
+# Backup berkelanjutan kedua database (online backup API): direktori tujuan, interval (detik, 0 = mati),
+# jumlah generasi yang disimpan per database dan halaman per langkah backup
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "backups"))
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "300"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "3"))
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "1024"))
+
+# Migrasi skema: jumlah baris per batch untuk migrasi data besar, dan ukuran database (MB) terbesar
+# yang masih di-VACUUM saat startup untuk mengaktifkan incremental vacuum (lebih besar: CLI `migrate`)
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "50000"))
+STARTUP_VACUUM_MAX_MB = int(os.getenv("STARTUP_VACUUM_MAX_MB", "64"))
+
 # Validasi Konfigurasi
-if not all([API_ID, API_HASH, BOT_TOKEN]):
-    print("Missing API_ID, API_HASH, or BOT_TOKEN in environment variables.")
-    print("Please create a .env file with these values.")
-    sys.exit(1)
-
-# Initialize SQLite Database
-def init_database():
-    """Inisialisasi database SQLite dengan tabel-tabel yang diperlukan."""
-    conn = sqlite3.connect(DB_PATH)
+def validate_config():
+    """Pastikan kredensial bot tersedia sebelum client dijalankan."""
+    if not all([API_ID, API_HASH, BOT_TOKEN]):
+        print("Missing API_ID, API_HASH, or BOT_TOKEN in environment variables.")
+        print("Please create a .env file with these values.")
+        sys.exit(1)
+
+# --- Migrasi Skema (PRAGMA user_version) ---
+#
+# Setiap database menyimpan versi skemanya di PRAGMA user_version. Migrasi ke-N
+# dijalankan sekali saja ketika user_version < N, lalu versi dinaikkan dalam
+# transaksi yang sama dengan commit terakhir migrasi itu. Migrasi data besar memakai
+# migrate_in_batches dan commit per batch: jika proses terhenti di tengah, tabel sudah
+# sebagian termigrasi sementara user_version masih versi lama, jadi step-nya harus bisa
+# diulang dan dilanjutkan dari titik yang ikut di-commit bersama batch terakhir.
+# Database yang sudah terbaru hanya membaca satu pragma.
+# Migrasi baru SELALU ditambahkan di akhir daftar, jangan menyisipkan atau mengubah urutan.
+
+def add_missing_column(cursor, table: str, column: str, definition: str):
+    """ALTER TABLE ADD COLUMN hanya jika kolom belum ada."""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        print(f"Migrating {table} table: adding {column}")
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def table_exists(cursor, name: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+def migrate_in_batches(conn, label: str, table: str, step, resume_after: int = 0):
+    """Jalankan step(cursor, lo, hi) per rentang id (lo, hi] dengan commit dan progres per batch.
+
+    Setiap batch di-commit tersendiri (user_version baru naik setelah batch terakhir). Jika proses
+    terhenti, migrasi diulang dari awal dengan resume_after yang dibaca pemanggil dari data yang
+    sudah di-commit, jadi step harus idempoten untuk rentang yang terulang (INSERT OR IGNORE
+    dengan id asli, atau resume_after yang tepat menunjuk baris terakhir yang sudah diproses).
+    """
     cursor = conn.cursor()
-    
-    # Tabel hanya akan dibuat jika belum ada (Persistensi Data Aktif)
-    
+    cursor.execute(f'SELECT MIN(id), MAX(id) FROM {table}')
+    first, last = cursor.fetchone()
+    if first is None:
+        return
+    lo = max(first - 1, resume_after)
+    span = last - first + 1
+    while lo < last:
+        hi = lo + MIGRATION_BATCH_SIZE
+        step(cursor, lo, hi)
+        conn.execute('COMMIT')
+        conn.execute('BEGIN')
+        lo = hi
+        done = min(hi, last) - first + 1
+        print(f"  {label}: {100 * done // span}% (id {min(hi, last)} of {last})")
+
+def migrate_storage_settings(conn):
+    """auto_vacuum INCREMENTAL (untuk GC) dan WAL (pembaca tidak memblokir penulis klik).
+
+    Pada database kosong auto_vacuum langsung berlaku. Database yang sudah berisi tabel butuh
+    VACUUM satu kali (menulis ulang seluruh file dan mengunci database selama itu): hanya
+    dijalankan di sini jika ukurannya di bawah STARTUP_VACUUM_MAX_MB, selebihnya lewat
+    vacuum_database / `python link_tracker_bot.py migrate` agar startup bot tidak tertahan.
+    """
+    # Keduanya tidak bisa diubah di dalam transaksi
+    conn.execute('COMMIT')
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        has_tables = conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] > 0
+        size = conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if has_tables and size <= STARTUP_VACUUM_MAX_MB * 1024 * 1024:
+            print("  enabling incremental vacuum (one-time VACUUM)")
+            conn.execute('VACUUM')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('BEGIN')
+
+def migrate_base_schema(conn):
+    """Skema dasar. Idempoten agar database lama tanpa user_version ikut terangkat."""
+    cursor = conn.cursor()
+
+    # Tabel click_stats & user_activity lama disisihkan; datanya dipindah di migrasi berikutnya
+    if table_exists(cursor, 'click_stats'):
+        cursor.execute('ALTER TABLE click_stats RENAME TO click_stats_legacy')
+    if table_exists(cursor, 'user_activity'):
+        cursor.execute('ALTER TABLE user_activity RENAME TO user_activity_legacy')
+        # Tabel lama mungkin belum punya kolom post_id
+        add_missing_column(cursor, 'user_activity_legacy', 'post_id', 'INTEGER')
+
     # Create links table
     # links = link_id, owner_id, username_target, owner_code, clicks
     cursor.execute('''
@@ -48,65 +236,98 @@ def init_database():
             owner_code TEXT NOT NULL,
             clicks INTEGER DEFAULT 0,
             group_username TEXT,
-            group_id INTEGER
+            group_id INTEGER,
+            deleted_at INTEGER
         )
     ''')
+    add_missing_column(cursor, 'links', 'group_username', 'TEXT')
+    add_missing_column(cursor, 'links', 'group_id', 'INTEGER')
+    # deleted_at: tombstone untuk penghapusan di latar belakang
+    add_missing_column(cursor, 'links', 'deleted_at', 'INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_owner_id ON links(owner_id)')
 
-    # Migrasi: Pastikan kolom baru ada jika tabel sudah dibuat sebelumnya
-    try:
-        cursor.execute("SELECT group_username FROM links LIMIT 1")
-    except sqlite3.OperationalError:
-        print("Migrating links table: adding group_username and group_id")
-        cursor.execute("ALTER TABLE links ADD COLUMN group_username TEXT")
-        cursor.execute("ALTER TABLE links ADD COLUMN group_id INTEGER")
-    
-    # Buat tabel click_stats
-    # click_stats = link_id, sumber, user_id, first_name, last_name, username, language_code
+    # Tabel klik ringkas: timestamp epoch (INTEGER), sumber diinternir ke tabel sources,
+    # profil pengguna disimpan sekali per versi di profiles (bukan disalin di setiap klik)
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS click_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            link_id TEXT NOT NULL,
-            sumber TEXT,
+        CREATE TABLE IF NOT EXISTS sources (
+            source_id INTEGER PRIMARY KEY,
+            sumber TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profiles (
+            profile_id INTEGER PRIMARY KEY,
             user_id INTEGER,
             first_name TEXT,
             last_name TEXT,
             username TEXT,
-            language_code TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (link_id) REFERENCES links(link_id)
+            language_code TEXT
         )
     ''')
-    
-    # Buat tabel user_activity (disimpan karena membantu pelacakan aktivitas, FK diperbarui)
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_activity (
+        CREATE TABLE IF NOT EXISTS clicks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link_id TEXT NOT NULL,
+            source_id INTEGER,
+            user_id INTEGER,
+            profile_id INTEGER,
+            ts INTEGER NOT NULL
+        )
+    ''')
+    # Indeks covering: /stats dan range scan per link tidak perlu menyentuh tabel
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_click_link_ts ON clicks(link_id, ts, source_id, profile_id)')
+    # (user_id, link_id, ts): klik terakhir user per koleksi untuk atribusi join
+    cursor.execute('DROP INDEX IF EXISTS idx_click_user')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_click_user_link ON clicks(user_id, link_id, ts)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_profile_user ON profiles(user_id)')
+
+    # View click_stats mempertahankan bentuk kolom lama untuk kueri yang belum dipindah
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS click_stats AS
+        SELECT c.id, c.link_id, s.sumber, c.user_id,
+               p.first_name, p.last_name, p.username, p.language_code,
+               datetime(c.ts, 'unixepoch') AS timestamp
+        FROM clicks c
+        LEFT JOIN sources s ON s.source_id = c.source_id
+        LEFT JOIN profiles p ON p.profile_id = c.profile_id
+    ''')
+
+    # Aktivitas: satu baris per pesan di activity_messages, atribusi ke koleksi
+    # (bisa lebih dari satu per pesan) di tabel sempit activity_links
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activity_messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
             username TEXT,
             chat_id INTEGER NOT NULL,
             chat_title TEXT,
             chat_username TEXT,
-            owner_code TEXT NOT NULL,
-            link_id TEXT NOT NULL,
             message_text TEXT,
             message_id INTEGER,
             post_id INTEGER,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (link_id) REFERENCES links(link_id)
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    # Migrasi sederhana: tambahkan kolom post_id jika belum ada
-    try:
-        cursor.execute("ALTER TABLE user_activity ADD COLUMN post_id INTEGER")
-    except sqlite3.OperationalError:
-        pass # Column already exists
-    
-    # Buat indeks untuk performa yang lebih baik
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_owner_id ON links(owner_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_link_id ON click_stats(link_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON click_stats(user_id)')
-    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activity_links (
+            activity_id INTEGER NOT NULL,
+            link_id TEXT NOT NULL,
+            owner_code TEXT NOT NULL,
+            PRIMARY KEY (activity_id, link_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_link ON activity_links(link_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_owner ON activity_links(owner_code)')
+
+    # View user_activity mempertahankan bentuk lama (satu baris per pesan per link)
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS user_activity AS
+        SELECT m.id, m.user_id, m.username, m.chat_id, m.chat_title, m.chat_username,
+               al.owner_code, al.link_id, m.message_text, m.message_id, m.post_id, m.timestamp
+        FROM activity_links al
+        JOIN activity_messages m ON m.id = al.activity_id
+    ''')
+
     # Tabel link_groups untuk multi-link support
     # Menyimpan grup link dengan nama yang diberikan user
     cursor.execute('''
@@ -116,10 +337,12 @@ def init_database():
             group_name TEXT NOT NULL,
             owner_code TEXT NOT NULL,
             clicks INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            deleted_at INTEGER
         )
     ''')
-    
+    add_missing_column(cursor, 'link_groups', 'deleted_at', 'INTEGER')
+
     # Tabel link_items untuk menyimpan link-link dalam grup
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS link_items (
@@ -132,11 +355,11 @@ def init_database():
             FOREIGN KEY (group_id) REFERENCES link_groups(group_id)
         )
     ''')
-    
+
     # Index untuk link_groups dan link_items
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_owner ON link_groups(owner_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_item_group ON link_items(group_id)')
-    
+
     # Tabel link_group_targets untuk tracking target channel dari link group
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS link_group_targets (
@@ -151,16 +374,274 @@ def init_database():
 
     # Index untuk link_group_targets
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_target_group ON link_group_targets(group_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_target_chat ON link_group_targets(chat_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_target_chat_username ON link_group_targets(LOWER(chat_username))')
 
-    conn.commit()
-    conn.close()
-    print(f"SQLite database initialized at {DB_PATH}")
+    # Tabel conversions: join ke chat target yang diatribusikan ke klik terakhir user
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link_id TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            click_id INTEGER,
+            source_id INTEGER,
+            joined_at INTEGER NOT NULL,
+            UNIQUE (link_id, chat_id, user_id)
+        )
+    ''')
 
-def init_user_database():
-    """Inisialisasi data.db untuk pelacakan pengguna, grup, dan anggota."""
-    conn = sqlite3.connect(DATA_DB_PATH)
+    # Penghitung konversi per (koleksi, sumber), diperbarui bersama setiap batch (source_id 0 = tanpa sumber)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversion_counts (
+            link_id TEXT NOT NULL,
+            source_id INTEGER NOT NULL DEFAULT 0,
+            conversions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (link_id, source_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Agregat engagement per post channel (komentar di grup diskusi), per koleksi
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_stats (
+            link_id TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            channel_username TEXT,
+            comments INTEGER NOT NULL DEFAULT 0,
+            unique_commenters INTEGER NOT NULL DEFAULT 0,
+            first_comment_at INTEGER,
+            last_comment_at INTEGER,
+            PRIMARY KEY (link_id, chat_id, post_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_post_stats_top ON post_stats(link_id, comments)')
+
+    # Komentator per post (untuk unique_commenters & sumber atribusi)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_commenters (
+            link_id TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            source_id INTEGER,
+            comments INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (link_id, chat_id, post_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Tabel hll_sketches: sketch HyperLogLog pengguna unik per (link_id, sumber, hari UTC)
+    # sumber NULL disimpan sebagai '' agar bisa menjadi bagian primary key
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS hll_sketches (
+            link_id TEXT NOT NULL,
+            sumber TEXT NOT NULL DEFAULT '',
+            day TEXT NOT NULL,
+            registers BLOB NOT NULL,
+            PRIMARY KEY (link_id, sumber, day)
+        ) WITHOUT ROWID
+    ''')
+
+    # Tabel heavy_hitters: count-min sketch + kandidat top-K per koleksi
+    # kind = 'source' (klik per sumber) atau 'user' (aktivitas per user_id)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS heavy_hitters (
+            link_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            sketch BLOB NOT NULL,
+            top TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (link_id, kind)
+        )
+    ''')
+
+    # Tabel export_cache: file_id Telegram dari export terakhir per koleksi & tipe export
+    # documents = JSON list [file_id, caption]; watermark = id klik/aktivitas terakhir saat export dibuat
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS export_cache (
+            group_id TEXT NOT NULL,
+            export_type TEXT NOT NULL,
+            watermark TEXT NOT NULL,
+            documents TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (group_id, export_type)
+        )
+    ''')
+
+def migrate_legacy_clicks(conn):
+    """Pindahkan click_stats lama (satu baris teks per klik) ke skema ringkas, per batch."""
     cursor = conn.cursor()
-    
+    if not table_exists(cursor, 'click_stats_legacy'):
+        return
+
+    def step(cursor, lo, hi):
+        cursor.execute('''
+            INSERT OR IGNORE INTO sources (sumber)
+            SELECT DISTINCT sumber FROM click_stats_legacy
+            WHERE id > ? AND id <= ? AND sumber IS NOT NULL
+        ''', (lo, hi))
+        # Satu baris profiles per kombinasi profil yang pernah terlihat
+        cursor.execute('''
+            INSERT INTO profiles (user_id, first_name, last_name, username, language_code)
+            SELECT DISTINCT cs.user_id, cs.first_name, cs.last_name, cs.username, cs.language_code
+            FROM click_stats_legacy cs
+            WHERE cs.id > ? AND cs.id <= ? AND NOT EXISTS (
+                SELECT 1 FROM profiles p
+                WHERE p.user_id IS cs.user_id
+                  AND p.first_name IS cs.first_name
+                  AND p.last_name IS cs.last_name
+                  AND p.username IS cs.username
+                  AND p.language_code IS cs.language_code
+            )
+        ''', (lo, hi))
+        cursor.execute('''
+            INSERT OR IGNORE INTO clicks (id, link_id, source_id, user_id, profile_id, ts)
+            SELECT cs.id, cs.link_id, s.source_id, cs.user_id, p.profile_id,
+                   COALESCE(CAST(strftime('%s', cs.timestamp) AS INTEGER), 0)
+            FROM click_stats_legacy cs
+            LEFT JOIN sources s ON s.sumber = cs.sumber
+            LEFT JOIN profiles p ON p.user_id IS cs.user_id
+                AND p.first_name IS cs.first_name
+                AND p.last_name IS cs.last_name
+                AND p.username IS cs.username
+                AND p.language_code IS cs.language_code
+            WHERE cs.id > ? AND cs.id <= ?
+        ''', (lo, hi))
+
+    # id klik lama dipertahankan, jadi id terbesar di clicks adalah titik lanjut
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM clicks')
+    migrate_in_batches(conn, "click_stats", 'click_stats_legacy', step, resume_after=cursor.fetchone()[0])
+    cursor.execute('DROP TABLE click_stats_legacy')
+
+def migrate_legacy_activity(conn):
+    """Pecah user_activity lama (satu baris per pesan per link) menjadi pesan + atribusi, per batch."""
+    cursor = conn.cursor()
+    if not table_exists(cursor, 'user_activity_legacy'):
+        return
+
+    # Baris fan-out dari pesan yang sama dipetakan ke id terkecilnya
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_activity_legacy_message
+        ON user_activity_legacy(chat_id, user_id, message_id, id)
+    ''')
+
+    def step(cursor, lo, hi):
+        cursor.execute('''
+            INSERT OR IGNORE INTO activity_messages
+                (id, user_id, username, chat_id, chat_title, chat_username, message_text, message_id, post_id, timestamp)
+            SELECT ua.id, ua.user_id, ua.username, ua.chat_id, ua.chat_title, ua.chat_username,
+                   ua.message_text, ua.message_id, ua.post_id, ua.timestamp
+            FROM user_activity_legacy ua
+            WHERE ua.id > ? AND ua.id <= ? AND (ua.message_id IS NULL OR NOT EXISTS (
+                SELECT 1 FROM user_activity_legacy u2
+                WHERE u2.chat_id = ua.chat_id AND u2.user_id = ua.user_id
+                  AND u2.message_id = ua.message_id AND u2.id < ua.id
+            ))
+        ''', (lo, hi))
+        cursor.execute('''
+            INSERT OR IGNORE INTO activity_links (activity_id, link_id, owner_code)
+            SELECT CASE WHEN ua.message_id IS NULL THEN ua.id ELSE (
+                       SELECT MIN(u2.id) FROM user_activity_legacy u2
+                       WHERE u2.chat_id = ua.chat_id AND u2.user_id = ua.user_id
+                         AND u2.message_id = ua.message_id
+                   ) END,
+                   ua.link_id, ua.owner_code
+            FROM user_activity_legacy ua
+            WHERE ua.id > ? AND ua.id <= ?
+        ''', (lo, hi))
+
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM activity_messages')
+    migrate_in_batches(conn, "user_activity", 'user_activity_legacy', step, resume_after=cursor.fetchone()[0])
+    cursor.execute('DROP TABLE user_activity_legacy')
+
+def migrate_post_stats(conn):
+    """Bangun agregat post dari aktivitas yang sudah ada."""
+    cursor = conn.cursor()
+    cursor.execute('SELECT 1 FROM post_stats LIMIT 1')
+    if cursor.fetchone() is None:
+        backfill_post_stats(cursor)
+
+def migrate_hll_sketches(conn):
+    """Bangun sketch HyperLogLog dari klik yang sudah ada."""
+    cursor = conn.cursor()
+    cursor.execute('SELECT 1 FROM hll_sketches LIMIT 1')
+    if cursor.fetchone() is None:
+        backfill_hll_sketches(cursor)
+
+def migrate_activity_fts(conn):
+    """Indeks FTS5 (external content) atas activity_messages.message_text, diisi per batch."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS activity_fts USING fts5(
+            message_text,
+            content='activity_messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+
+    def step(cursor, lo, hi):
+        cursor.execute('''
+            INSERT INTO activity_fts (rowid, message_text)
+            SELECT id, message_text FROM activity_messages
+            WHERE id > ? AND id <= ? AND message_text IS NOT NULL
+        ''', (lo, hi))
+
+    # Lanjut dari dokumen terakhir yang sudah terindeks jika migrasi sempat terhenti
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM activity_fts_docsize')
+    migrate_in_batches(conn, "activity_fts", 'activity_messages', step, resume_after=cursor.fetchone()[0])
+    cursor.execute("INSERT INTO activity_fts (activity_fts) VALUES ('optimize')")
+
+def migrate_journal_state(conn):
+    """Posisi (segment, position) jurnal klik yang sudah diterapkan ke SQLite."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS journal_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            segment INTEGER NOT NULL,
+            position INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO journal_state (id, segment, position) VALUES (1, 0, 0)')
+
+def migrate_click_rollup(conn):
+    """Agregat klik per (link, jam UTC, sumber, bahasa) untuk /stats, diisi dari clicks yang sudah ada."""
+    cursor = conn.cursor()
+    # source_id NULL disimpan sebagai 0 dan bahasa NULL sebagai '' agar bisa menjadi bagian primary key
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS click_rollup (
+            link_id TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            source_id INTEGER NOT NULL DEFAULT 0,
+            language_code TEXT NOT NULL DEFAULT '',
+            clicks INTEGER NOT NULL,
+            PRIMARY KEY (link_id, hour, source_id, language_code)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO click_rollup (link_id, hour, source_id, language_code, clicks)
+        SELECT c.link_id, c.ts / 3600, COALESCE(c.source_id, 0), COALESCE(p.language_code, ''), COUNT(*)
+        FROM clicks c
+        LEFT JOIN profiles p ON p.profile_id = c.profile_id
+        GROUP BY 1, 2, 3, 4
+    ''')
+
+# Urutan = nomor versi (indeks + 1). Hanya boleh ditambah di akhir.
+MIGRATIONS = [
+    ("storage settings (incremental vacuum, WAL)", migrate_storage_settings),
+    ("base schema", migrate_base_schema),
+    ("compact click schema", migrate_legacy_clicks),
+    ("single activity row per message", migrate_legacy_activity),
+    ("per-post engagement aggregates", migrate_post_stats),
+    ("HyperLogLog sketches", migrate_hll_sketches),
+    ("full-text search over activity", migrate_activity_fts),
+    ("click journal state", migrate_journal_state),
+    ("hourly click rollup", migrate_click_rollup),
+]
+
+def migrate_user_base_schema(conn):
+    """Skema dasar data.db untuk pelacakan pengguna, grup, dan anggota."""
+    cursor = conn.cursor()
+
     # Buat tabel users
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -175,7 +656,7 @@ def init_user_database():
             interaction_count INTEGER DEFAULT 0
         )
     ''')
-    
+
     # Buat tabel groups
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS groups (
@@ -188,7 +669,7 @@ def init_user_database():
             last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
+
     # Buat tabel members (pelacakan pasif)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS members (
@@ -204,33 +685,204 @@ def init_user_database():
             UNIQUE(chat_id, user_id)
         )
     ''')
-    
+
     # Buat indeks untuk pencarian yang lebih cepat
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_username ON users(username)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_members_chat_id ON members(chat_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_members_user_id ON members(user_id)')
-    
-    conn.commit()
-    conn.close()
-    print(f"Data database initialized at {DATA_DB_PATH}")
 
-# Initialize database on startup
-try:
-    init_database()
-    init_user_database()
-except Exception as e:
-    print(f"Failed to initialize database: {e}")
-    sys.exit(1)
+def migrate_members_keyset_index(conn):
+    """Indeks (chat_id, last_seen, user_id) untuk export anggota dengan keyset pagination."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_members_chat_last_seen
+        ON members(chat_id, last_seen, user_id)
+    ''')
+    # Awalan chat_id sudah dicakup indeks di atas dan UNIQUE(chat_id, user_id)
+    cursor.execute('DROP INDEX IF EXISTS idx_members_chat_id')
+
+USER_DB_MIGRATIONS = [
+    ("base schema", migrate_user_base_schema),
+    ("storage settings (incremental vacuum, WAL)", migrate_storage_settings),
+    ("members keyset index", migrate_members_keyset_index),
+]
+
+def run_migrations(db_path: str, migrations: list) -> int:
+    """Terapkan migrasi yang belum dijalankan pada db_path dan kembalikan versi skemanya.
+
+    Kenaikan user_version di-commit bersama commit terakhir migrasinya, jadi versi tidak
+    pernah mendahului data. Migrasi biasa berjalan dalam satu transaksi; migrasi per batch
+    (migrate_in_batches) bisa meninggalkan data sebagian yang dilanjutkan saat dijalankan ulang.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for target, (description, migrate) in enumerate(migrations, start=1):
+            if target <= version:
+                continue
+            print(f"Migrating {db_path} to v{target}: {description}")
+            started = time.perf_counter()
+            conn.execute('BEGIN')
+            try:
+                migrate(conn)
+                conn.execute(f'PRAGMA user_version = {target}')
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            version = target
+            print(f"  v{target} applied in {time.perf_counter() - started:.1f}s")
+        return version
+    finally:
+        conn.close()
+
+def incremental_vacuum_enabled(db_path: str) -> bool:
+    """True jika auto_vacuum INCREMENTAL sudah berlaku di file database."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    finally:
+        conn.close()
+
+def vacuum_database(db_path: str):
+    """VACUUM satu kali agar auto_vacuum INCREMENTAL berlaku di database lama (dari CLI `migrate`).
+
+    Menulis ulang seluruh file (butuh ruang disk kosong seukuran database) dan mengunci
+    database sampai selesai, jadi jalankan saat bot berhenti.
+    """
+    if incremental_vacuum_enabled(db_path):
+        return
+    print(f"Vacuuming {db_path} to enable incremental vacuum...")
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    print(f"  done in {time.perf_counter() - started:.1f}s")
+
+def init_databases():
+    """Pulihkan database yang hilang dari backup, lalu bawa keduanya ke versi skema terbaru."""
+    restore_missing_databases()
+    version = run_migrations(DB_PATH, MIGRATIONS)
+    print(f"SQLite database initialized at {DB_PATH} (schema v{version})")
+    version = run_migrations(DATA_DB_PATH, USER_DB_MIGRATIONS)
+    print(f"Data database initialized at {DATA_DB_PATH} (schema v{version})")
+    for db_path in (DB_PATH, DATA_DB_PATH):
+        if not incremental_vacuum_enabled(db_path):
+            print(f"Note: {db_path} does not use incremental vacuum yet, so GC cannot return free pages "
+                  f"to the OS. Stop the bot and run `python link_tracker_bot.py migrate` once (full VACUUM).")
 
 # Initialize Pyrogram Client
 app = Client(
-    "link_tracker_bot",
+    SESSION_NAME,
     api_id=API_ID,
     api_hash=API_HASH,
     bot_token=BOT_TOKEN,
-    in_memory=True,
+    workdir=SESSION_DIR,
+    workers=BOT_WORKERS,
 )
 
+# --- Model ---
+# Objek ringan ber-__slots__ untuk baris yang dibaca di jalur panas (klik, monitor grup, menu)
+# sebagai ganti dict(sqlite3.Row). Kolom SELECT mengikuti urutan konstruktor, jadi row factory
+# cukup meneruskan tuple baris ke konstruktor.
+
+def model_factory(model):
+    """Row factory sqlite3 yang membangun `model` langsung dari tuple baris."""
+    def factory(cursor, row):
+        return model(*row)
+    return factory
+
+class LinkGroup:
+    """Satu koleksi link (link_groups). item_count hanya terisi dari get_user_link_groups."""
+    __slots__ = ('group_id', 'owner_id', 'group_name', 'owner_code', 'clicks', 'created_at', 'item_count')
+    COLUMNS = 'group_id, owner_id, group_name, owner_code, clicks, created_at'
+
+    def __init__(self, group_id, owner_id, group_name, owner_code, clicks, created_at, item_count=None):
+        self.group_id = group_id
+        self.owner_id = owner_id
+        self.group_name = group_name
+        self.owner_code = owner_code
+        self.clicks = clicks
+        self.created_at = created_at
+        self.item_count = item_count
+
+class LinkItem:
+    """Satu link di dalam koleksi (link_items)."""
+    __slots__ = ('id', 'group_id', 'display_name', 'target_url', 'target_type', 'position')
+    COLUMNS = 'id, group_id, display_name, target_url, target_type, position'
+
+    def __init__(self, id, group_id, display_name, target_url, target_type, position):
+        self.id = id
+        self.group_id = group_id
+        self.display_name = display_name
+        self.target_url = target_url
+        self.target_type = target_type
+        self.position = position
+
+class TrackedLink:
+    """Link (legacy atau koleksi) yang pernah diklik user dan menargetkan sebuah chat."""
+    __slots__ = ('link_id', 'owner_code', 'username_target')
+
+    def __init__(self, link_id, owner_code, username_target):
+        self.link_id = link_id
+        self.owner_code = owner_code
+        self.username_target = username_target
+
+# Rekaman biner ClickEvent di jurnal: user_id & ts (int64), lalu 6 string UTF-8 berawalan panjang uint16
+CLICK_RECORD = struct.Struct('<qq')
+CLICK_FIELD = struct.Struct('<H')
+CLICK_FIELD_NONE = 0xFFFF
+
+class ClickEvent:
+    """Satu klik deep link beserta profil user saat klik terjadi."""
+    __slots__ = ('link_id', 'user_id', 'source', 'ts', 'first_name', 'last_name', 'username', 'language_code')
+
+    def __init__(self, link_id, user_id, source, ts, first_name, last_name, username, language_code):
+        self.link_id = link_id
+        self.user_id = user_id
+        self.source = source
+        self.ts = ts
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+        self.language_code = language_code
+
+    @classmethod
+    def from_user(cls, link_id: str, user, source: str = None):
+        return cls(link_id, user.id, source, int(time.time()),
+                   user.first_name, user.last_name, user.username, user.language_code)
+
+    def to_bytes(self) -> bytes:
+        parts = [CLICK_RECORD.pack(self.user_id, self.ts)]
+        for value in (self.link_id, self.source, self.first_name, self.last_name, self.username, self.language_code):
+            if value is None:
+                parts.append(CLICK_FIELD.pack(CLICK_FIELD_NONE))
+            else:
+                data = value.encode('utf-8')[:CLICK_FIELD_NONE - 1]
+                parts.append(CLICK_FIELD.pack(len(data)))
+                parts.append(data)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        user_id, ts = CLICK_RECORD.unpack_from(data)
+        pos = CLICK_RECORD.size
+        values = []
+        for _ in range(6):
+            (size,) = CLICK_FIELD.unpack_from(data, pos)
+            pos += CLICK_FIELD.size
+            if size == CLICK_FIELD_NONE:
+                values.append(None)
+            else:
+                values.append(data[pos:pos + size].decode('utf-8', 'replace'))
+                pos += size
+        link_id, source, first_name, last_name, username, language_code = values
+        return cls(link_id, user_id, source, ts, first_name, last_name, username, language_code)
+
 # --- Helper Functions ---
 
 def generate_owner_code() -> str:
@@ -245,6 +897,43 @@ def sanitize_slug(text: str) -> str:
     slug = re.sub(r'[\s-]+', '-', slug).strip('-').lower()
     return slug[:50]
 
+def connect_unified(analytics: bool = False, timeout: float = 5.0):
+    """Koneksi ke link_tracker.db (atau snapshot analitik) dengan data.db di-ATTACH sebagai skema `data`.
+
+    Tabel kedua database bisa di-join dalam satu statement dan ditulis dalam satu transaksi.
+    Nama tabel kedua file tidak bertabrakan, jadi helper berbasis cursor di bawah berjalan
+    sama di koneksi ini maupun di koneksi data.db biasa. Catatan: dengan WAL, commit atomik
+    per file; crash di tengah commit bisa menyimpan perubahan salah satu database saja.
+    """
+    conn = connect_analytics() if analytics else sqlite3.connect(DB_PATH, timeout=timeout)
+    conn.execute('ATTACH DATABASE ? AS data', (DATA_DB_PATH,))
+    return conn
+
+def save_user_to_db(cursor, user):
+    """Simpan/perbarui pengguna di tabel users (data.db)."""
+    # Periksa apakah pengguna ada
+    cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user.id,))
+    exists = cursor.fetchone()
+    
+    if exists:
+        # Perbarui pengguna yang sudah ada
+        cursor.execute('''
+            UPDATE users 
+            SET username = ?, 
+                first_name = ?, 
+                last_name = ?, 
+                language_code = ?,
+                last_seen = CURRENT_TIMESTAMP,
+                interaction_count = interaction_count + 1
+            WHERE user_id = ?
+        ''', (user.username, user.first_name, user.last_name, user.language_code, user.id))
+    else:
+        # Masukkan pengguna baru
+        cursor.execute('''
+            INSERT INTO users (user_id, username, first_name, last_name, language_code, is_bot, interaction_count)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+        ''', (user.id, user.username, user.first_name, user.last_name, user.language_code, 1 if user.is_bot else 0))
+
 def track_user(user):
     """Lacak interaksi pengguna di data.db."""
     if not user:
@@ -252,94 +941,46 @@ def track_user(user):
     
     try:
         conn = sqlite3.connect(DATA_DB_PATH)
-        cursor = conn.cursor()
-        
-        # Periksa apakah pengguna ada
-        cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user.id,))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Perbarui pengguna yang sudah ada
-            cursor.execute('''
-                UPDATE users 
-                SET username = ?, 
-                    first_name = ?, 
-                    last_name = ?, 
-                    language_code = ?,
-                    last_seen = CURRENT_TIMESTAMP,
-                    interaction_count = interaction_count + 1
-                WHERE user_id = ?
-            ''', (user.username, user.first_name, user.last_name, user.language_code, user.id))
-        else:
-            # Masukkan pengguna baru
-            cursor.execute('''
-                INSERT INTO users (user_id, username, first_name, last_name, language_code, is_bot, interaction_count)
-                VALUES (?, ?, ?, ?, ?, ?, 1)
-            ''', (user.id, user.username, user.first_name, user.last_name, user.language_code, 1 if user.is_bot else 0))
-        
+        save_user_to_db(conn.cursor(), user)
         conn.commit()
         conn.close()
     except Exception as e:
         print(f"Error tracking user: {e}")
 
-def save_group_to_db(chat):
-    """Simpan/perbarui informasi grup ke data.db."""
-    if not chat:
-        return
+def save_group_to_db(cursor, chat):
+    """Simpan/perbarui informasi grup di tabel groups (data.db)."""
+    # Ambil tipe chat sebagai string
+    chat_type = str(chat.type).replace("ChatType.", "").lower() if chat.type else "unknown"
     
-    try:
-        conn = sqlite3.connect(DATA_DB_PATH)
-        cursor = conn.cursor()
-        
-        # Ambil tipe chat sebagai string
-        chat_type = str(chat.type).replace("ChatType.", "").lower() if chat.type else "unknown"
-        
-        # Simpan atau perbarui grup
-        cursor.execute('''
-            INSERT OR REPLACE INTO groups (chat_id, chat_type, title, username, description, last_seen)
-            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (chat.id, chat_type, chat.title, chat.username, chat.description))
-        
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"Error saving group: {e}")
+    # Simpan atau perbarui grup
+    cursor.execute('''
+        INSERT OR REPLACE INTO groups (chat_id, chat_type, title, username, description, last_seen)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (chat.id, chat_type, chat.title, chat.username, chat.description))
 
-def save_member_to_db(chat_id: int, user):
-    """Simpan/perbarui informasi anggota ke data.db (pelacakan pasif)."""
-    if not user:
-        return
+def save_member_to_db(cursor, chat_id: int, user):
+    """Simpan/perbarui anggota di tabel members (data.db, pelacakan pasif)."""
+    # Periksa apakah anggota ada
+    cursor.execute('SELECT id FROM members WHERE chat_id = ? AND user_id = ?', (chat_id, user.id))
+    exists = cursor.fetchone()
     
-    try:
-        conn = sqlite3.connect(DATA_DB_PATH)
-        cursor = conn.cursor()
-        
-        # Periksa apakah anggota ada
-        cursor.execute('SELECT id FROM members WHERE chat_id = ? AND user_id = ?', (chat_id, user.id))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Perbarui anggota yang sudah ada
-            cursor.execute('''
-                UPDATE members 
-                SET username = ?, 
-                    first_name = ?, 
-                    last_name = ?,
-                    last_seen = CURRENT_TIMESTAMP,
-                    message_count = message_count + 1
-                WHERE chat_id = ? AND user_id = ?
-            ''', (user.username, user.first_name, user.last_name, chat_id, user.id))
-        else:
-            # Masukkan anggota baru
-            cursor.execute('''
-                INSERT INTO members (chat_id, user_id, username, first_name, last_name, message_count)
-                VALUES (?, ?, ?, ?, ?, 1)
-            ''', (chat_id, user.id, user.username, user.first_name, user.last_name))
-        
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"Error saving member: {e}")
+    if exists:
+        # Perbarui anggota yang sudah ada
+        cursor.execute('''
+            UPDATE members 
+            SET username = ?, 
+                first_name = ?, 
+                last_name = ?,
+                last_seen = CURRENT_TIMESTAMP,
+                message_count = message_count + 1
+            WHERE chat_id = ? AND user_id = ?
+        ''', (user.username, user.first_name, user.last_name, chat_id, user.id))
+    else:
+        # Masukkan anggota baru
+        cursor.execute('''
+            INSERT INTO members (chat_id, user_id, username, first_name, last_name, message_count)
+            VALUES (?, ?, ?, ?, ?, 1)
+        ''', (chat_id, user.id, user.username, user.first_name, user.last_name))
 
 def get_link_from_db(link_id: str):
     """Ambil link dari database SQLite."""
@@ -347,7 +988,7 @@ def get_link_from_db(link_id: str):
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM links WHERE link_id = ?', (link_id,))
+    cursor.execute('SELECT * FROM links WHERE link_id = ? AND deleted_at IS NULL', (link_id,))
     row = cursor.fetchone()
     conn.close()
     
@@ -386,28 +1027,74 @@ def save_link_to_db(user_id: int, username_target: str, owner_code: str, group_u
     conn.close()
     return link_id
 
-def log_click(link_id: str, user, source: str = None):
+# Cache sumber -> source_id (tabel sources hanya bertambah)
+source_ids = {}
+
+def get_source_id(cursor, source: str):
+    """Ambil source_id untuk nama sumber, buat baru jika belum ada."""
+    if not source:
+        return None
+    source_id = source_ids.get(source)
+    if source_id is None:
+        cursor.execute('INSERT OR IGNORE INTO sources (sumber) VALUES (?)', (source,))
+        created = cursor.rowcount > 0
+        cursor.execute('SELECT source_id FROM sources WHERE sumber = ?', (source,))
+        source_id = cursor.fetchone()[0]
+        # Baris baru baru aman di-cache setelah transaksinya commit
+        if not created:
+            source_ids[source] = source_id
+    return source_id
+
+def get_profile_id(cursor, click: ClickEvent):
+    """Ambil profile_id untuk versi profil user saat klik, buat baru jika berubah."""
+    profile = (click.user_id, click.first_name, click.last_name, click.username, click.language_code)
+    cursor.execute('''
+        SELECT profile_id FROM profiles
+        WHERE user_id = ? AND first_name IS ? AND last_name IS ? AND username IS ? AND language_code IS ?
+    ''', profile)
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute('''
+        INSERT INTO profiles (user_id, first_name, last_name, username, language_code)
+        VALUES (?, ?, ?, ?, ?)
+    ''', profile)
+    return cursor.lastrowid
+
+def insert_click(cursor, click: ClickEvent) -> int:
+    """Simpan satu klik ke skema ringkas (clicks + sources + profiles) dan agregat per jam; return id klik."""
+    source_id = get_source_id(cursor, click.source)
+    cursor.execute(
+        'INSERT INTO clicks (link_id, source_id, user_id, profile_id, ts) VALUES (?, ?, ?, ?, ?)',
+        (click.link_id, source_id, click.user_id, get_profile_id(cursor, click), click.ts)
+    )
+    click_id = cursor.lastrowid
+    cursor.execute('''
+        INSERT INTO click_rollup (link_id, hour, source_id, language_code, clicks) VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT (link_id, hour, source_id, language_code) DO UPDATE SET clicks = clicks + 1
+    ''', (click.link_id, click.ts // 3600, source_id or 0, click.language_code or ''))
+    return click_id
+
+def log_click(click: ClickEvent):
     """Log kejadian klik ke database SQLite."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
     # Tingkatkan penghitung
-    cursor.execute('UPDATE links SET clicks = clicks + 1 WHERE link_id = ?', (link_id,))
+    cursor.execute('UPDATE links SET clicks = clicks + 1 WHERE link_id = ?', (click.link_id,))
     
     # Log detail
-    cursor.execute('''
-        INSERT INTO click_stats (link_id, sumber, user_id, first_name, last_name, username, language_code)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (link_id, source, user.id, user.first_name, user.last_name, user.username, user.language_code))
+    insert_click(cursor, click)
+    
+    update_hll_sketch(cursor, click.link_id, click.source, click.user_id)
     
     conn.commit()
     conn.close()
 
-async def get_user_tracked_links(user_id: int, chat_username: str, chat_id: int):
+def get_user_tracked_links(conn, user_id: int, chat_username: str, chat_id: int):
     """Get tracked links that a user clicked for a specific chat (by username or ID)."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
+    cursor.row_factory = model_factory(TrackedLink)
     
     results = []
 
@@ -415,8 +1102,8 @@ async def get_user_tracked_links(user_id: int, chat_username: str, chat_id: int)
     query_single = '''
         SELECT DISTINCT l.link_id, l.owner_code, l.username_target
         FROM links l
-        INNER JOIN click_stats cs ON l.link_id = cs.link_id
-        WHERE cs.user_id = ?
+        INNER JOIN clicks cs ON l.link_id = cs.link_id
+        WHERE cs.user_id = ? AND l.deleted_at IS NULL
     '''
     params_single = [user_id]
     
@@ -430,20 +1117,19 @@ async def get_user_tracked_links(user_id: int, chat_username: str, chat_id: int)
         query_single += " AND l.group_id = ?"
         params_single.append(chat_id)
     else:
-        conn.close()
         return []
 
     cursor.execute(query_single, params_single)
-    results.extend([dict(row) for row in cursor.fetchall()])
+    results.extend(cursor.fetchall())
 
     # 2. Multi-Link Groups (Link Groups via link_group_targets)
     # Cek link_group_targets
     query_group = '''
         SELECT DISTINCT lg.group_id as link_id, lg.owner_code, lgt.username_target
         FROM link_groups lg
-        INNER JOIN click_stats cs ON lg.group_id = cs.link_id
+        INNER JOIN clicks cs ON lg.group_id = cs.link_id
         INNER JOIN link_group_targets lgt ON lg.group_id = lgt.group_id
-        WHERE cs.user_id = ?
+        WHERE cs.user_id = ? AND lg.deleted_at IS NULL
     '''
     params_group = [user_id]
 
@@ -458,30 +1144,40 @@ async def get_user_tracked_links(user_id: int, chat_username: str, chat_id: int)
         params_group.append(chat_id)
         
     cursor.execute(query_group, params_group)
-    results.extend([dict(row) for row in cursor.fetchall()])
-    
-    conn.close()
+    results.extend(cursor.fetchall())
     
     return results
 
-def log_user_activity(user_id: int, username: str, chat_id: int, chat_title: str, 
-                      chat_username: str, owner_code: str, link_id: str, 
-                      message_text: str, message_id: int, post_id: int = None):
-    """Log user activity in a group/channel."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+def log_user_activity(cursor, user_id: int, username: str, chat_id: int, chat_title: str,
+                      chat_username: str, links: list, message_text: str, message_id: int,
+                      post_id: int = None, channel_username: str = None):
+    """Log satu pesan user beserta atribusinya ke semua koleksi di `links` (commit oleh pemanggil); return id aktivitas."""
     # Truncate message text to avoid excessive storage (max 500 chars)
     truncated_message = message_text[:500] if message_text else None
     
     cursor.execute('''
-        INSERT INTO user_activity 
-        (user_id, username, chat_id, chat_title, chat_username, owner_code, link_id, message_text, message_id, post_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, username, chat_id, chat_title, chat_username, owner_code, link_id, truncated_message, message_id, post_id))
+        INSERT INTO activity_messages
+        (user_id, username, chat_id, chat_title, chat_username, message_text, message_id, post_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, username, chat_id, chat_title, chat_username, truncated_message, message_id, post_id))
+    activity_id = cursor.lastrowid
+    index_activity_text(cursor, activity_id, truncated_message)
+    
+    cursor.executemany(
+        'INSERT OR IGNORE INTO activity_links (activity_id, link_id, owner_code) VALUES (?, ?, ?)',
+        [(activity_id, link.link_id, link.owner_code) for link in links]
+    )
     
-    conn.commit()
-    conn.close()
+    # Komentar pada post channel: perbarui agregat per post
+    if post_id:
+        now = int(time.time())
+        for link in links:
+            update_post_stats(cursor, link.link_id, chat_id, post_id, channel_username, user_id, now)
+    
+    # Export yang di-cache untuk koleksi ini tidak lagi valid
+    for link in links:
+        invalidate_export_cache(cursor, group_id=link.link_id, owner_code=link.owner_code)
+    return activity_id
 
 # --- Helper Functions untuk Link Groups ---
 
@@ -517,33 +1213,31 @@ def create_link_group(owner_id: int, group_name: str, owner_code: str) -> str:
     conn.close()
     return group_id
 
-def get_link_group(group_id: str) -> dict:
+def get_link_group(group_id: str) -> LinkGroup:
     """Ambil data link group berdasarkan group_id."""
     conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn.row_factory = model_factory(LinkGroup)
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM link_groups WHERE group_id = ?', (group_id,))
-    row = cursor.fetchone()
+    cursor.execute(f'SELECT {LinkGroup.COLUMNS} FROM link_groups WHERE group_id = ? AND deleted_at IS NULL', (group_id,))
+    group = cursor.fetchone()
     conn.close()
     
-    if row:
-        return dict(row)
-    return None
+    return group
 
 def get_link_items(group_id: str) -> list:
     """Ambil semua link items dalam sebuah grup."""
     conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn.row_factory = model_factory(LinkItem)
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT * FROM link_items 
+    cursor.execute(f'''
+        SELECT {LinkItem.COLUMNS} FROM link_items 
         WHERE group_id = ? 
         ORDER BY position ASC, id ASC
     ''', (group_id,))
     
-    items = [dict(row) for row in cursor.fetchall()]
+    items = cursor.fetchall()
     conn.close()
     return items
 
@@ -563,145 +1257,2767 @@ def add_link_item(group_id: str, display_name: str, target_url: str, target_type
     ''', (group_id, display_name, target_url, target_type, position))
     
     item_id = cursor.lastrowid
+    # Target chat berubah, export aktivitas yang di-cache tidak lagi valid
+    invalidate_export_cache(cursor, group_id=group_id)
     conn.commit()
     conn.close()
     return item_id
 
-def delete_link_item(item_id: int) -> bool:
-    """Hapus link item berdasarkan id."""
-    conn = sqlite3.connect(DB_PATH)
+def delete_link_item(item_id: int) -> bool:
+    """Hapus link item berdasarkan id."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute('DELETE FROM export_cache WHERE group_id = (SELECT group_id FROM link_items WHERE id = ?)', (item_id,))
+    cursor.execute('DELETE FROM link_items WHERE id = ?', (item_id,))
+    deleted = cursor.rowcount > 0
+    
+    conn.commit()
+    conn.close()
+    return deleted
+
+def get_link_item(item_id: int) -> LinkItem:
+    """Ambil data satu link item."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = model_factory(LinkItem)
+    cursor = conn.cursor()
+    
+    cursor.execute(f'SELECT {LinkItem.COLUMNS} FROM link_items WHERE id = ?', (item_id,))
+    item = cursor.fetchone()
+    conn.close()
+    
+    return item
+
+def update_link_item(item_id: int, display_name: str = None, target_url: str = None) -> bool:
+    """Update data link item (nama atau url)."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    
+    if display_name and target_url:
+        cursor.execute('''
+            UPDATE link_items 
+            SET display_name = ?, target_url = ?
+            WHERE id = ?
+        ''', (display_name, target_url, item_id))
+    elif display_name:
+        cursor.execute('UPDATE link_items SET display_name = ? WHERE id = ?', (display_name, item_id))
+    elif target_url:
+        cursor.execute('UPDATE link_items SET target_url = ? WHERE id = ?', (target_url, item_id))
+    
+    updated = cursor.rowcount > 0
+    if target_url:
+        cursor.execute('DELETE FROM export_cache WHERE group_id = (SELECT group_id FROM link_items WHERE id = ?)', (item_id,))
+    conn.commit()
+    conn.close()
+    return updated
+
+def delete_link_group(group_id: str) -> bool:
+    """Tandai link group sebagai dihapus (tombstone); datanya dihapus reaper di latar belakang."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        'UPDATE link_groups SET deleted_at = ? WHERE group_id = ? AND deleted_at IS NULL',
+        (int(time.time()), group_id)
+    )
+    deleted = cursor.rowcount > 0
+    cursor.execute('DELETE FROM export_cache WHERE group_id = ?', (group_id,))
+    
+    conn.commit()
+    conn.close()
+    
+    forget_heavy_hitters(group_id)
+    return deleted
+
+def delete_link(link_id: str) -> bool:
+    """Tandai link lama (legacy) sebagai dihapus (tombstone)."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        'UPDATE links SET deleted_at = ? WHERE link_id = ? AND deleted_at IS NULL',
+        (int(time.time()), link_id)
+    )
+    deleted = cursor.rowcount > 0
+    
+    conn.commit()
+    conn.close()
+    
+    forget_heavy_hitters(link_id)
+    return deleted
+
+def apply_clicks(cursor, clicks: list) -> list:
+    """Tulis batch klik link group (link_id klik = group_id); commit oleh pemanggil.
+
+    Mengembalikan [(link_id, sumber, jumlah, id klik terakhir link di batch)] untuk heavy hitters
+    setelah commit (id menandai batch saat sketch dibangun dari data yang sudah ada).
+    """
+    counts = {}
+    marks = {}
+    for click in clicks:
+        # Log detail ke clicks (gunakan group_id sebagai link_id untuk kompatibilitas)
+        marks[click.link_id] = insert_click(cursor, click)
+        update_hll_sketch(cursor, click.link_id, click.source, click.user_id, click.ts)
+        key = (click.link_id, click.source or "None")
+        counts[key] = counts.get(key, 0) + 1
+    
+    # Increment click counter
+    per_link = {}
+    for (link_id, _), n in counts.items():
+        per_link[link_id] = per_link.get(link_id, 0) + n
+    cursor.executemany(
+        'UPDATE link_groups SET clicks = clicks + ? WHERE group_id = ?',
+        [(n, link_id) for link_id, n in per_link.items()]
+    )
+    
+    # Export yang di-cache untuk koleksi ini tidak lagi valid
+    for link_id in per_link:
+        invalidate_export_cache(cursor, group_id=link_id)
+    return [(link_id, source, n, marks[link_id]) for (link_id, source), n in counts.items()]
+
+def count_source_hits(hits: list):
+    """Masukkan hasil apply_clicks ke heavy hitters sumber (dipanggil di event loop)."""
+    for link_id, source, n, mark in hits:
+        count_heavy_hitter(link_id, 'source', source, n, mark)
+
+def log_group_click(click: ClickEvent):
+    """Log klik pada link group langsung ke SQLite (fallback jika jurnal klik tidak bisa ditulis)."""
+    conn = sqlite3.connect(DB_PATH)
+    hits = apply_clicks(conn.cursor(), [click])
+    conn.commit()
+    conn.close()
+    
+    count_source_hits(hits)
+
+def save_target_channel(group_id: str, username_target: str, chat_id: int, chat_username: str):
+    """Simpan target channel/group untuk tracking."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    # Cek apakah sudah ada
+    cursor.execute('''
+        SELECT id FROM link_group_targets 
+        WHERE group_id = ? AND username_target = ?
+    ''', (group_id, username_target))
+    
+    exists = cursor.fetchone()
+    
+    if exists:
+        # Update jika ada perubahan chat_id atau chat_username
+        cursor.execute('''
+            UPDATE link_group_targets
+            SET chat_id = ?, chat_username = ?
+            WHERE id = ?
+        ''', (chat_id, chat_username, exists[0]))
+    else:
+        # Insert baru
+        cursor.execute('''
+            INSERT INTO link_group_targets (group_id, chat_id, chat_username, username_target)
+            VALUES (?, ?, ?, ?)
+        ''', (group_id, chat_id, chat_username, username_target))
+    
+    conn.commit()
+    conn.close()
+
+def get_user_link_groups(owner_id: int) -> list:
+    """Ambil semua link groups milik user."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = model_factory(LinkGroup)
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT lg.group_id, lg.owner_id, lg.group_name, lg.owner_code, lg.clicks, lg.created_at,
+               COUNT(li.id) as item_count
+        FROM link_groups lg
+        LEFT JOIN link_items li ON lg.group_id = li.group_id
+        WHERE lg.owner_id = ? AND lg.deleted_at IS NULL
+        GROUP BY lg.group_id
+        ORDER BY lg.created_at DESC
+    ''', (owner_id,))
+    
+    groups = cursor.fetchall()
+    conn.close()
+    return groups
+
+# --- HyperLogLog (Pengguna Unik Perkiraan) ---
+
+HLL_PRECISION = 12                  # 4096 register, error standar ~1.6%
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_MASK64 = (1 << 64) - 1
+_HLL_POW = [2.0 ** -r for r in range(65)]
+
+def hll_position(user_id: int):
+    """Hash user_id (splitmix64) menjadi (indeks register, rank)."""
+    z = (user_id + 0x9E3779B97F4A7C15) & HLL_MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & HLL_MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & HLL_MASK64
+    z ^= z >> 31
+
+    index = z >> (64 - HLL_PRECISION)
+    rest = z & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+    return index, rank
+
+def hll_estimate(registers) -> int:
+    """Perkiraan kardinalitas dari register HLL (dengan koreksi linear counting)."""
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum(map(_HLL_POW.__getitem__, registers))
+
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+def hll_merge(blobs) -> bytes:
+    """Gabungkan beberapa sketch (maksimum per register)."""
+    import numpy as np
+
+    merged = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    for blob in blobs:
+        np.maximum(merged, np.frombuffer(blob, dtype=np.uint8), out=merged)
+    return merged.tobytes()
+
+def update_hll_sketch(cursor, link_id: str, source: str, user_id: int, ts: int = None):
+    """Tambahkan user ke sketch (link_id, sumber, hari klik `ts` / hari ini) di dalam transaksi klik."""
+    index, rank = hll_position(user_id)
+    day = time.strftime('%Y-%m-%d', time.gmtime(ts))
+    source = source or ''
+
+    cursor.execute(
+        'SELECT registers FROM hll_sketches WHERE link_id = ? AND sumber = ? AND day = ?',
+        (link_id, source, day)
+    )
+    row = cursor.fetchone()
+
+    if row is None:
+        registers = bytearray(HLL_REGISTERS)
+        registers[index] = rank
+        cursor.execute(
+            'INSERT INTO hll_sketches (link_id, sumber, day, registers) VALUES (?, ?, ?, ?)',
+            (link_id, source, day, bytes(registers))
+        )
+    elif row[0][index] < rank:
+        # Hanya tulis jika register berubah (makin jarang seiring sketch terisi)
+        registers = bytearray(row[0])
+        registers[index] = rank
+        cursor.execute(
+            'UPDATE hll_sketches SET registers = ? WHERE link_id = ? AND sumber = ? AND day = ?',
+            (bytes(registers), link_id, source, day)
+        )
+
+def backfill_hll_sketches(cursor):
+    """Bangun hll_sketches dari seluruh clicks (migrasi satu kali).
+
+    Klik dibaca per batch sehingga memori sebanding dengan jumlah sketch, bukan jumlah klik.
+    """
+    cursor.execute('SELECT COUNT(*) FROM clicks')
+    total = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT c.link_id, COALESCE(s.sumber, ''), date(c.ts, 'unixepoch'), c.user_id
+        FROM clicks c
+        LEFT JOIN sources s ON s.source_id = c.source_id
+    ''')
+
+    sketches = {}
+    done = 0
+    for rows in iter(lambda: cursor.fetchmany(MIGRATION_BATCH_SIZE), []):
+        for link_id, source, day, user_id in rows:
+            registers = sketches.get((link_id, source, day))
+            if registers is None:
+                registers = sketches[(link_id, source, day)] = bytearray(HLL_REGISTERS)
+            index, rank = hll_position(user_id)
+            if registers[index] < rank:
+                registers[index] = rank
+        done += len(rows)
+        print(f"  hll_sketches: {100 * done // max(total, 1)}% ({done} of {total} clicks)")
+
+    cursor.executemany(
+        'INSERT OR REPLACE INTO hll_sketches (link_id, sumber, day, registers) VALUES (?, ?, ?, ?)',
+        [(link_id, source, day, bytes(regs)) for (link_id, source, day), regs in sketches.items()]
+    )
+
+def estimate_unique_users(cursor, link_id: str, sources: list = None,
+                          start_day: str = None, end_day: str = None) -> int:
+    """Perkiraan pengguna unik untuk rentang hari ('YYYY-MM-DD') dan kumpulan sumber tertentu."""
+    sql = 'SELECT registers FROM hll_sketches WHERE link_id = ?'
+    params = [link_id]
+
+    if sources is not None:
+        sql += f" AND sumber IN ({','.join('?' for _ in sources)})"
+        params.extend(src or '' for src in sources)
+    if start_day:
+        sql += " AND day >= ?"
+        params.append(start_day)
+    if end_day:
+        sql += " AND day <= ?"
+        params.append(end_day)
+
+    cursor.execute(sql, params)
+    blobs = [row[0] for row in cursor.fetchall()]
+    if not blobs:
+        return 0
+    return hll_estimate(hll_merge(blobs))
+
+# --- Heavy Hitters (Top Sumber & User Paling Aktif) ---
+
+class HeavyHitters:
+    """Count-min sketch dengan daftar kandidat top-K untuk satu koleksi dan satu dimensi."""
+
+    WIDTH = 2048
+    DEPTH = 4
+    TOP_K = 10
+
+    def __init__(self, table: array = None, top: dict = None):
+        self.table = table if table is not None else array('Q', bytes(8 * self.WIDTH * self.DEPTH))
+        self.top = top or {}
+        self.dirty = False
+        self.last_used = time.monotonic()
+
+    def _cells(self, key: str):
+        # Hash stabil (bukan hash() bawaan yang diacak per proses) agar sketch bisa disimpan
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [row * self.WIDTH + (h1 + row * h2) % self.WIDTH for row in range(self.DEPTH)]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """Tambah hitungan key dan perbarui top-K. Mengembalikan perkiraan hitungan."""
+        table = self.table
+        estimate = None
+        for cell in self._cells(key):
+            table[cell] += count
+            if estimate is None or table[cell] < estimate:
+                estimate = table[cell]
+
+        top = self.top
+        if key in top or len(top) < self.TOP_K:
+            top[key] = estimate
+        else:
+            weakest = min(top, key=top.get)
+            if estimate > top[weakest]:
+                del top[weakest]
+                top[key] = estimate
+
+        self.dirty = True
+        return estimate
+
+    def ranking(self) -> list:
+        """Daftar (key, perkiraan hitungan) terurut menurun."""
+        return sorted(self.top.items(), key=lambda kv: kv[1], reverse=True)
+
+    def to_row(self):
+        return self.table.tobytes(), json.dumps(self.top)
+
+    @classmethod
+    def from_row(cls, sketch: bytes, top: str):
+        table = array('Q')
+        table.frombytes(sketch)
+        return cls(table, json.loads(top))
+
+# Cache LRU di event loop: urutan = terakhir dipakai. Sketch yang belum ada di memori dimuat di
+# thread (lihat load_heavy_hitters); hitungan yang masuk selama pemuatan ditampung di
+# heavy_hitters_pending lalu diterapkan begitu sketch siap. Setiap hitungan membawa id baris
+# (clicks.id / activity_messages.id) yang sudah di-commit: saat sketch dibangun dari GROUP BY,
+# hitungan dengan id <= id tertinggi yang terbaca sudah termasuk dan dilewati. Sketch bersih yang
+# idle lebih dari HEAVY_HITTERS_IDLE_TTL atau di luar HEAVY_HITTERS_CACHE_SIZE dibuang setelah persist.
+heavy_hitters = OrderedDict()  # (link_id, kind) -> HeavyHitters
+heavy_hitters_pending = {}     # (link_id, kind) -> [(key, count, id baris)] selama sketch dimuat
+heavy_hitters_loads = {}       # (link_id, kind) -> task pemuatan yang sedang berjalan
+
+def load_heavy_hitters(link_id: str, kind: str):
+    """Baca sketch dari DB, atau bangun sekali dari data yang sudah ada (GROUP BY; jalankan di thread).
+
+    Mengembalikan (sketch, id baris tertinggi yang ikut terhitung); id None jika sketch dibaca dari
+    tabel heavy_hitters (hitungan tertunda belum termasuk di dalamnya).
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT sketch, top FROM heavy_hitters WHERE link_id = ? AND kind = ?', (link_id, kind))
+    row = cursor.fetchone()
+    high_water = None
+
+    if row:
+        sketch = HeavyHitters.from_row(*row)
+    else:
+        # Belum ada sketch: isi dari data historis (satu kali per koleksi). Satu query = satu
+        # snapshot, jadi MAX(id) tepat menandai baris yang ikut terhitung.
+        sketch = HeavyHitters()
+        if kind == 'source':
+            cursor.execute('''
+                SELECT s.sumber, COUNT(*), MAX(c.id) FROM clicks c
+                LEFT JOIN sources s ON s.source_id = c.source_id
+                WHERE c.link_id = ? GROUP BY c.source_id
+            ''', (link_id,))
+        else:
+            cursor.execute('''
+                SELECT m.user_id, COUNT(*), MAX(m.id) FROM activity_links al
+                JOIN activity_messages m ON m.id = al.activity_id
+                WHERE al.link_id = ? GROUP BY m.user_id
+            ''', (link_id,))
+        high_water = 0
+        for value, count, last_id in cursor.fetchall():
+            sketch.add(str(value) if value is not None else "None", count)
+            high_water = max(high_water, last_id)
+    conn.close()
+    return sketch, high_water
+
+async def load_heavy_hitters_cached(link_id: str, kind: str) -> HeavyHitters:
+    """Muat sketch di thread, terapkan hitungan yang tertunda, lalu masukkan ke cache."""
+    key = (link_id, kind)
+    task = asyncio.current_task()
+    pending = ()
+    try:
+        sketch, high_water = await asyncio.get_running_loop().run_in_executor(
+            None, load_heavy_hitters, link_id, kind
+        )
+    except Exception as e:
+        print(f"Error loading heavy hitters for {link_id} ({kind}): {e}")
+        raise
+    finally:
+        # forget_heavy_hitters melepas pemuatan koleksi yang dihapus: hasilnya tidak masuk cache
+        current = heavy_hitters_loads.get(key) is task
+        if current:
+            del heavy_hitters_loads[key]
+            pending = heavy_hitters_pending.pop(key, ())
+
+    if not current:
+        return sketch
+    for value, count, mark in pending:
+        if high_water is None or mark > high_water:
+            sketch.add(value, count)
+    heavy_hitters[key] = sketch
+    return sketch
+
+def start_heavy_hitters_load(key: tuple):
+    """Task pemuatan sketch untuk key (satu per key meski diminta berkali-kali)."""
+    task = heavy_hitters_loads.get(key)
+    if task is None:
+        task = heavy_hitters_loads[key] = asyncio.get_running_loop().create_task(load_heavy_hitters_cached(*key))
+        # Kegagalan sudah dicetak; hindari peringatan exception yang tidak pernah diambil
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+def touch_heavy_hitters(key: tuple):
+    """Sketch dari cache (ditandai baru dipakai), atau None jika belum dimuat."""
+    sketch = heavy_hitters.get(key)
+    if sketch is not None:
+        heavy_hitters.move_to_end(key)
+        sketch.last_used = time.monotonic()
+    return sketch
+
+async def get_heavy_hitters(link_id: str, kind: str) -> HeavyHitters:
+    """Ambil sketch dari memori, atau tunggu pemuatannya dari DB di thread."""
+    key = (link_id, kind)
+    sketch = touch_heavy_hitters(key)
+    if sketch is None:
+        # shield: handler yang dibatalkan tidak membatalkan pemuatan yang ditunggu pemanggil lain
+        sketch = await asyncio.shield(start_heavy_hitters_load(key))
+    return sketch
+
+def count_heavy_hitter(link_id: str, kind: str, value: str, count: int, mark: int):
+    """Tambah hitungan tanpa menunggu (dipanggil di event loop); ditunda jika sketch sedang dimuat.
+
+    `mark` = id baris (clicks / activity_messages) yang dihitung, sudah di-commit.
+    """
+    key = (link_id, kind)
+    sketch = touch_heavy_hitters(key)
+    if sketch is not None:
+        sketch.add(value, count)
+        return
+    heavy_hitters_pending.setdefault(key, []).append((value, count, mark))
+    start_heavy_hitters_load(key)
+
+def forget_heavy_hitters(link_id: str):
+    """Buang sketch koleksi yang dihapus dari memori agar tidak ditulis ulang.
+
+    Pemuatan yang masih berjalan dilepas dari heavy_hitters_loads sehingga hasilnya tidak masuk
+    cache (lihat load_heavy_hitters_cached); pemanggil yang menunggunya tetap mendapat sketch.
+    """
+    for kind in ('source', 'user'):
+        heavy_hitters.pop((link_id, kind), None)
+        heavy_hitters_pending.pop((link_id, kind), None)
+        heavy_hitters_loads.pop((link_id, kind), None)
+
+def write_heavy_hitters(rows: list):
+    """Simpan baris sketch ke tabel heavy_hitters (dijalankan di thread)."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany('''
+        INSERT OR REPLACE INTO heavy_hitters (link_id, kind, sketch, top, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+def evict_heavy_hitters() -> int:
+    """Buang sketch bersih yang idle melewati TTL atau di luar kapasitas cache. Return jumlah yang dibuang."""
+    now = time.monotonic()
+    excess = len(heavy_hitters) - HEAVY_HITTERS_CACHE_SIZE
+    evicted = 0
+    # Dari yang paling lama tidak dipakai; sketch kotor menunggu persist berikutnya
+    for key, sketch in list(heavy_hitters.items()):
+        if excess - evicted <= 0 and now - sketch.last_used < HEAVY_HITTERS_IDLE_TTL:
+            break
+        if not sketch.dirty:
+            del heavy_hitters[key]
+            evicted += 1
+    return evicted
+
+async def persist_heavy_hitters():
+    """Simpan sketch yang berubah ke tabel heavy_hitters di thread, lalu buang sketch idle dari memori."""
+    # Pemuatan yang masih berjalan mungkin membawa hitungan tertunda
+    if heavy_hitters_loads:
+        await asyncio.gather(*heavy_hitters_loads.values(), return_exceptions=True)
+
+    dirty = [(key, sketch) for key, sketch in heavy_hitters.items() if sketch.dirty]
+    if dirty:
+        rows = []
+        for (link_id, kind), sketch in dirty:
+            sketch.dirty = False
+            rows.append((link_id, kind, *sketch.to_row()))
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write_heavy_hitters, rows)
+        except Exception:
+            # Jangan sampai sketch yang gagal disimpan ikut dibuang dari memori
+            for _, sketch in dirty:
+                sketch.dirty = True
+            raise
+    evict_heavy_hitters()
+
+async def heavy_hitters_persist_loop():
+    """Simpan sketch heavy-hitter secara berkala."""
+    while True:
+        await asyncio.sleep(HEAVY_HITTERS_PERSIST_INTERVAL)
+        try:
+            await persist_heavy_hitters()
+        except Exception as e:
+            print(f"Error persisting heavy hitters: {e}")
+
+# --- Jurnal Klik (Append-only) ---
+#
+# /start hanya menambahkan rekaman ke segmen jurnal (satu write() tanpa SQLite), jadi balasan ke user
+# tidak menunggu penulisan database. Setiap rekaman: panjang + CRC32 (uint32) lalu ClickEvent.to_bytes().
+# Data di page cache sudah aman dari kill -9; fsync dijalankan per batch (CLICK_JOURNAL_FSYNC_INTERVAL)
+# untuk mati listrik. Konsumen menerapkan rekaman ke SQLite per batch dan menyimpan posisinya di
+# journal_state dalam transaksi yang sama, jadi saat startup segmen yang belum diterapkan di-replay
+# tepat sekali. Rekaman terpotong / CRC salah di ekor segmen (crash di tengah write) diabaikan.
+
+JOURNAL_FRAME = struct.Struct('<II')
+
+def journal_segment_path(segment: int) -> str:
+    return os.path.join(CLICK_JOURNAL_DIR, f"{segment:010d}.journal")
+
+def list_journal_segments() -> list:
+    """Nomor segmen jurnal yang ada di disk, urut naik."""
+    try:
+        names = os.listdir(CLICK_JOURNAL_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-8]) for name in names if name.endswith('.journal') and name[:-8].isdigit())
+
+def read_journal_segment(segment: int, start: int = 0, end: int = None):
+    """Yield (offset setelah rekaman, ClickEvent) dari `start` sampai `end` atau rekaman rusak pertama."""
+    with open(journal_segment_path(segment), 'rb') as f:
+        f.seek(start)
+        data = f.read() if end is None else f.read(end - start)
+    pos = 0
+    while pos + JOURNAL_FRAME.size <= len(data):
+        size, crc = JOURNAL_FRAME.unpack_from(data, pos)
+        payload = data[pos + JOURNAL_FRAME.size:pos + JOURNAL_FRAME.size + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            return
+        pos += JOURNAL_FRAME.size + size
+        yield start + pos, ClickEvent.from_bytes(payload)
+
+class ClickJournal:
+    """Penulis segmen jurnal klik. Semua method dipanggil dari event loop kecuali sync_fds()."""
+
+    def __init__(self):
+        self.fd = None
+        self.segment = 0
+        self.offset = 0
+        self.retired = []       # fd segmen lama: di-fsync lalu ditutup oleh sync berikutnya
+        self.dirty = False
+        self.new_segment = False
+
+    def open(self, after_segment: int = 0):
+        """Mulai segmen baru bernomor di atas semua segmen yang ada dan `after_segment`."""
+        os.makedirs(CLICK_JOURNAL_DIR, exist_ok=True)
+        self.segment = max(list_journal_segments() + [after_segment])
+        self._open_next()
+
+    def _open_next(self):
+        self.segment += 1
+        self.offset = 0
+        self.fd = os.open(journal_segment_path(self.segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.new_segment = True
+
+    def append(self, click: ClickEvent):
+        payload = click.to_bytes()
+        frame = JOURNAL_FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+        if self.fd is None:
+            raise OSError("click journal is not open")
+        os.write(self.fd, frame)
+        self.offset += len(frame)
+        self.dirty = True
+        if self.offset >= CLICK_JOURNAL_SEGMENT_SIZE:
+            self.retired.append(self.fd)
+            self._open_next()
+
+    def take_sync(self):
+        """Ambil pekerjaan fsync yang tertunda: (fd aktif atau None, fd lama, fsync direktori?)."""
+        fd = self.fd if self.dirty else None
+        retired, self.retired = self.retired, []
+        new_segment, self.new_segment = self.new_segment, False
+        self.dirty = False
+        return fd, retired, new_segment
+
+    @staticmethod
+    def sync_fds(fd, retired: list, new_segment: bool):
+        """fsync batch (di thread): segmen aktif, segmen lama lalu ditutup, dan direktori jika ada segmen baru."""
+        for old_fd in retired:
+            os.fsync(old_fd)
+            os.close(old_fd)
+        if fd is not None:
+            os.fsync(fd)
+        if new_segment:
+            dir_fd = os.open(CLICK_JOURNAL_DIR, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def close(self):
+        fd, retired, new_segment = self.take_sync()
+        self.sync_fds(fd, retired, new_segment)
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+click_journal = ClickJournal()
+click_journal_lock = asyncio.Lock()
+click_journal_stats = {'appended': 0, 'applied': 0, 'fallback': 0}
+
+def record_click(click: ClickEvent):
+    """Catat klik ke jurnal (jalur cepat /start); langsung ke SQLite jika jurnal gagal ditulis."""
+    try:
+        click_journal.append(click)
+        click_journal_stats['appended'] += 1
+    except OSError as e:
+        print(f"Error writing click journal: {e}")
+        click_journal_stats['fallback'] += 1
+        log_group_click(click)
+
+def apply_click_journal(limit: tuple = None):
+    """Terapkan rekaman jurnal yang belum diterapkan ke SQLite, CLICK_JOURNAL_BATCH_SIZE klik per transaksi.
+
+    `limit` = (segment, offset) yang sudah ditulis di segmen aktif; None saat replay startup (semua
+    segmen di disk sudah selesai). Segmen yang sudah diterapkan penuh dihapus.
+    Mengembalikan (jumlah klik, hitungan heavy hitters dari apply_clicks untuk semua batch).
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT segment, position FROM journal_state')
+    segment_done, position = initial = cursor.fetchone()
+    applied = 0
+    hits = []
+    batch = []
+
+    for segment in list_journal_segments():
+        if segment < segment_done or (limit and segment > limit[0]):
+            continue
+        start = position if segment == segment_done else 0
+        end = limit[1] if limit and segment == limit[0] else None
+        for offset, click in read_journal_segment(segment, start, end):
+            batch.append(click)
+            segment_done, position = segment, offset
+            if len(batch) >= CLICK_JOURNAL_BATCH_SIZE:
+                applied += commit_journal_batch(cursor, batch, (segment_done, position), hits)
+                batch = []
+        if not limit or segment < limit[0]:
+            # Segmen sudah selesai ditulis: sisa ekor yang rusak (crash) dilewati
+            segment_done, position = segment + 1, 0
+
+    if batch or (segment_done, position) != initial:
+        applied += commit_journal_batch(cursor, batch, (segment_done, position), hits)
+    conn.close()
+
+    for segment in list_journal_segments():
+        if segment < segment_done:
+            os.remove(journal_segment_path(segment))
+    return applied, hits
+
+def commit_journal_batch(cursor, batch: list, state: tuple, hits: list) -> int:
+    """Terapkan satu batch klik dan posisi jurnalnya dalam satu transaksi."""
+    hits.extend(apply_clicks(cursor, batch))
+    cursor.execute('UPDATE journal_state SET segment = ?, position = ?', state)
+    cursor.connection.commit()
+    return len(batch)
+
+def replay_click_journal():
+    """Saat startup: terapkan segmen yang tertinggal dari proses sebelumnya, lalu buka segmen baru."""
+    applied, hits = apply_click_journal()
+    if applied:
+        print(f"Click journal: replayed {applied} clicks")
+        count_source_hits(hits)
+    conn = sqlite3.connect(DB_PATH)
+    segment_done = conn.execute('SELECT segment FROM journal_state').fetchone()[0]
+    conn.close()
+    # Nomor di atas posisi terapan: posisi lama tidak pernah menunjuk ke segmen baru
+    click_journal.open(after_segment=segment_done)
+
+async def sync_click_journal():
+    """fsync batch segmen jurnal (di thread, tidak memblokir event loop)."""
+    fd, retired, new_segment = click_journal.take_sync()
+    if fd is None and not retired and not new_segment:
+        return
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, ClickJournal.sync_fds, fd, retired, new_segment)
+    except OSError as e:
+        print(f"Error syncing click journal: {e}")
+
+async def flush_click_journal():
+    """Terapkan semua klik yang sudah ada di jurnal ke SQLite (di thread)."""
+    async with click_journal_lock:
+        limit = (click_journal.segment, click_journal.offset)
+        try:
+            applied, hits = await asyncio.get_running_loop().run_in_executor(None, apply_click_journal, limit)
+        except Exception as e:
+            print(f"Error applying click journal: {e}")
+            return
+        click_journal_stats['applied'] += applied
+        count_source_hits(hits)
+
+async def click_journal_sync_loop():
+    """fsync jurnal klik secara berkala."""
+    while True:
+        await asyncio.sleep(CLICK_JOURNAL_FSYNC_INTERVAL)
+        await sync_click_journal()
+
+async def click_journal_apply_loop():
+    """Terapkan jurnal klik ke SQLite secara berkala."""
+    while True:
+        await asyncio.sleep(CLICK_JOURNAL_APPLY_INTERVAL)
+        await flush_click_journal()
+
+# --- Konversi Klik → Join ---
+
+# Buffer join (chat_id, chat_username, user_id, joined_at) yang belum ditulis
+conversion_buffer = []
+conversion_flush_lock = asyncio.Lock()
+
+def record_conversions(batch: list) -> int:
+    """Cocokkan batch join ke klik terakhir user dan tulis dalam satu transaksi.
+
+    Mengembalikan jumlah konversi baru.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    window = CONVERSION_WINDOW_DAYS * 86400
+    targets = {}
+    counts = {}
+
+    for chat_id, chat_username, user_id, joined_at in batch:
+        # Koleksi aktif yang menargetkan chat ini (di-cache per batch, lonjakan join biasanya satu chat);
+        # koleksi yang sudah di-tombstone tidak menerima konversi baru selagi menunggu reaper
+        key = (chat_id, chat_username)
+        group_ids = targets.get(key)
+        if group_ids is None:
+            cursor.execute('''
+                SELECT DISTINCT t.group_id FROM link_group_targets t
+                JOIN link_groups g ON g.group_id = t.group_id
+                WHERE (t.chat_id = ? OR LOWER(t.chat_username) = LOWER(?)) AND g.deleted_at IS NULL
+            ''', (chat_id, chat_username))
+            group_ids = targets[key] = [row[0] for row in cursor.fetchall()]
+        if not group_ids:
+            continue
+
+        # Klik terakhir user pada koleksi tsb dalam jendela atribusi
+        # (+60 detik toleransi selisih jam server bot vs Telegram)
+        cursor.execute(f'''
+            SELECT id, link_id, source_id FROM clicks
+            WHERE user_id = ? AND link_id IN ({','.join('?' for _ in group_ids)})
+              AND ts BETWEEN ? AND ?
+            ORDER BY ts DESC
+            LIMIT 1
+        ''', (user_id, *group_ids, joined_at - window, joined_at + 60))
+        click = cursor.fetchone()
+        if not click:
+            continue
+
+        click_id, link_id, source_id = click
+        cursor.execute('''
+            INSERT OR IGNORE INTO conversions (link_id, chat_id, user_id, click_id, source_id, joined_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (link_id, chat_id, user_id, click_id, source_id, joined_at))
+        # Join ulang / update ganda (service message + chat_member) tidak dihitung dua kali
+        if cursor.rowcount > 0:
+            counts[(link_id, source_id or 0)] = counts.get((link_id, source_id or 0), 0) + 1
+
+    cursor.executemany('''
+        INSERT INTO conversion_counts (link_id, source_id, conversions) VALUES (?, ?, ?)
+        ON CONFLICT(link_id, source_id) DO UPDATE SET conversions = conversions + excluded.conversions
+    ''', [(link_id, source_id, n) for (link_id, source_id), n in counts.items()])
+    for link_id in {link_id for link_id, _ in counts}:
+        invalidate_export_cache(cursor, group_id=link_id)
+
+    conn.commit()
+    conn.close()
+    return sum(counts.values())
+
+def queue_conversion(chat_id: int, chat_username: str, user_id: int, joined_at: int):
+    """Masukkan join ke buffer; flush segera jika batch sudah penuh."""
+    conversion_buffer.append((chat_id, chat_username, user_id, joined_at))
+    if len(conversion_buffer) >= CONVERSION_BATCH_SIZE:
+        asyncio.get_running_loop().create_task(flush_conversions())
+
+async def flush_conversions():
+    """Tulis seluruh isi buffer join ke database (di thread, tidak memblokir event loop)."""
+    async with conversion_flush_lock:
+        if not conversion_buffer:
+            return
+        batch = conversion_buffer[:]
+        del conversion_buffer[:]
+        # Klik yang masih di jurnal harus sudah ada di tabel clicks untuk atribusi
+        await flush_click_journal()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, record_conversions, batch)
+        except Exception as e:
+            print(f"Error recording conversions: {e}")
+
+async def conversion_flush_loop():
+    """Flush buffer join secara berkala."""
+    while True:
+        await asyncio.sleep(CONVERSION_FLUSH_INTERVAL)
+        await flush_conversions()
+
+def get_conversion_rates(cursor, link_id: str) -> list:
+    """Konversi per sumber: [(sumber, joins, perkiraan user unik, rate)]."""
+    cursor.execute('''
+        SELECT s.sumber, cc.conversions
+        FROM conversion_counts cc
+        LEFT JOIN sources s ON s.source_id = cc.source_id
+        WHERE cc.link_id = ?
+        ORDER BY s.sumber
+    ''', (link_id,))
+    rates = []
+    for source, joins in cursor.fetchall():
+        unique_users = estimate_unique_users(cursor, link_id, [source])
+        # Estimasi HLL bisa sedikit di bawah jumlah join pada koleksi kecil
+        rate = min(joins / unique_users, 1.0) if unique_users else 0.0
+        rates.append((source or "None", joins, unique_users, rate))
+    return rates
+
+def get_group_reach(group_id: str) -> tuple:
+    """(perkiraan pengguna unik dari sketch HLL, total join) untuk detail koleksi (dijalankan di thread)."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    unique_users = estimate_unique_users(cursor, group_id)
+    cursor.execute('SELECT COALESCE(SUM(conversions), 0) FROM conversion_counts WHERE link_id = ?', (group_id,))
+    joins = cursor.fetchone()[0]
+    conn.close()
+    return unique_users, joins
+
+# --- Engagement Post Channel ---
+
+TOP_POSTS_LIMIT = 10
+
+def update_post_stats(cursor, link_id: str, chat_id: int, post_id: int, channel_username: str,
+                      user_id: int, ts: int):
+    """Tambahkan satu komentar ke agregat post (di dalam transaksi aktivitas)."""
+    # Komentator baru: sumber diambil dari klik terakhirnya pada koleksi ini
+    cursor.execute('''
+        INSERT OR IGNORE INTO post_commenters (link_id, chat_id, post_id, user_id, source_id)
+        VALUES (?, ?, ?, ?, (
+            SELECT source_id FROM clicks WHERE user_id = ? AND link_id = ? ORDER BY ts DESC LIMIT 1
+        ))
+    ''', (link_id, chat_id, post_id, user_id, user_id, link_id))
+    new_commenter = cursor.rowcount > 0
+    if not new_commenter:
+        cursor.execute('''
+            UPDATE post_commenters SET comments = comments + 1
+            WHERE link_id = ? AND chat_id = ? AND post_id = ? AND user_id = ?
+        ''', (link_id, chat_id, post_id, user_id))
+
+    cursor.execute('''
+        INSERT INTO post_stats
+            (link_id, chat_id, post_id, channel_username, comments, unique_commenters, first_comment_at, last_comment_at)
+        VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+        ON CONFLICT(link_id, chat_id, post_id) DO UPDATE SET
+            comments = comments + 1,
+            unique_commenters = unique_commenters + excluded.unique_commenters,
+            last_comment_at = excluded.last_comment_at,
+            channel_username = COALESCE(excluded.channel_username, channel_username)
+    ''', (link_id, chat_id, post_id, channel_username, int(new_commenter), ts, ts))
+
+def backfill_post_stats(cursor):
+    """Bangun post_stats & post_commenters dari activity_messages (migrasi satu kali)."""
+    cursor.execute('''
+        INSERT INTO post_commenters (link_id, chat_id, post_id, user_id, source_id, comments)
+        SELECT al.link_id, m.chat_id, m.post_id, m.user_id,
+               (SELECT c.source_id FROM clicks c
+                WHERE c.user_id = m.user_id AND c.link_id = al.link_id
+                ORDER BY c.ts DESC LIMIT 1),
+               COUNT(*)
+        FROM activity_messages m
+        JOIN activity_links al ON al.activity_id = m.id
+        WHERE m.post_id IS NOT NULL
+        GROUP BY al.link_id, m.chat_id, m.post_id, m.user_id
+    ''')
+    cursor.execute('''
+        INSERT INTO post_stats
+            (link_id, chat_id, post_id, comments, unique_commenters, first_comment_at, last_comment_at)
+        SELECT al.link_id, m.chat_id, m.post_id, COUNT(*), COUNT(DISTINCT m.user_id),
+               MIN(CAST(strftime('%s', m.timestamp) AS INTEGER)),
+               MAX(CAST(strftime('%s', m.timestamp) AS INTEGER))
+        FROM activity_messages m
+        JOIN activity_links al ON al.activity_id = m.id
+        WHERE m.post_id IS NOT NULL
+        GROUP BY al.link_id, m.chat_id, m.post_id
+    ''')
+
+def get_top_posts(link_id: str, limit: int = TOP_POSTS_LIMIT) -> list:
+    """Post dengan komentar terbanyak untuk satu koleksi, langsung dari post_stats."""
+    conn = connect_analytics()
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT chat_id, post_id, channel_username, comments, unique_commenters,
+               first_comment_at, last_comment_at
+        FROM post_stats
+        WHERE link_id = ?
+        ORDER BY comments DESC
+        LIMIT ?
+    ''', (link_id, limit))
+    posts = [dict(row) for row in cursor.fetchall()]
+
+    # Sumber atribusi teratas per post (hanya untuk post yang ditampilkan)
+    for post in posts:
+        cursor.execute('''
+            SELECT s.sumber, SUM(pc.comments) AS total
+            FROM post_commenters pc
+            LEFT JOIN sources s ON s.source_id = pc.source_id
+            WHERE pc.link_id = ? AND pc.chat_id = ? AND pc.post_id = ?
+            GROUP BY pc.source_id
+            ORDER BY total DESC
+            LIMIT 1
+        ''', (link_id, post['chat_id'], post['post_id']))
+        row = cursor.fetchone()
+        post['top_source'] = (row['sumber'] or "None") if row else "None"
+
+    conn.close()
+    return posts
+
+# --- Pencarian Aktivitas (FTS5) ---
+
+SEARCH_PAGE_SIZE = 10
+
+# Query /search terakhir per user (dipakai ulang oleh tombol koleksi & halaman berikutnya)
+search_queries = {}
+
+def index_activity_text(cursor, activity_id: int, message_text: str):
+    """Tambahkan teks pesan ke indeks FTS (di dalam transaksi aktivitas)."""
+    if message_text:
+        cursor.execute('INSERT INTO activity_fts (rowid, message_text) VALUES (?, ?)', (activity_id, message_text))
+
+def delete_activity_messages(cursor, where: str, params) -> int:
+    """Hapus activity_messages yang cocok dengan `where` beserta entri indeks FTS-nya.
+
+    Indeks external content butuh teks lama untuk menghapus entri, jadi indeks dibersihkan lebih dulu.
+    """
+    cursor.execute(f'''
+        INSERT INTO activity_fts (activity_fts, rowid, message_text)
+        SELECT 'delete', id, message_text FROM activity_messages
+        WHERE ({where}) AND message_text IS NOT NULL
+    ''', params)
+    cursor.execute(f'DELETE FROM activity_messages WHERE {where}', params)
+    return cursor.rowcount
+
+def fts_query(text: str) -> str:
+    """Ubah input user menjadi query FTS5 yang aman: tiap kata jadi frasa (AND), akhiran * = prefix."""
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+def search_activity(link_id: str, owner_code: str, query: str, before_id: int = 0,
+                    limit: int = SEARCH_PAGE_SIZE) -> list:
+    """Pesan teratribusi ke koleksi yang cocok dengan query, terbaru dulu (keyset: id < before_id)."""
+    conn = connect_analytics()
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT m.id, m.user_id, m.username, m.chat_title, m.chat_username, m.post_id, m.timestamp,
+               snippet(activity_fts, 0, '**', '**', '…', 16) AS snippet
+        FROM activity_fts
+        JOIN activity_messages m ON m.id = activity_fts.rowid
+        WHERE activity_fts MATCH ? AND activity_fts.rowid < ?
+          AND EXISTS (
+              SELECT 1 FROM activity_links al
+              WHERE al.activity_id = activity_fts.rowid AND (al.link_id = ? OR al.owner_code = ?)
+          )
+        ORDER BY activity_fts.rowid DESC
+        LIMIT ?
+    ''', (query, before_id or 1 << 62, link_id, owner_code, limit))
+    results = [dict(row) for row in cursor.fetchall()]
+
+    conn.close()
+    return results
+
+# --- Penghapusan Latar Belakang (Tombstone, Reaper & GC) ---
+
+# Tabel turunan per link/koleksi: (tabel, kolom link, kunci baris untuk DELETE bertahap)
+REAP_TABLES = [
+    ('clicks', 'link_id', 'rowid'),
+    ('click_rollup', 'link_id', 'link_id, hour, source_id, language_code'),
+    ('conversions', 'link_id', 'rowid'),
+    ('conversion_counts', 'link_id', 'link_id, source_id'),
+    ('post_commenters', 'link_id', 'link_id, chat_id, post_id, user_id'),
+    ('post_stats', 'link_id', 'link_id, chat_id, post_id'),
+    ('hll_sketches', 'link_id', 'link_id, sumber, day'),
+    ('heavy_hitters', 'link_id', 'rowid'),
+    ('export_cache', 'group_id', 'rowid'),
+    ('link_items', 'group_id', 'rowid'),
+    ('link_group_targets', 'group_id', 'rowid'),
+]
+
+reaper_wakeup = asyncio.Event()
+
+def get_tombstoned_ids() -> list:
+    """Daftar link_id / group_id yang sudah ditandai dihapus."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT group_id FROM link_groups WHERE deleted_at IS NOT NULL
+        UNION ALL
+        SELECT link_id FROM links WHERE deleted_at IS NOT NULL
+    ''')
+    ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return ids
+
+def reap_step(link_id: str) -> int:
+    """Hapus satu batch kecil data milik link_id dalam satu transaksi singkat.
+
+    Jika tidak ada lagi data turunan, baris induk yang di-tombstone ikut dihapus.
+    Mengembalikan jumlah baris yang dihapus (0 = selesai).
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    deleted = 0
+
+    # Aktivitas: pesan hanya dihapus jika tidak diatribusikan ke link lain
+    cursor.execute('SELECT activity_id FROM activity_links WHERE link_id = ? LIMIT ?', (link_id, REAPER_BATCH_SIZE))
+    activity_ids = [row[0] for row in cursor.fetchall()]
+    if activity_ids:
+        placeholders = ','.join('?' for _ in activity_ids)
+        cursor.execute(
+            f'DELETE FROM activity_links WHERE link_id = ? AND activity_id IN ({placeholders})',
+            [link_id] + activity_ids
+        )
+        deleted += cursor.rowcount
+        deleted += delete_activity_messages(
+            cursor,
+            f'id IN ({placeholders}) AND NOT EXISTS '
+            '(SELECT 1 FROM activity_links al WHERE al.activity_id = activity_messages.id)',
+            activity_ids
+        )
+    else:
+        for table, column, key in REAP_TABLES:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE ({key}) IN (SELECT {key} FROM {table} WHERE {column} = ? LIMIT ?)',
+                (link_id, REAPER_BATCH_SIZE)
+            )
+            deleted += cursor.rowcount
+            if deleted:
+                break
+
+    if not deleted:
+        cursor.execute('DELETE FROM link_groups WHERE group_id = ? AND deleted_at IS NOT NULL', (link_id,))
+        cursor.execute('DELETE FROM links WHERE link_id = ? AND deleted_at IS NOT NULL', (link_id,))
+
+    conn.commit()
+    conn.close()
+    return deleted
+
+async def reap_link_data(link_id: str) -> int:
+    """Hapus seluruh data link_id batch demi batch, memberi jeda agar penulis lain dapat lock."""
+    loop = asyncio.get_running_loop()
+    total = 0
+    while True:
+        deleted = await loop.run_in_executor(None, reap_step, link_id)
+        if not deleted:
+            return total
+        total += deleted
+        await asyncio.sleep(REAPER_PAUSE)
+
+async def reaper_loop():
+    """Proses tombstone secara berkala (atau segera setelah ada penghapusan baru)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await asyncio.wait_for(reaper_wakeup.wait(), REAPER_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        reaper_wakeup.clear()
+        try:
+            for link_id in await loop.run_in_executor(None, get_tombstoned_ids):
+                total = await reap_link_data(link_id)
+                print(f"Reaper: removed {link_id} ({total} rows)")
+        except Exception as e:
+            print(f"Error in reaper: {e}")
+
+def find_orphan_link_ids() -> set:
+    """link_id di tabel turunan yang induknya (link_groups / links) sudah tidak ada."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT group_id FROM link_groups UNION SELECT link_id FROM links')
+    live = {row[0] for row in cursor.fetchall()}
+
+    orphans = set()
+    for table, column, _ in REAP_TABLES + [('activity_links', 'link_id', None)]:
+        cursor.execute(f'SELECT DISTINCT {column} FROM {table}')
+        orphans.update(row[0] for row in cursor.fetchall() if row[0] not in live)
+    conn.close()
+    return orphans
+
+def delete_orphan_messages(after_id: int):
+    """Hapus activity_messages tanpa atribusi dalam satu jendela id.
+
+    Mengembalikan (jumlah terhapus, id terakhir yang diperiksa atau None jika selesai).
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM activity_messages WHERE id > ? ORDER BY id LIMIT ?', (after_id, REAPER_BATCH_SIZE))
+    ids = [row[0] for row in cursor.fetchall()]
+    if not ids:
+        conn.close()
+        return 0, None
+
+    deleted = delete_activity_messages(
+        cursor,
+        'id BETWEEN ? AND ? AND NOT EXISTS '
+        '(SELECT 1 FROM activity_links al WHERE al.activity_id = activity_messages.id)',
+        (ids[0], ids[-1])
+    )
+    conn.commit()
+    conn.close()
+    return deleted, ids[-1]
+
+def incremental_vacuum_step() -> int:
+    """Kembalikan sebagian halaman bebas ke sistem file. Mengembalikan sisa halaman bebas setelah langkah."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    # executescript menjalankan pragma sampai selesai; execute() hanya membebaskan satu halaman
+    cursor.executescript(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})')
+    cursor.execute('PRAGMA freelist_count')
+    free_pages = cursor.fetchone()[0]
+    conn.close()
+    return free_pages
+
+async def run_gc():
+    """Hapus data orphan lalu jalankan incremental vacuum, semuanya bertahap."""
+    loop = asyncio.get_running_loop()
+
+    removed = 0
+    for link_id in await loop.run_in_executor(None, find_orphan_link_ids):
+        removed += await reap_link_data(link_id)
+
+    after_id = 0
+    while after_id is not None:
+        deleted, after_id = await loop.run_in_executor(None, delete_orphan_messages, after_id)
+        removed += deleted
+        await asyncio.sleep(REAPER_PAUSE)
+
+    # Berhenti jika freelist tidak lagi berkurang (mis. auto_vacuum belum aktif)
+    free_pages = None
+    while True:
+        remaining = await loop.run_in_executor(None, incremental_vacuum_step)
+        if not remaining or (free_pages is not None and remaining >= free_pages):
+            break
+        free_pages = remaining
+        await asyncio.sleep(REAPER_PAUSE)
+
+    print(f"GC: removed {removed} orphan rows")
+
+async def gc_loop():
+    """Jalankan GC orphan secara berkala."""
+    while True:
+        await asyncio.sleep(GC_INTERVAL)
+        try:
+            await run_gc()
+        except Exception as e:
+            print(f"Error in GC: {e}")
+
+# --- Antrean Monitoring Pasif (Prioritas Rendah) ---
+#
+# Pesan grup datang dalam volume besar dan tidak ada yang menunggu balasannya, jadi handler
+# hanya memasukkannya ke antrean terbatas. Worker di event loop hanya menyerahkan pesan satu per
+# satu ke thread pasif khusus yang menjalankan transaksi SQLite-nya, sehingga klik, perintah dan
+# callback pengguna tidak pernah mengantre di belakang penulisan monitoring, dan penulisan pasif
+# tidak memakai thread default executor (jurnal klik, snapshot, heavy hitters). Saat backlog
+# melewati ambang, pesan tanpa teks dibuang dan pelacakan users/members di-sampling; saat antrean
+# penuh, pesan dibuang.
+
+passive_queue = asyncio.Queue(maxsize=PASSIVE_QUEUE_SIZE)
+passive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="passive")
+passive_connection = None  # ((DB_PATH, DATA_DB_PATH), koneksi) milik thread pasif
+passive_stats = {
+    'received': 0,      # pesan grup yang masuk ke handler
+    'processed': 0,     # selesai diproses worker
+    'sampled': 0,       # diproses tanpa pelacakan users/members (backlog di atas ambang)
+    'shed': 0,          # pesan tanpa teks dibuang (backlog di atas ambang)
+    'dropped': 0,       # dibuang karena antrean penuh
+    'busy': 0,          # percobaan yang tidak mendapat lock tulis dalam PASSIVE_DB_TIMEOUT (dicoba ulang)
+    'busy_dropped': 0,  # dibuang setelah PASSIVE_BUSY_RETRIES percobaan ulang gagal mendapat lock
+    'errors': 0,
+}
+
+def enqueue_passive_message(message: Message) -> bool:
+    """Masukkan pesan grup ke antrean pasif; False jika pesan di-shed atau dibuang."""
+    passive_stats['received'] += 1
+    text = message.text or message.caption
+    track_members = True
+
+    if passive_queue.qsize() >= PASSIVE_SHED_THRESHOLD:
+        # Pesan tanpa teks hanya berguna untuk pelacakan member
+        if not text:
+            passive_stats['shed'] += 1
+            return False
+        track_members = passive_stats['received'] % PASSIVE_SAMPLE_RATE == 0
+        if not track_members:
+            passive_stats['sampled'] += 1
+
+    # Cek apakah ini komentar dia sendiri (reply to message)
+    # Biasanya di discussion group, message adalah reply ke channel post.
+    post_id = None
+    channel_username = None
+    reply = message.reply_to_message
+    if reply and reply.forward_from_message_id:
+        post_id = reply.forward_from_message_id
+        if reply.forward_from_chat:
+            channel_username = reply.forward_from_chat.username
+
+    # Simpan field yang dibutuhkan saja, bukan seluruh Message (beserta reply_to_message)
+    try:
+        passive_queue.put_nowait((message.chat, message.from_user, text, message.id,
+                                  post_id, channel_username, track_members))
+    except asyncio.QueueFull:
+        passive_stats['dropped'] += 1
+        return False
+    return True
+
+def get_passive_connection():
+    """Koneksi ter-ATTACH milik thread pasif, dibuka sekali dan dipakai ulang (hanya dari thread pasif).
+
+    Membuka, ATTACH dan menutup koneksi per pesan memakan ~2/3 waktu pesan (koneksi terakhir
+    yang ditutup ikut checkpoint WAL). Dibuka ulang jika path database berubah.
+    """
+    global passive_connection
+    paths = (DB_PATH, DATA_DB_PATH)
+    if passive_connection is None or passive_connection[0] != paths:
+        close_passive_connection()
+        passive_connection = (paths, connect_unified(timeout=PASSIVE_DB_TIMEOUT))
+    return passive_connection[1]
+
+def close_passive_connection():
+    """Tutup koneksi thread pasif (dijalankan di thread pasif saat shutdown)."""
+    global passive_connection
+    if passive_connection is not None:
+        passive_connection[1].close()
+        passive_connection = None
+
+def record_group_message(chat, user, text: str, message_id: int, post_id: int,
+                         channel_username: str, track_members: bool = True) -> tuple:
+    """Tulis member & aktivitas satu pesan grup (dijalankan di thread pasif).
+
+    Mengembalikan (link yang dilacak, id aktivitas) untuk heavy hitters.
+
+    Semua baca/tulis ke link_tracker.db dan data.db memakai koneksi ter-ATTACH milik thread pasif
+    dengan busy timeout PASSIVE_DB_TIMEOUT dan satu transaksi per pesan.
+    """
+    chat_id = chat.id
+    chat_username = chat.username
+    tracked_links = []
+    activity_id = None
+
+    conn = get_passive_connection()
+    try:
+        cursor = conn.cursor()
+        # Kunci tulis kedua database sejak awal: baca lalu tulis tanpa risiko snapshot basi
+        cursor.execute('BEGIN IMMEDIATE')
+
+        if track_members:
+            # Passive tracking: user, group info & member info
+            save_user_to_db(cursor, user)
+            save_group_to_db(cursor, chat)
+            save_member_to_db(cursor, chat_id, user)
+
+        # Activity logging hanya untuk pesan teks di chat yang bisa dicocokkan ke link
+        if text and (chat_username or chat_id):
+            # Get tracked links for this user in this chat
+            tracked_links = get_user_tracked_links(conn, user.id, chat_username, chat_id)
+            if tracked_links:
+                # Pesan disimpan sekali, diatribusikan ke semua link yang dilacak
+                activity_id = log_user_activity(
+                    cursor,
+                    user_id=user.id,
+                    username=user.username or "",
+                    chat_id=chat_id,
+                    chat_title=chat.title or "",
+                    chat_username=chat_username,
+                    links=tracked_links,
+                    message_text=text,
+                    message_id=message_id,
+                    post_id=post_id,
+                    channel_username=channel_username
+                )
+
+        conn.commit()
+    except BaseException:
+        # Koneksi dipakai ulang: jangan tinggalkan transaksi yang setengah jalan
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return tracked_links, activity_id
+
+async def process_group_message(chat, user, text: str, message_id: int, post_id: int,
+                                channel_username: str, track_members: bool = True):
+    """Lacak member & catat aktivitas satu pesan grup (dipanggil worker pasif).
+
+    Transaksi SQLite berjalan di thread pasif (lihat record_group_message); event loop hanya
+    menunggu hasilnya lalu memperbarui heavy hitters.
+    """
+    # Skip if no user
+    if not user:
+        return
+
+    loop = asyncio.get_running_loop()
+    record = functools.partial(record_group_message, chat, user, text, message_id, post_id,
+                               channel_username, track_members)
+    for attempt in range(PASSIVE_BUSY_RETRIES + 1):
+        if attempt:
+            # Penulis lain (jurnal klik, reaper, backup) memegang lock: mundur lalu coba lagi.
+            # Antrean di belakangnya tetap terkendali oleh sampling/shedding enqueue_passive_message.
+            await asyncio.sleep(PASSIVE_BUSY_BACKOFF * 2 ** (attempt - 1))
+        try:
+            tracked_links, activity_id = await loop.run_in_executor(passive_executor, record)
+            break
+        except sqlite3.OperationalError as e:
+            if e.sqlite_errorcode != sqlite3.SQLITE_BUSY:
+                raise
+            passive_stats['busy'] += 1
+    else:
+        passive_stats['busy_dropped'] += 1
+        print(f"Dropped group message {message_id} in {chat.id}: database busy after "
+              f"{PASSIVE_BUSY_RETRIES} retries")
+        return
+
+    for link in tracked_links:
+        count_heavy_hitter(link.link_id, 'user', str(user.id), 1, activity_id)
+
+async def passive_worker():
+    """Serahkan pesan dari antrean monitoring pasif ke thread pasif, satu per satu."""
+    while True:
+        item = await passive_queue.get()
+        try:
+            await process_group_message(*item)
+        except Exception as e:
+            passive_stats['errors'] += 1
+            print(f"Error monitoring group activity: {e}")
+        passive_stats['processed'] += 1
+
+async def drain_passive_queue():
+    """Proses sisa antrean pasif lalu tutup koneksi thread pasif (saat shutdown)."""
+    while not passive_queue.empty():
+        try:
+            await process_group_message(*passive_queue.get_nowait())
+        except Exception as e:
+            passive_stats['errors'] += 1
+            print(f"Error monitoring group activity: {e}")
+        passive_stats['processed'] += 1
+    await asyncio.get_running_loop().run_in_executor(passive_executor, close_passive_connection)
+
+# --- Sesi & Pemanasan Peer ---
+
+startup_started = None      # time.monotonic() saat main() mulai
+first_update_logged = False
+
+def get_known_peers():
+    """Chat id & username yang akan di-resolve handler: target koleksi/link aktif dan grup di data.db."""
+    chat_ids = set()
+    usernames = set()
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT t.chat_id, t.chat_username, t.username_target
+        FROM link_group_targets t
+        JOIN link_groups g ON g.group_id = t.group_id
+        WHERE g.deleted_at IS NULL
+        UNION
+        SELECT group_id, group_username, username_target FROM links WHERE deleted_at IS NULL
+    ''')
+    for chat_id, chat_username, username_target in cursor.fetchall():
+        if chat_id:
+            chat_ids.add(chat_id)
+        for name in (chat_username, username_target):
+            if name:
+                usernames.add(name.lstrip('@').lower())
+    conn.close()
+
+    conn = sqlite3.connect(DATA_DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT chat_id FROM groups')
+    chat_ids.update(row[0] for row in cursor.fetchall())
+    conn.close()
+
+    return chat_ids, usernames
+
+async def warm_up_peers(client: Client):
+    """Isi cache peer sesi dengan chat yang sudah dikenal agar handler tidak perlu resolve ulang.
+
+    Peer yang sudah ada di file sesi dilewati; sisanya diambil sekaligus per PEER_WARMUP_BATCH
+    lewat GetChannels/GetChats (access_hash 0 berlaku untuk bot). Username yang belum ada
+    atau kedaluwarsa di-resolve satu per satu dengan jeda, dan berhenti saat kena FloodWait.
+    """
+    started = time.monotonic()
+    chat_ids, usernames = await asyncio.get_running_loop().run_in_executor(None, get_known_peers)
+
+    missing_channels, missing_chats = [], []
+    for chat_id in chat_ids:
+        try:
+            await client.storage.get_peer_by_id(chat_id)
+            continue
+        except KeyError:
+            pass
+        try:
+            peer_type = utils.get_peer_type(chat_id)
+        except ValueError:
+            continue
+        if peer_type == "channel":
+            missing_channels.append(chat_id)
+        elif peer_type == "chat":
+            missing_chats.append(chat_id)
+
+    fetched = 0
+    requests = [
+        raw.functions.channels.GetChannels(id=[
+            raw.types.InputChannel(channel_id=utils.get_channel_id(chat_id), access_hash=0)
+            for chat_id in missing_channels[i:i + PEER_WARMUP_BATCH]
+        ])
+        for i in range(0, len(missing_channels), PEER_WARMUP_BATCH)
+    ] + [
+        raw.functions.messages.GetChats(id=[-chat_id for chat_id in missing_chats[i:i + PEER_WARMUP_BATCH]])
+        for i in range(0, len(missing_chats), PEER_WARMUP_BATCH)
+    ]
+    for request in requests:
+        try:
+            # invoke() menyimpan chat hasilnya ke storage sesi
+            result = await client.invoke(request)
+            fetched += len(result.chats)
+        except FloodWait as e:
+            print(f"Peer warm-up stopped by FloodWait ({e.value}s)")
+            break
+        except RPCError as e:
+            print(f"Peer warm-up batch failed: {e}")
+
+    resolved = 0
+    for username in usernames:
+        try:
+            await client.storage.get_peer_by_username(username)
+            continue
+        except KeyError:
+            pass
+        try:
+            await client.resolve_peer(username)
+            resolved += 1
+        except FloodWait as e:
+            print(f"Peer warm-up stopped by FloodWait ({e.value}s)")
+            break
+        except (RPCError, KeyError):
+            pass
+        await asyncio.sleep(PEER_WARMUP_PAUSE)
+
+    print(f"Peer warm-up: {len(chat_ids)} chats / {len(usernames)} usernames known, "
+          f"{fetched} chats fetched, {resolved} usernames resolved in {time.monotonic() - started:.1f}s")
+
+# --- Snapshot Analitik ---
+
+def connect_analytics():
+    """Koneksi read-only ke snapshot analitik; fallback ke DB live jika snapshot belum ada."""
+    if SNAPSHOT_INTERVAL > 0 and os.path.exists(ANALYTICS_DB_PATH):
+        return sqlite3.connect(f"{Path(ANALYTICS_DB_PATH).resolve().as_uri()}?mode=ro", uri=True)
+    return sqlite3.connect(DB_PATH)
+
+def copy_database_snapshot(source_path: str, target_path: str, step_pages: int) -> float:
+    """Salin DB live ke `target_path` memakai online backup API; kembalikan waktu snapshot diambil.
+
+    Backup berjalan bertahap (`step_pages` halaman per langkah) di dalam satu transaksi
+    baca WAL, jadi hasilnya konsisten tanpa memblokir penulisan klik. Salinan tidak di-fsync
+    (pemanggil yang butuh durabilitas melakukannya); halaman yang sudah ditulis langsung
+    dikirim ke disk setiap langkah, karena fsync WAL penulis di ext4 (data=ordered) ikut
+    menunggu semua halaman kotor salinan dan tertahan ~100 ms per 200 MB.
+    """
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    target_fd = None
+
+    def write_back(status, remaining, total):
+        nonlocal target_fd
+        if target_fd is None:
+            target_fd = os.open(target_path, os.O_RDONLY)
+        os.posix_fadvise(target_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+    try:
+        target.execute('PRAGMA synchronous=OFF')
+        # Kunci snapshot WAL: perubahan dari koneksi lain tidak me-restart backup
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        taken_at = time.time()
+        source.backup(target, pages=step_pages, progress=write_back if hasattr(os, 'posix_fadvise') else None)
+        source.execute('COMMIT')
+
+        # Salinan berdiri sendiri (satu file, bisa dibuka read-only), jadi jangan tinggalkan mode WAL
+        target.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        source.close()
+        target.close()
+        if target_fd is not None:
+            os.close(target_fd)
+    return taken_at
+
+# database_signature DB live saat snapshot terakhir diambil
+snapshot_signature = None
+
+def refresh_analytics_snapshot() -> bool:
+    """Bangun ulang snapshot analitik dari DB live (lihat copy_database_snapshot).
+
+    Salinan selalu penuh (backup API tidak punya mode inkremental), jadi jika DB live tidak
+    berubah sejak snapshot terakhir, hanya mtime snapshot yang diperbarui. Return True jika disalin.
+    """
+    global snapshot_signature
+    signature = database_signature(DB_PATH)
+    if signature == snapshot_signature and os.path.exists(ANALYTICS_DB_PATH):
+        os.utime(ANALYTICS_DB_PATH)
+        return False
+
+    tmp_path = f"{ANALYTICS_DB_PATH}.tmp"
+    taken_at = copy_database_snapshot(DB_PATH, tmp_path, SNAPSHOT_STEP_PAGES)
+
+    # mtime snapshot = waktu data diambil (dipakai sebagai indikator kesegaran)
+    os.utime(tmp_path, (taken_at, taken_at))
+    os.replace(tmp_path, ANALYTICS_DB_PATH)
+    snapshot_signature = signature
+    return True
+
+def analytics_freshness() -> str:
+    """Teks indikator kesegaran data export untuk caption (dirender saat kirim, tidak disimpan di cache)."""
+    if SNAPSHOT_INTERVAL <= 0 or not os.path.exists(ANALYTICS_DB_PATH):
+        return "🕒 Data: live"
+    taken_at = datetime.fromtimestamp(os.path.getmtime(ANALYTICS_DB_PATH))
+    age_min = int((datetime.now() - taken_at).total_seconds() // 60)
+    return f"🕒 Data as of {taken_at.strftime('%Y-%m-%d %H:%M')} ({age_min} min ago)"
+
+# Task refresh yang sedang berjalan: loop berkala dan pembaca yang menemukan snapshot basi berbagi satu salinan
+snapshot_refresh = None
+
+async def run_snapshot_refresh():
+    """Refresh snapshot di thread; kegagalan dicetak (pembaca tetap memakai snapshot lama)."""
+    global snapshot_refresh
+    try:
+        started = time.perf_counter()
+        if await asyncio.get_running_loop().run_in_executor(None, refresh_analytics_snapshot):
+            print(f"Analytics snapshot refreshed in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"Error refreshing analytics snapshot: {e}")
+    finally:
+        snapshot_refresh = None
+
+async def refresh_snapshot_once():
+    """Jalankan refresh snapshot, atau tunggu refresh yang sedang berjalan."""
+    global snapshot_refresh
+    if snapshot_refresh is None:
+        snapshot_refresh = asyncio.get_running_loop().create_task(run_snapshot_refresh())
+    # shield: handler yang dibatalkan tidak membatalkan salinan yang ditunggu pembaca lain
+    await asyncio.shield(snapshot_refresh)
+
+async def ensure_fresh_snapshot():
+    """Dipanggil handler interaktif sebelum membaca snapshot: refresh jika lebih tua dari SNAPSHOT_MAX_AGE."""
+    if SNAPSHOT_INTERVAL <= 0 or SNAPSHOT_MAX_AGE <= 0:
+        return
+    try:
+        age = time.time() - os.path.getmtime(ANALYTICS_DB_PATH)
+    except OSError:
+        # Belum ada snapshot: connect_analytics membaca DB live
+        return
+    if age > SNAPSHOT_MAX_AGE:
+        await refresh_snapshot_once()
+
+async def analytics_snapshot_loop():
+    """Perbarui snapshot analitik secara berkala di thread terpisah."""
+    while True:
+        await refresh_snapshot_once()
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+# --- Backup & Restore ---
+#
+# Setiap BACKUP_INTERVAL detik kedua database disalin dengan copy_database_snapshot ke BACKUP_DIR
+# sebagai generasi baru `<nama db>.<YYYYmmdd-HHMMSS>.bak` (di-fsync lalu rename atomik), BACKUP_KEEP
+# generasi terakhir disimpan. Database yang file db/-wal-nya tidak berubah sejak backup terakhir dilewati.
+# Saat startup, database yang hilang dipulihkan dari generasi terbaru yang lolos quick_check.
+
+# db_path -> tanda (ukuran, mtime) file db & -wal saat backup terakhir
+backup_signatures = {}
+backup_stats = {'backups': 0, 'skipped': 0, 'errors': 0}
+
+def database_signature(db_path: str) -> tuple:
+    """Ukuran & mtime file db dan -wal; berubah setiap ada commit (atau checkpoint)."""
+    signature = []
+    for path in (db_path, f"{db_path}-wal"):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def fsync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def list_backups(db_path: str) -> list:
+    """Path generasi backup untuk database ini, terbaru lebih dulu."""
+    prefix = f"{os.path.basename(db_path)}."
+    try:
+        names = os.listdir(BACKUP_DIR)
+    except FileNotFoundError:
+        return []
+    names = [name for name in names if name.startswith(prefix) and name.endswith('.bak')]
+    # Nama memuat stempel waktu yang bisa diurutkan secara leksikal
+    return [os.path.join(BACKUP_DIR, name) for name in sorted(names, reverse=True)]
+
+def backup_database(db_path: str, force: bool = False) -> str:
+    """Buat generasi backup baru; None jika database tidak berubah sejak backup terakhir."""
+    signature = database_signature(db_path)
+    if not force and backup_signatures.get(db_path) == signature:
+        return None
+
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = os.path.basename(db_path)
+    tmp_path = os.path.join(BACKUP_DIR, f"{name}.tmp")
+    # Generasi tertua ditimpa di tempat (selama masih ada generasi utuh lain): menghapus file
+    # ratusan MB di ext4 menahan fsync penulis puluhan ms, menimpa bloknya tidak
+    backups = list_backups(db_path)
+    if len(backups) >= max(BACKUP_KEEP, 2):
+        os.replace(backups[-1], tmp_path)
+    taken_at = copy_database_snapshot(db_path, tmp_path, BACKUP_STEP_PAGES)
+    fsync_path(tmp_path)
+
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(taken_at))
+    backup_path = os.path.join(BACKUP_DIR, f"{name}.{stamp}.bak")
+    os.replace(tmp_path, backup_path)
+    fsync_path(BACKUP_DIR)
+    backup_signatures[db_path] = signature
+
+    for old_path in list_backups(db_path)[max(BACKUP_KEEP, 1):]:
+        os.remove(old_path)
+    return backup_path
+
+def backup_databases(force: bool = False):
+    """Backup link_tracker.db dan data.db (dipanggil di thread terpisah atau dari command `backup`)."""
+    for db_path in (DB_PATH, DATA_DB_PATH):
+        try:
+            started = time.perf_counter()
+            backup_path = backup_database(db_path, force)
+            if backup_path is None:
+                backup_stats['skipped'] += 1
+                continue
+            backup_stats['backups'] += 1
+            print(f"Backed up {db_path} to {backup_path} in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            backup_stats['errors'] += 1
+            print(f"Error backing up {db_path}: {e}")
+
+def restore_database(db_path: str) -> str:
+    """Pulihkan `db_path` dari generasi backup terbaru yang utuh; None jika tidak ada.
+
+    Database yang masih ada dipindahkan ke `<db>.pre-restore`. File -wal/-shm lama dihapus
+    agar tidak diterapkan ke atas salinan backup.
+    """
+    for backup_path in list_backups(db_path):
+        conn = sqlite3.connect(f"{Path(backup_path).resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            ok = conn.execute('PRAGMA quick_check').fetchone()[0] == 'ok'
+        except sqlite3.DatabaseError:
+            ok = False
+        finally:
+            conn.close()
+        if not ok:
+            print(f"Skipping damaged backup {backup_path}")
+            continue
+
+        tmp_path = f"{db_path}.restore"
+        shutil.copyfile(backup_path, tmp_path)
+        fsync_path(tmp_path)
+        if os.path.exists(db_path):
+            os.replace(db_path, f"{db_path}.pre-restore")
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(f"{db_path}{suffix}"):
+                os.remove(f"{db_path}{suffix}")
+        os.replace(tmp_path, db_path)
+
+        # Salinan backup disimpan tanpa WAL; kembalikan mode DB live
+        conn = sqlite3.connect(db_path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.close()
+        return backup_path
+    return None
+
+def restore_missing_databases():
+    """Saat startup: pulihkan database yang file-nya tidak ada dari backup terbaru."""
+    for db_path in (DB_PATH, DATA_DB_PATH):
+        if os.path.exists(db_path):
+            continue
+        started = time.perf_counter()
+        backup_path = restore_database(db_path)
+        if backup_path:
+            print(f"Restored missing {db_path} from {backup_path} in {time.perf_counter() - started:.2f}s")
+
+async def backup_loop():
+    """Backup kedua database secara berkala di thread terpisah."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        await loop.run_in_executor(None, backup_databases)
+
+# --- Helper Functions untuk Export ---
+
+def iter_cursor_batches(cursor, size: int = EXPORT_BATCH_SIZE):
+    """Ambil hasil kueri per batch agar tidak memuat semua baris ke memori."""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield rows
+
+class ExportPartWriter:
+    """Tulis baris CSV ke file sementara (terkompresi), dipecah per EXPORT_PART_SIZE byte."""
+
+    EXTENSIONS = {'gzip': '.csv.gz', 'zip': '.zip', 'none': '.csv'}
+
+    def __init__(self, base_name: str, header: list, compression: str = EXPORT_COMPRESSION,
+                 part_size: int = EXPORT_PART_SIZE):
+        self.base_name = base_name
+        self.header = header
+        self.compression = compression if compression in self.EXTENSIONS else 'none'
+        self.part_size = part_size
+        self.row_count = 0
+        self._paths = []
+        self._raw = None
+        self._archive = None
+        self._stream = None
+        self._writer = None
+
+    def _open_part(self):
+        index = len(self._paths) + 1
+        self._raw = tempfile.NamedTemporaryFile(
+            prefix="export_", suffix=self.EXTENSIONS[self.compression], delete=False
+        )
+        self._paths.append(self._raw.name)
+
+        if self.compression == 'gzip':
+            binary = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+        elif self.compression == 'zip':
+            inner_name = f"{self.base_name}.csv" if index == 1 else f"{self.base_name}_part{index}.csv"
+            self._archive = zipfile.ZipFile(self._raw, 'w', compression=zipfile.ZIP_DEFLATED)
+            binary = self._archive.open(inner_name, 'w', force_zip64=True)
+        else:
+            binary = self._raw
+
+        self._stream = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+        self._writer = csv.writer(self._stream)
+        self._writer.writerow(self.header)
+
+    def _close_part(self):
+        if not self._stream:
+            return
+        self._stream.close()
+        if self._archive:
+            self._archive.close()
+            self._archive = None
+        self._raw.close()
+        self._raw = None
+        self._stream = None
+        self._writer = None
+
+    def write_rows(self, rows):
+        """Tulis satu batch baris, buka part baru jika part saat ini sudah penuh."""
+        if not self._stream:
+            self._open_part()
+        self._writer.writerows(rows)
+        self.row_count += len(rows)
+
+        # Ukuran dicek per batch dari posisi file terkompresi
+        if self._raw.tell() >= self.part_size:
+            self._close_part()
+
+    def close(self) -> list:
+        """Tutup part terakhir dan kembalikan daftar (path, file_name) setiap part."""
+        self._close_part()
+        total = len(self._paths)
+        ext = self.EXTENSIONS[self.compression]
+        parts = []
+        for i, path in enumerate(self._paths, 1):
+            suffix = f"_part{i}of{total}" if total > 1 else ""
+            parts.append((path, f"{self.base_name}{suffix}{ext}"))
+        return parts
+
+    def cleanup(self):
+        """Hapus semua file sementara."""
+        self._close_part()
+        for path in self._paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+class ParquetPartWriter:
+    """Tulis baris export ke file Parquet bertipe (via pyarrow), dipecah sebelum melewati EXPORT_PART_SIZE byte.
+
+    Setiap batch menjadi satu row group yang langsung ditulis ke sink milik writer, jadi posisi sink
+    adalah ukuran data yang benar-benar tertulis. Part baru dibuka sebelum batch berikutnya jika
+    row group terbesar sejauh ini ditambah perkiraan footer tidak lagi muat di part saat ini.
+    """
+
+    EXTENSION = '.parquet'
+    # Perkiraan (berlebih) metadata footer: dasar + per kolom per row group
+    FOOTER_BASE = 4096
+    FOOTER_PER_COLUMN_CHUNK = 256
+
+    def __init__(self, base_name: str, columns: list, part_size: int = EXPORT_PART_SIZE):
+        import pyarrow as pa
+
+        self._pa = pa
+        self.base_name = base_name
+        self.columns = columns
+        self.part_size = part_size
+        self.row_count = 0
+        self._paths = []
+        self._writer = None
+        self._sink = None
+        self._row_groups = 0      # row group di part saat ini
+        self._largest_group = 0   # byte row group terbesar sejauh ini (perkiraan batch berikutnya)
+
+        types = {'int': pa.int64(), 'str': pa.string(), 'timestamp': pa.timestamp('s')}
+        self.schema = pa.schema([
+            (name.lower().replace(' ', '_'), types[kind]) for name, kind in columns
+        ])
+
+    def _open_part(self):
+        import pyarrow.parquet as pq
+
+        fd, path = tempfile.mkstemp(prefix="export_", suffix=self.EXTENSION)
+        os.close(fd)
+        self._paths.append(path)
+        self._sink = self._pa.OSFile(path, 'wb')
+        self._writer = pq.ParquetWriter(self._sink, self.schema, compression='zstd')
+        self._row_groups = 0
+
+    def _close_part(self):
+        if self._writer:
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+            self._sink = None
+
+    def _footer_estimate(self, row_groups: int) -> int:
+        return self.FOOTER_BASE + row_groups * len(self.columns) * self.FOOTER_PER_COLUMN_CHUNK
+
+    def write_rows(self, rows):
+        """Tulis satu batch baris sebagai satu row group, di part baru jika part saat ini bisa kelebihan."""
+        import pyarrow.compute as pc
+
+        pa = self._pa
+        if self._writer and self._row_groups and (
+            self._sink.tell() + self._largest_group + self._footer_estimate(self._row_groups + 1) > self.part_size
+        ):
+            self._close_part()
+        if not self._writer:
+            self._open_part()
+
+        arrays = []
+        for (name, kind), values, field in zip(self.columns, zip(*rows), self.schema):
+            if kind == 'timestamp':
+                # Timestamp SQLite berupa teks 'YYYY-MM-DD HH:MM:SS'
+                arrays.append(pc.strptime(pa.array(values, pa.string()), format='%Y-%m-%d %H:%M:%S', unit='s'))
+            else:
+                arrays.append(pa.array(values, field.type))
+
+        written = self._sink.tell()
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self._largest_group = max(self._largest_group, self._sink.tell() - written)
+        self._row_groups += 1
+        self.row_count += len(rows)
+
+    def close(self) -> list:
+        """Tutup part terakhir dan kembalikan daftar (path, file_name) setiap part."""
+        self._close_part()
+        total = len(self._paths)
+        parts = []
+        for i, path in enumerate(self._paths, 1):
+            suffix = f"_part{i}of{total}" if total > 1 else ""
+            parts.append((path, f"{self.base_name}{suffix}{self.EXTENSION}"))
+        return parts
+
+    def cleanup(self):
+        """Hapus semua file sementara."""
+        self._close_part()
+        for path in self._paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# Kolom export beserta tipenya (dipakai untuk skema Parquet)
+CLICK_EXPORT_COLUMNS = [
+    ('User ID', 'int'), ('First Name', 'str'), ('Username', 'str'),
+    ('Language', 'str'), ('First Click', 'timestamp'), ('Activity Count', 'int')
+]
+ACTIVITY_EXPORT_COLUMNS = [
+    ('User ID', 'int'), ('Username', 'str'), ('Chat ID', 'int'), ('Chat Title', 'str'),
+    ('ID Post', 'int'), ('Timestamp', 'timestamp'), ('Message', 'str')
+]
+
+MEMBERS_EXPORT_COLUMNS = [
+    ('Chat ID', 'int'), ('User ID', 'int'), ('Username', 'str'), ('First Name', 'str'), ('Last Name', 'str'),
+    ('First Seen', 'timestamp'), ('Last Seen', 'timestamp'), ('Messages', 'int'),
+    ('Clicked', 'int'), ('First Click', 'timestamp'), ('Source', 'str'), ('Joined Via Link', 'int')
+]
+
+def open_export_writer(export_format: str, base_name: str, columns: list):
+    """Buat writer export sesuai format ('csv' atau 'parquet')."""
+    if export_format == 'parquet':
+        return ParquetPartWriter(base_name, columns)
+    return ExportPartWriter(base_name, [name for name, _ in columns])
+
+def parquet_available() -> bool:
+    """Cek apakah pyarrow terpasang untuk export Parquet."""
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def safe_export_name(export_name: str) -> str:
+    """Bersihkan nama koleksi untuk dipakai sebagai nama file."""
+    return "".join(x for x in export_name if x.isalnum() or x in ('_','-'))
+
+def build_click_export(doc_id: str, link_data: LinkGroup, export_format: str = 'csv', progress=None):
+    """Bangun file export klik (per pengguna unik + ringkasan) secara streaming.
+
+    `progress(rows)` dipanggil setiap batch. Mengembalikan (writer, summary_bytes)
+    atau (None, None) jika belum ada klik.
+    """
+    export_name = link_data.group_name
+
+    conn = connect_analytics()
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT COUNT(*) FROM clicks WHERE link_id = ?', (doc_id,))
+    total_clicks = cursor.fetchone()[0]
+
+    if total_clicks == 0:
+        conn.close()
+        return None, None
+
+    date_str = datetime.now().strftime("%Y%m%d")
+    safe_name = safe_export_name(export_name)
+
+    # 1. BUAT CSV/PARQUET (Pengguna Unik dengan Data Aktivitas)
+    # Menghapus 'Join Status' karena tidak relevan untuk grup
+    writer = open_export_writer(export_format, f"export_{safe_name}_{date_str}", CLICK_EXPORT_COLUMNS)
+
+    try:
+        # Pengguna unik beserta jumlah aktivitasnya dalam satu kueri
+        # Gunakan link_id (group_id) atau owner_code untuk mencocokkan aktivitas
+        cursor.execute('''
+            SELECT cs.user_id, p.first_name, p.username, p.language_code,
+                   datetime(cs.first_ts, 'unixepoch') as first_click,
+                   COALESCE(ua.act_count, 0) as act_count
+            FROM (
+                -- profile_id ikut baris dengan MIN(ts): profil saat klik pertama
+                SELECT user_id, profile_id, MIN(ts) as first_ts
+                FROM clicks
+                WHERE link_id = ?
+                GROUP BY user_id
+            ) cs
+            LEFT JOIN profiles p ON p.profile_id = cs.profile_id
+            LEFT JOIN (
+                SELECT m.user_id, COUNT(*) as act_count
+                FROM activity_messages m
+                WHERE m.id IN (
+                    SELECT activity_id FROM activity_links WHERE link_id = ? OR owner_code = ?
+                )
+                GROUP BY m.user_id
+            ) ua ON ua.user_id = cs.user_id
+            ORDER BY cs.first_ts DESC
+        ''', (doc_id, doc_id, link_data.owner_code))
+
+        for batch in iter_cursor_batches(cursor):
+            writer.write_rows([
+                (
+                    user['user_id'],
+                    user['first_name'],
+                    user['username'],
+                    user['language_code'],
+                    user['first_click'],
+                    user['act_count']
+                )
+                for user in batch
+            ])
+            if progress:
+                progress(writer.row_count)
+
+        # Hitung sumber lalu lintas; user unik per sumber diperkirakan dari sketch HLL
+        cursor.execute('''
+            SELECT s.sumber, COUNT(*) as total
+            FROM clicks c
+            LEFT JOIN sources s ON s.source_id = c.source_id
+            WHERE c.link_id = ?
+            GROUP BY c.source_id
+            ORDER BY s.sumber
+        ''', (doc_id,))
+        source_data = [
+            (row['sumber'] or "None", row['total'], estimate_unique_users(cursor, doc_id, [row['sumber']]))
+            for row in cursor.fetchall()
+        ]
+        conversion_data = get_conversion_rates(cursor, doc_id)
+    except Exception:
+        writer.cleanup()
+        raise
+    finally:
+        conn.close()
+
+    # 2. BUAT RINGKASAN (File Teks)
+    output_txt = io.StringIO()
+    output_txt.write(f"Export Report for: {export_name}\n")
+    output_txt.write(f"Generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+
+    output_txt.write(f"Total Clicks (All Time): {total_clicks}\n")
+    output_txt.write(f"Unique Users: {writer.row_count}\n\n")
+
+    output_txt.write("Traffic Sources (Total Clicks - Approx. Unique Users):\n")
+    for src, total, unique_users in source_data:
+        output_txt.write(f"- {src}: {total} (~{unique_users})\n")
+
+    if conversion_data:
+        output_txt.write("\nJoins by Source (Joins - Rate vs Approx. Unique Users):\n")
+        for src, joins, _, rate in conversion_data:
+            output_txt.write(f"- {src}: {joins} ({rate:.1%})\n")
+
+    return writer, output_txt.getvalue().encode('utf-8')
+
+def build_activity_export(doc_id: str, link_data: LinkGroup, target_chat_ids: set, export_format: str = 'csv',
+                          progress=None):
+    """Bangun file export aktivitas secara streaming dari cursor SQLite.
+
+    `progress(rows)` dipanggil setiap batch. Mengembalikan writer, atau None jika belum ada aktivitas.
+    """
+    export_name = link_data.group_name
+    owner_code = link_data.owner_code
+
+    conn = connect_analytics()
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    # Setiap pesan muncul sekali walau diatribusikan ke beberapa koleksi
+    if not target_chat_ids:
+        # Fallback jika tidak ada id yang berhasil di-resolve
+        cursor.execute('''
+            SELECT user_id, username, chat_id, chat_title, chat_username,
+                   message_text, message_id, timestamp, post_id
+            FROM activity_messages
+            WHERE id IN (SELECT activity_id FROM activity_links WHERE link_id = ?)
+            ORDER BY timestamp DESC
+        ''', (doc_id,))
+    else:
+        # Query Dinamis menggunakan IN clause
+        ids_list = list(target_chat_ids)
+        placeholders = ','.join('?' for _ in ids_list)
+
+        # Logika Kueri:
+        # - Cocokkan link_id
+        # - ATAU Cocokkan owner_code DAN chat_id ada di target (aktivitas terdeteksi di grup relevan)
+        sql = f'''
+            SELECT user_id, username, chat_id, chat_title, chat_username,
+                   message_text, message_id, timestamp, post_id
+            FROM activity_messages
+            WHERE id IN (SELECT activity_id FROM activity_links WHERE link_id = ?)
+               OR (chat_id IN ({placeholders})
+                   AND id IN (SELECT activity_id FROM activity_links WHERE owner_code = ?))
+            ORDER BY timestamp DESC
+        '''
+        params = [doc_id] + ids_list + [owner_code]
+        cursor.execute(sql, params)
+
+    writer = open_export_writer(export_format, f"activity_{safe_export_name(export_name)}", ACTIVITY_EXPORT_COLUMNS)
+
+    try:
+        for batch in iter_cursor_batches(cursor):
+            writer.write_rows([
+                (
+                    activity['user_id'],
+                    activity['username'],
+                    activity['chat_id'],
+                    activity['chat_title'],
+                    activity['post_id'],
+                    activity['timestamp'],
+                    # Potong pesan untuk pratinjau
+                    activity['message_text'][:200] if activity['message_text'] else ""
+                )
+                for activity in batch
+            ])
+            if progress:
+                progress(writer.row_count)
+    except Exception:
+        writer.cleanup()
+        raise
+    finally:
+        conn.close()
+
+    if writer.row_count == 0:
+        writer.cleanup()
+        return None
+    return writer
+
+def get_target_chat_ids(group_id: str) -> list:
+    """Chat id target koleksi yang sudah di-resolve (link_group_targets)."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT DISTINCT chat_id FROM link_group_targets WHERE group_id = ? AND chat_id IS NOT NULL',
+        (group_id,)
+    )
+    chat_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return chat_ids
+
+# Anggota satu chat beserta klik pertama ke koleksi (sumbernya) dan join lewat link, satu statement:
+# members di data.db, clicks/sources/conversions di link_tracker.db (koneksi connect_unified)
+MEMBERS_PAGE_QUERY = '''
+    SELECT m.user_id, m.username, m.first_name, m.last_name, m.first_seen, m.last_seen, m.message_count,
+           c.id IS NOT NULL, datetime(c.ts, 'unixepoch'), s.sumber,
+           EXISTS (
+               SELECT 1 FROM conversions v
+               WHERE v.link_id = :group_id AND v.chat_id = m.chat_id AND v.user_id = m.user_id
+           )
+    FROM data.members m
+    LEFT JOIN clicks c ON c.id = (
+        SELECT id FROM clicks
+        WHERE user_id = m.user_id AND link_id = :group_id
+        ORDER BY ts LIMIT 1
+    )
+    LEFT JOIN sources s ON s.source_id = c.source_id
+    WHERE m.chat_id = :chat_id {keyset} {clicked}
+    ORDER BY m.last_seen DESC, m.user_id DESC
+    LIMIT :page_size
+'''
+
+def iter_member_pages(cursor, group_id: str, chat_id: int, clicked_only: bool = False,
+                      page_size: int = EXPORT_BATCH_SIZE):
+    """Anggota satu chat per halaman (terakhir aktif lebih dulu), sudah ditandai klik/join.
+
+    Keyset pagination pada idx_members_chat_last_seen: setiap halaman melanjutkan dari
+    (last_seen, user_id) baris terakhir, jadi biayanya sama di awal maupun akhir chat.
+    """
+    clicked = 'AND c.id IS NOT NULL' if clicked_only else ''
+    params = {'group_id': group_id, 'chat_id': chat_id, 'page_size': page_size}
+    cursor.execute(MEMBERS_PAGE_QUERY.format(keyset='', clicked=clicked), params)
+    next_page = MEMBERS_PAGE_QUERY.format(
+        keyset='AND (m.last_seen, m.user_id) < (:last_seen, :user_id)', clicked=clicked
+    )
+    while True:
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        params['last_seen'], params['user_id'] = rows[-1][5], rows[-1][0]
+        cursor.execute(next_page, params)
+
+def build_members_export(group_id: str, group_name: str, chat_ids: list, export_format: str = 'csv',
+                         clicked_only: bool = False, progress=None):
+    """Bangun export anggota chat target secara streaming, satu halaman keyset per batch.
+
+    Semua halaman dibaca dalam satu transaksi baca (snapshot WAL): anggota yang aktif
+    selama export tidak terlewat atau tercatat dua kali, dan penulis pasif tidak terblokir.
+    Anggota (data.db) dan flag klik (link_tracker.db) sama-sama dibaca dari DB live, bukan dari
+    snapshot analitik, agar satu baris tidak menggabungkan data dari dua waktu berbeda.
+    `progress(rows)` dipanggil setiap halaman. Mengembalikan writer, atau None jika tidak ada anggota.
+    """
+    conn = connect_unified()
+    writer = open_export_writer(export_format, f"members_{safe_export_name(group_name)}", MEMBERS_EXPORT_COLUMNS)
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        for chat_id in chat_ids:
+            for page in iter_member_pages(cursor, group_id, chat_id, clicked_only):
+                writer.write_rows([(chat_id,) + row for row in page])
+                if progress:
+                    progress(writer.row_count)
+        conn.commit()
+    except Exception:
+        writer.cleanup()
+        raise
+    finally:
+        conn.close()
+
+    if writer.row_count == 0:
+        writer.cleanup()
+        return None
+    return writer
+
+async def send_export_parts(client: Client, callback_query, parts: list, caption: str,
+                            dated: bool = True) -> list:
+    """Kirim setiap part export sebagai dokumen terpisah, caption diakhiri indikator kesegaran data.
+
+    Mengembalikan daftar [file_id, caption, dated] untuk disimpan di export_cache; caption disimpan
+    tanpa indikator kesegaran (lihat send_cached_export). dated=False untuk export dari DB live.
+    """
+    reply_to = callback_query.message.reply_to_message.id if callback_query.message.reply_to_message else None
+    total = len(parts)
+    documents = []
+
+    for i, (path, file_name) in enumerate(parts, 1):
+        part_caption = caption if total == 1 else f"{caption}\n\n📦 Part {i}/{total}"
+        sent = await client.send_document(
+            chat_id=callback_query.message.chat.id,
+            document=path,
+            file_name=file_name,
+            caption=f"{part_caption}\n{analytics_freshness()}" if dated else part_caption,
+            reply_to_message_id=reply_to
+        )
+        documents.append([sent.document.file_id, part_caption, dated])
+
+    return documents
+
+# --- Helper Functions untuk Export Cache ---
+
+def invalidate_export_cache(cursor, group_id: str = None, owner_code: str = None):
+    """Hapus entri export_cache milik koleksi (dipanggil di dalam transaksi penulisan)."""
+    if owner_code:
+        cursor.execute('''
+            DELETE FROM export_cache
+            WHERE group_id = ?
+               OR group_id IN (SELECT group_id FROM link_groups WHERE owner_code = ?)
+        ''', (group_id, owner_code))
+    else:
+        cursor.execute('DELETE FROM export_cache WHERE group_id = ?', (group_id,))
+
+def get_export_watermark(doc_id: str, owner_code: str) -> str:
+    """Watermark data export: id klik dan id aktivitas terakhir milik koleksi (dari snapshot analitik)."""
+    conn = connect_analytics()
     cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM link_items WHERE id = ?', (item_id,))
-    deleted = cursor.rowcount > 0
-    
-    conn.commit()
+
+    cursor.execute('SELECT MAX(id) FROM clicks WHERE link_id = ?', (doc_id,))
+    last_click = cursor.fetchone()[0] or 0
+    cursor.execute(
+        'SELECT MAX(activity_id) FROM activity_links WHERE link_id = ? OR owner_code = ?', (doc_id, owner_code)
+    )
+    last_activity = cursor.fetchone()[0] or 0
+
     conn.close()
-    return deleted
+    return f"{last_click}:{last_activity}"
 
-def get_link_item(item_id: int) -> dict:
-    """Ambil data satu link item."""
+def get_cached_export(doc_id: str, export_type: str, watermark: str) -> list:
+    """Ambil daftar dokumen [file_id, caption(, bertanda kesegaran)] jika data belum berubah sejak export terakhir."""
     conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM link_items WHERE id = ?', (item_id,))
+
+    cursor.execute('''
+        SELECT documents FROM export_cache
+        WHERE group_id = ? AND export_type = ? AND watermark = ?
+    ''', (doc_id, export_type, watermark))
     row = cursor.fetchone()
     conn.close()
-    
-    return dict(row) if row else None
 
-def update_link_item(item_id: int, display_name: str = None, target_url: str = None) -> bool:
-    """Update data link item (nama atau url)."""
+    return json.loads(row[0]) if row else None
+
+def save_export_cache(doc_id: str, export_type: str, watermark: str, documents: list):
+    """Simpan file_id hasil send_document untuk dipakai ulang."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    
-    if display_name and target_url:
-        cursor.execute('''
-            UPDATE link_items 
-            SET display_name = ?, target_url = ?
-            WHERE id = ?
-        ''', (display_name, target_url, item_id))
-    elif display_name:
-        cursor.execute('UPDATE link_items SET display_name = ? WHERE id = ?', (display_name, item_id))
-    elif target_url:
-        cursor.execute('UPDATE link_items SET target_url = ? WHERE id = ?', (target_url, item_id))
-    
-    updated = cursor.rowcount > 0
+
+    cursor.execute('''
+        INSERT OR REPLACE INTO export_cache (group_id, export_type, watermark, documents)
+        VALUES (?, ?, ?, ?)
+    ''', (doc_id, export_type, watermark, json.dumps(documents)))
+
     conn.commit()
     conn.close()
-    return updated
 
-def delete_link_group(group_id: str) -> bool:
-    """Hapus link group beserta semua items-nya."""
+def drop_export_cache(doc_id: str, export_type: str):
+    """Hapus satu entri export_cache (misalnya file_id sudah tidak valid)."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    
-    # Hapus items dulu
-    cursor.execute('DELETE FROM link_items WHERE group_id = ?', (group_id,))
-    # Hapus grup
-    cursor.execute('DELETE FROM link_groups WHERE group_id = ?', (group_id,))
-    deleted = cursor.rowcount > 0
-    
+    cursor.execute('DELETE FROM export_cache WHERE group_id = ? AND export_type = ?', (doc_id, export_type))
     conn.commit()
     conn.close()
-    return deleted
 
-def log_group_click(group_id: str, user, source: str = None):
-    """Log klik pada link group."""
-    conn = sqlite3.connect(DB_PATH)
+async def send_cached_export(client: Client, callback_query, doc_id: str, export_type: str, watermark: str) -> bool:
+    """Kirim ulang export dari cache berdasarkan file_id. Kembalikan False jika tidak ada cache."""
+    documents = get_cached_export(doc_id, export_type, watermark)
+    if not documents:
+        return False
+
+    reply_to = callback_query.message.reply_to_message.id if callback_query.message.reply_to_message else None
+    try:
+        for file_id, caption, *dated in documents:
+            # Dokumen data dari send_export_parts: indikator kesegaran dirender ulang saat kirim
+            if dated and dated[0]:
+                caption = f"{caption}\n{analytics_freshness()}"
+            await client.send_document(
+                chat_id=callback_query.message.chat.id,
+                document=file_id,
+                caption=caption,
+                reply_to_message_id=reply_to
+            )
+    except Exception as e:
+        # file_id tidak bisa dipakai lagi, buat ulang export
+        print(f"Cached export for {doc_id} ({export_type}) failed, regenerating: {e}")
+        drop_export_cache(doc_id, export_type)
+        return False
+
+    return True
+
+# --- Export Job Queue ---
+
+class ExportCancelled(Exception):
+    """Dilempar dari builder export ketika job dibatalkan pemiliknya."""
+
+class ExportJob:
+    """Satu permintaan export yang menunggu/berjalan di antrian."""
+
+    def __init__(self, key: tuple, owner_id: int, status_message: Message, run):
+        self.job_id = next(_export_job_ids)
+        self.key = key
+        self.owner_id = owner_id
+        self.status_message = status_message
+        self.run = run
+        self.rows = 0
+        self.started = False
+        self.cancel_event = threading.Event()
+
+    def cancel_markup(self) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("✖️ Cancel", callback_data=f"expcancel_{self.job_id}")]
+        ])
+
+    def update_progress(self, rows: int):
+        """Dipanggil dari thread builder; hentikan export jika job dibatalkan."""
+        self.rows = rows
+        if self.cancel_event.is_set():
+            raise ExportCancelled()
+
+_export_job_ids = itertools.count(1)
+export_jobs = {}           # job_id -> ExportJob
+active_export_keys = {}    # (group_id, export_type) -> job_id
+_export_queue = None
+_export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+def ensure_export_workers():
+    """Jalankan worker export di event loop aktif (sekali saja)."""
+    global _export_queue
+    if _export_queue is None:
+        _export_queue = asyncio.Queue()
+        for _ in range(EXPORT_WORKERS):
+            asyncio.get_running_loop().create_task(export_worker())
+
+async def enqueue_export_job(key: tuple, owner_id: int, status_message: Message, run, update=None):
+    """Masukkan job export ke antrian. Kembalikan None jika export yang sama sedang berjalan.
+
+    Hanya job baru (yang akan membangun file) yang memakai budget kelas 'export' milik pengirim
+    `update`; jika budget habis, balasan cooldown sudah dikirim dan yang dikembalikan False.
+    """
+    if key in active_export_keys:
+        return None
+    if update is not None and not await admit_update("export", update):
+        return False
+
+    ensure_export_workers()
+    job = ExportJob(key, owner_id, status_message, run)
+    export_jobs[job.job_id] = job
+    active_export_keys[key] = job.job_id
+
+    position = _export_queue.qsize() + 1
+    await status_message.edit_text(
+        f"⏳ Export queued (position {position})...",
+        reply_markup=job.cancel_markup()
+    )
+    await _export_queue.put(job)
+    return job
+
+async def export_worker():
+    """Ambil job dari antrian dan jalankan satu per satu."""
+    while True:
+        job = await _export_queue.get()
+        try:
+            if job.cancel_event.is_set():
+                raise ExportCancelled()
+            job.started = True
+            await job.run(job)
+        except ExportCancelled:
+            try:
+                await job.status_message.edit_text("❌ Export cancelled.")
+            except Exception:
+                pass
+        except Exception as e:
+            print(f"Error in export job {job.key}: {e}")
+            try:
+                await job.status_message.edit_text(f"❌ An error occurred during export: {e}")
+            except Exception:
+                pass
+        finally:
+            export_jobs.pop(job.job_id, None)
+            active_export_keys.pop(job.key, None)
+            _export_queue.task_done()
+
+async def report_export_progress(job: ExportJob, label: str):
+    """Perbarui pesan '⏳ Generating' dengan jumlah baris yang sudah ditulis."""
+    last_rows = None
+    while True:
+        await asyncio.sleep(EXPORT_PROGRESS_INTERVAL)
+        if job.rows == last_rows:
+            continue
+        last_rows = job.rows
+        try:
+            await job.status_message.edit_text(
+                f"{label}\n📄 {job.rows:,} rows written",
+                reply_markup=job.cancel_markup()
+            )
+        except Exception:
+            pass
+
+async def run_export_builder(job: ExportJob, label: str, func, *args):
+    """Jalankan builder export (blocking) di thread pool sambil melaporkan progres."""
+    await job.status_message.edit_text(label, reply_markup=job.cancel_markup())
+
+    loop = asyncio.get_running_loop()
+    reporter = loop.create_task(report_export_progress(job, label))
+    try:
+        return await loop.run_in_executor(
+            _export_executor,
+            functools.partial(func, *args, progress=job.update_progress)
+        )
+    finally:
+        reporter.cancel()
+
+# --- Statistik Klik (NumPy) ---
+
+STATS_TOP_SOURCES = 5
+WEEKDAY_LABELS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+def load_click_arrays(doc_id: str):
+    """Muat agregat klik per (jam UTC, sumber, bahasa) dari click_rollup sebagai array NumPy.
+
+    Satu elemen per bin, bukan per klik: ukurannya sebanding dengan rentang jam × sumber × bahasa,
+    jadi /stats untuk jutaan klik tidak perlu memuat (atau mengelompokkan) setiap baris clicks.
+    Mengembalikan (hours, counts, source_idx, source_names, lang_idx, lang_names).
+    """
+    import numpy as np
+
+    conn = connect_analytics()
     cursor = conn.cursor()
-    
-    # Increment click counter
-    cursor.execute('UPDATE link_groups SET clicks = clicks + 1 WHERE group_id = ?', (group_id,))
-    
-    # Log detail ke click_stats (gunakan group_id sebagai link_id untuk kompatibilitas)
     cursor.execute('''
-        INSERT INTO click_stats (link_id, sumber, user_id, first_name, last_name, username, language_code)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (group_id, source, user.id, user.first_name, user.last_name, user.username, user.language_code))
-    
-    conn.commit()
+        SELECT r.hour, r.clicks, COALESCE(s.sumber, 'None'), r.language_code
+        FROM click_rollup r
+        LEFT JOIN sources s ON s.source_id = r.source_id
+        WHERE r.link_id = ?
+    ''', (doc_id,))
+    rows = cursor.fetchall()
     conn.close()
 
-def save_target_channel(group_id: str, username_target: str, chat_id: int, chat_username: str):
-    """Simpan target channel/group untuk tracking."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, [], empty, []
 
-    # Cek apakah sudah ada
-    cursor.execute('''
-        SELECT id FROM link_group_targets 
-        WHERE group_id = ? AND username_target = ?
-    ''', (group_id, username_target))
-    
-    exists = cursor.fetchone()
-    
-    if exists:
-        # Update jika ada perubahan chat_id atau chat_username
-        cursor.execute('''
-            UPDATE link_group_targets
-            SET chat_id = ?, chat_username = ?
-            WHERE id = ?
-        ''', (chat_id, chat_username, exists[0]))
+    hours, counts, sources, langs = zip(*rows)
+    source_names, source_idx = np.unique(np.array(sources), return_inverse=True)
+    lang_names, lang_idx = np.unique(np.array(langs), return_inverse=True)
+    return (
+        np.array(hours, dtype=np.int64),
+        np.array(counts, dtype=np.int64),
+        source_idx,
+        source_names.tolist(),
+        lang_idx,
+        [v or "None" for v in lang_names.tolist()],
+    )
+
+def compute_click_stats(hours, counts, source_idx, source_names, lang_idx, lang_names) -> dict:
+    """Hitung deret waktu, heatmap jam × hari dan tren sumber dengan binning vektor berbobot."""
+    import numpy as np
+
+    def binned(index, minlength=0):
+        return np.bincount(index, weights=counts, minlength=minlength).astype(np.int64)
+
+    day = hours // 24
+    first_hour = int(hours.min())
+    first_day = first_hour // 24
+    n_days = int(day.max()) - first_day + 1
+    day_idx = day - first_day
+
+    hourly = binned(hours - first_hour)
+    daily = binned(day_idx, n_days)
+
+    # 1970-01-01 adalah hari Kamis -> geser agar Senin = 0
+    weekday = (day + 3) % 7
+    hour_of_day = hours % 24
+    heatmap = binned(weekday * 24 + hour_of_day, 7 * 24).reshape(7, 24)
+
+    # Tren harian per sumber dalam satu bincount 2D
+    source_totals = binned(source_idx, len(source_names))
+    source_daily = binned(
+        source_idx.astype(np.int64) * n_days + day_idx,
+        len(source_names) * n_days
+    ).reshape(len(source_names), n_days)
+    top_sources = np.argsort(source_totals)[::-1][:STATS_TOP_SOURCES]
+
+    lang_totals = binned(lang_idx, len(lang_names))
+    top_langs = np.argsort(lang_totals)[::-1][:STATS_TOP_SOURCES]
+
+    return {
+        'total': int(counts.sum()),
+        # Awal jam klik pertama/terakhir: resolusi bin, cukup untuk rentang tanggal di caption
+        'first_ts': first_hour * 3600,
+        'last_ts': int(hours.max()) * 3600,
+        'first_day': first_day,
+        'first_hour': first_hour,
+        'hourly': hourly,
+        'daily': daily,
+        'heatmap': heatmap,
+        'source_trends': [(source_names[i], source_daily[i]) for i in top_sources],
+        'top_sources': [(source_names[i], int(source_totals[i])) for i in top_sources],
+        'top_langs': [(lang_names[i], int(lang_totals[i])) for i in top_langs],
+    }
+
+def render_click_stats_png(stats: dict, title: str) -> io.BytesIO:
+    """Render deret waktu, heatmap dan tren sumber ke PNG."""
+    import numpy as np
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, (ax_series, ax_heat, ax_src) = plt.subplots(3, 1, figsize=(10, 12))
+    fig.suptitle(f"Click statistics: {title}", fontsize=14)
+
+    # 1. Deret waktu: per jam untuk rentang pendek, per hari selain itu
+    if stats['daily'].size <= 3:
+        x = (stats['first_hour'] + np.arange(stats['hourly'].size)) * 3600
+        ax_series.bar(x.astype('datetime64[s]'), stats['hourly'], width=1 / 24)
+        ax_series.set_title("Clicks per hour (UTC)")
     else:
-        # Insert baru
-        cursor.execute('''
-            INSERT INTO link_group_targets (group_id, chat_id, chat_username, username_target)
-            VALUES (?, ?, ?, ?)
-        ''', (group_id, chat_id, chat_username, username_target))
-    
-    conn.commit()
-    conn.close()
+        x = (stats['first_day'] + np.arange(stats['daily'].size)) * 86400
+        ax_series.plot(x.astype('datetime64[s]'), stats['daily'])
+        ax_series.set_title("Clicks per day (UTC)")
 
-def get_user_link_groups(owner_id: int) -> list:
-    """Ambil semua link groups milik user."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT lg.*, COUNT(li.id) as item_count
-        FROM link_groups lg
-        LEFT JOIN link_items li ON lg.group_id = li.group_id
-        WHERE lg.owner_id = ?
-        GROUP BY lg.group_id
-        ORDER BY lg.created_at DESC
-    ''', (owner_id,))
-    
-    groups = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return groups
+    # 2. Heatmap jam × hari
+    im = ax_heat.imshow(stats['heatmap'], aspect='auto', cmap='YlOrRd')
+    ax_heat.set_yticks(range(7), WEEKDAY_LABELS)
+    ax_heat.set_xticks(range(0, 24, 2))
+    ax_heat.set_xlabel("Hour of day (UTC)")
+    ax_heat.set_title("Clicks by weekday and hour")
+    fig.colorbar(im, ax=ax_heat)
+
+    # 3. Tren sumber teratas
+    x = ((stats['first_day'] + np.arange(stats['daily'].size)) * 86400).astype('datetime64[s]')
+    for name, series in stats['source_trends']:
+        ax_src.plot(x, series, label=name)
+    ax_src.set_title("Top sources per day")
+    ax_src.legend(loc='upper left')
+
+    # Margin tetap: tight_layout mengukur ulang semua label dan memakan ~40% waktu render
+    fig.subplots_adjust(left=0.07, right=0.97, top=0.94, bottom=0.04, hspace=0.3)
+    output = io.BytesIO()
+    fig.savefig(output, format='png', dpi=100)
+    plt.close(fig)
+    output.seek(0)
+    output.name = "stats.png"
+    return output
+
+def build_click_stats(doc_id: str, title: str):
+    """Bangun gambar & ringkasan statistik klik. Mengembalikan (png, stats) atau (None, None)."""
+    arrays = load_click_arrays(doc_id)
+    if arrays[0].size == 0:
+        return None, None
+    stats = compute_click_stats(*arrays)
+    return render_click_stats_png(stats, title), stats
 
 # --- Conversation State ---
 user_states = {}
 
+# Antrean per user: update dari user yang sama (pesan & callback) diproses berurutan sesuai urutan
+# masuk, user berbeda tetap paralel. Worker yang menemukan user sedang diproses cukup menitipkan
+# update ke antreannya lalu kembali ke dispatcher, sehingga burst satu user tidak menahan worker lain.
+user_queues = {}  # key -> deque update (handler, client, update) yang menunggu giliran
+
+def serialize_per_user(handler):
+    """Decorator handler: jalankan handler berurutan per user (atau per chat jika tanpa pengirim)."""
+    @functools.wraps(handler)
+    async def wrapper(client: Client, update):
+        if update.from_user:
+            key = update.from_user.id
+        else:
+            key = (update if isinstance(update, Message) else update.message).chat.id
+
+        pending = user_queues.get(key)
+        if pending is not None:
+            pending.append((handler, client, update))
+            return
+
+        pending = user_queues[key] = deque([(handler, client, update)])
+        try:
+            while pending:
+                func, func_client, func_update = pending.popleft()
+                try:
+                    await func(func_client, func_update)
+                except Exception as e:
+                    print(f"Error in {func.__name__}: {e!r}")
+        finally:
+            del user_queues[key]
+    return wrapper
+
+# --- Admission Control per User (Token Bucket) ---
+
+# Kelas perintah -> (kapasitas burst, detik per token)
+ADMISSION_LIMITS = {
+    'click': (RATE_CLICK_BURST, RATE_CLICK_REFILL),
+    'menu': (RATE_MENU_BURST, RATE_MENU_REFILL),
+    'export': (RATE_EXPORT_BURST, RATE_EXPORT_REFILL),
+}
+
+# Bucket disimpan sebagai satu float per user: waktu (monotonic) saat bucket kembali penuh.
+# Token tersisa = burst - (full_at - now) / refill. Bucket yang sudah penuh sama dengan user baru,
+# jadi entrinya boleh dibuang kapan saja tanpa mengubah perilaku (lihat admission_sweep_loop).
+admission_buckets = {name: {} for name in ADMISSION_LIMITS}
+admission_notified = set()  # (kelas, user_id) yang sudah menerima balasan cooldown
+admission_stats = {name: {'admitted': 0, 'dropped': 0} for name in ADMISSION_LIMITS}
+
+def admit(command_class: str, user_id: int) -> float:
+    """Ambil satu token dari bucket user. Return 0 jika diterima, atau detik sampai token berikutnya."""
+    burst, refill = ADMISSION_LIMITS[command_class]
+    if burst <= 0:
+        return 0
+    buckets = admission_buckets[command_class]
+    now = time.monotonic()
+    full_at = buckets.get(user_id, now)
+    if full_at < now:
+        full_at = now
+    wait = full_at - now - (burst - 1) * refill
+    if wait > 0:
+        admission_stats[command_class]['dropped'] += 1
+        return wait
+    buckets[user_id] = full_at + refill
+    admission_stats[command_class]['admitted'] += 1
+    return 0
+
+def sweep_admission_buckets() -> int:
+    """Buang bucket yang sudah penuh kembali. Return jumlah entri yang dibuang."""
+    now = time.monotonic()
+    removed = 0
+    for name, buckets in admission_buckets.items():
+        idle_users = [user_id for user_id, full_at in buckets.items() if full_at <= now]
+        for user_id in idle_users:
+            del buckets[user_id]
+            admission_notified.discard((name, user_id))
+        removed += len(idle_users)
+    return removed
+
+async def admission_sweep_loop():
+    """Bersihkan bucket user idle secara berkala agar memori sebanding dengan user aktif."""
+    while True:
+        await asyncio.sleep(RATE_SWEEP_INTERVAL)
+        try:
+            sweep_admission_buckets()
+        except Exception as e:
+            print(f"Error sweeping admission buckets: {e}")
+
+async def admit_update(command_class: str, update) -> bool:
+    """Ambil token kelas perintah untuk pengirim update; jika ditolak, kirim balasan cooldown.
+
+    Penolakan pertama dibalas pesan cooldown, penolakan berikutnya dibuang diam-diam sampai
+    user diterima lagi. Update tanpa pengirim selalu diterima.
+    """
+    user = update.from_user
+    if not user:
+        return True
+
+    wait = admit(command_class, user.id)
+    key = (command_class, user.id)
+    if not wait:
+        if admission_notified:
+            admission_notified.discard(key)
+        return True
+
+    if key in admission_notified:
+        return False
+    admission_notified.add(key)
+    text = f"⏳ Too many requests. Please try again in {math.ceil(wait)}s."
+    try:
+        if isinstance(update, Message):
+            await update.reply_text(text)
+        else:
+            await update.answer(text, show_alert=True)
+    except RPCError as e:
+        print(f"Error sending cooldown reply: {e}")
+    return False
+
+def rate_limited(command_class: str):
+    """Decorator handler: tolak update yang melebihi budget user untuk kelas perintah ini.
+
+    Update yang ditolak tidak menyentuh database (lihat admit_update).
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(client: Client, update):
+            if await admit_update(command_class, update):
+                return await handler(client, update)
+        return wrapper
+    return decorator
+
 # --- Bot Handlers ---
 
 @app.on_message(filters.command("start"))
+@rate_limited("click")
+@serialize_per_user
 async def start_handler(client: Client, message: Message):
     """Handle /start command. Can be a normal start or a deep link redirect."""
-    track_user(message.from_user)
+    try:
+        await reply_start(client, message)
+    finally:
+        # Profil dicatat setelah balasan dan di thread: jalur klik tidak menunggu penulisan SQLite
+        await asyncio.get_running_loop().run_in_executor(None, track_user, message.from_user)
+
+def load_start_link(link_id: str):
+    """Ambil link group beserta item-nya untuk deep link /start (dijalankan di thread)."""
+    group_data = get_link_group(link_id)
+    if not group_data:
+        return None, []
+    return group_data, get_link_items(link_id)
+
+async def reply_start(client: Client, message: Message):
+    """Balas /start biasa atau deep link (klik dicatat ke jurnal klik)."""
     args = message.command
     
     if len(args) > 1:
@@ -737,34 +4053,34 @@ async def start_handler(client: Client, message: Message):
             source = "-".join(parts[2:]) if len(parts) > 2 else None
             link_id = f"{target}-{code}"
         
-        # Cek dulu di link_groups (multi-link)
-        group_data = get_link_group(link_id)
+        # Cek dulu di link_groups (multi-link); baca SQLite di thread agar event loop tidak tertahan
+        group_data, items = await asyncio.get_running_loop().run_in_executor(
+            None, load_start_link, link_id
+        )
         
         if group_data:
             # Multi-link mode: tampilkan semua link sebagai tombol
-            items = get_link_items(link_id)
-            
             if not items:
                 await message.reply_text("❌ This link group has no items yet.")
                 return
             
             # Log klik
             try:
-                log_group_click(link_id, message.from_user, source)
+                record_click(ClickEvent.from_user(link_id, message.from_user, source))
             except Exception as e:
                 print(f"Error logging group click: {e}")
             
             # Buat tombol untuk setiap link
             buttons = []
             for item in items:
-                if item['target_type'] == 'telegram':
-                    url = f"https://t.me/{item['target_url'].replace('@', '')}"
+                if item.target_type == 'telegram':
+                    url = f"https://t.me/{item.target_url.replace('@', '')}"
                 else:
-                    url = item['target_url']
-                buttons.append([InlineKeyboardButton(item['display_name'], url=url)])
+                    url = item.target_url
+                buttons.append([InlineKeyboardButton(item.display_name, url=url)])
             
             await message.reply_text(
-                f"📂 **{group_data['group_name']}**\n\n"
+                f"📂 **{group_data.group_name}**\n\n"
                 f"Select a link below:",
                 reply_markup=InlineKeyboardMarkup(buttons)
             )
@@ -781,6 +4097,8 @@ async def start_handler(client: Client, message: Message):
         )
 
 @app.on_message(filters.command("help"))
+@rate_limited("menu")
+@serialize_per_user
 async def help_handler(client: Client, message: Message):
     """Show help message with all available commands."""
     track_user(message.from_user)
@@ -792,6 +4110,11 @@ async def help_handler(client: Client, message: Message):
         "📂 /mylinks - View all your links\n"
         "📊 /export - Export click statistics\n"
         "📝 /activity - View user activity logs\n"
+        "🧮 /export parquet, /activity parquet - Typed columnar export\n"
+        "📈 /stats - Click charts (time series, heatmap, sources)\n"
+        "💬 /topposts - Channel posts with the most comments\n"
+        "🔎 /search <words> - Search messages from users who clicked your links\n"
+        "👥 /members - Export members of your target chats (`/members parquet`, `/members clicked`)\n"
         "🗑 /deletegroup - Delete a link group\n\n"
         "**How to use:**\n"
         "1. Create a collection with /newlinks\n"
@@ -803,6 +4126,8 @@ async def help_handler(client: Client, message: Message):
     )
 
 @app.on_message(filters.command(["newlinks"]))
+@rate_limited("menu")
+@serialize_per_user
 async def add_link_handler(client: Client, message: Message):
     """Create a new multi-link collection."""
     track_user(message.from_user)
@@ -820,7 +4145,9 @@ async def add_link_handler(client: Client, message: Message):
         "Send /cancel to cancel."
     )
 
-@app.on_message(filters.text & filters.private & ~filters.command(["start", "help", "mylinks", "export", "newlinks", "activity", "deletegroup"]))
+@app.on_message(filters.text & filters.private & ~filters.command(["start", "help", "mylinks", "export", "newlinks", "activity", "deletegroup", "stats", "topposts", "search", "members"]))
+@rate_limited("menu")
+@serialize_per_user
 async def text_handler(client: Client, message: Message):
     """Handle text messages for conversation."""
     track_user(message.from_user)
@@ -1031,15 +4358,15 @@ async def text_handler(client: Client, message: Message):
         user_states[user_id] = {
             'step': 'managing_group',
             'group_id': group_id,
-            'group_name': group_data['group_name']
+            'group_name': group_data.group_name
         }
         
         # Tampilkan menu pilihan edit lagi
         item = get_link_item(item_id)
         await client.send_message(
             message.chat.id,
-            f"✏️ **Editing: {item['display_name']}**\n"
-            f"URL: `{item['target_url']}`\n\n"
+            f"✏️ **Editing: {item.display_name}**\n"
+            f"URL: `{item.target_url}`\n\n"
             "What do you want to edit?",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("Change Name", callback_data=f"editname_{item_id}_{group_id}")],
@@ -1088,15 +4415,15 @@ async def text_handler(client: Client, message: Message):
         user_states[user_id] = {
             'step': 'managing_group',
             'group_id': group_id,
-            'group_name': group_data['group_name']
+            'group_name': group_data.group_name
         }
         
         # Tampilkan menu pilihan edit lagi
         item = get_link_item(item_id)
         await client.send_message(
             message.chat.id,
-            f"✏️ **Editing: {item['display_name']}**\n"
-            f"URL: `{item['target_url']}`\n\n"
+            f"✏️ **Editing: {item.display_name}**\n"
+            f"URL: `{item.target_url}`\n\n"
             "What do you want to edit?",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("Change Name", callback_data=f"editname_{item_id}_{group_id}")],
@@ -1163,7 +4490,7 @@ async def send_group_management_menu(client: Client, chat_id: int, group_id: str
     items_text = ""
     if items:
         for i, item in enumerate(items, 1):
-            items_text += f"{i}. {item['display_name']} → {item['target_url']}\n"
+            items_text += f"{i}. {item.display_name} → {item.target_url}\n"
     else:
         items_text = "_No links added yet_\n"
     
@@ -1191,6 +4518,8 @@ async def send_group_management_menu(client: Client, chat_id: int, group_id: str
         await client.send_message(chat_id, text, reply_markup=markup, disable_web_page_preview=True)
 
 @app.on_callback_query(filters.regex(r"^confirmname_"))
+@rate_limited("menu")
+@serialize_per_user
 async def confirm_name_callback(client: Client, callback_query):
     """Handle confirmation of suggested name."""
     suggested_name = callback_query.data.split("_", 1)[1]
@@ -1237,6 +4566,8 @@ async def confirm_name_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^cancelname$"))
+@rate_limited("menu")
+@serialize_per_user
 async def cancel_name_callback(client: Client, callback_query):
     """Handle cancellation of suggested name."""
     user_id = callback_query.from_user.id
@@ -1254,6 +4585,8 @@ async def cancel_name_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^edititem_"))
+@rate_limited("menu")
+@serialize_per_user
 async def edit_item_menu_callback(client: Client, callback_query):
     """Show menu to select item to edit."""
     group_id = callback_query.data.split("_", 1)[1]
@@ -1261,7 +4594,7 @@ async def edit_item_menu_callback(client: Client, callback_query):
     
     # Verify ownership
     group_data = get_link_group(group_id)
-    if not group_data or group_data['owner_id'] != user_id:
+    if not group_data or group_data.owner_id != user_id:
         await callback_query.answer("Access denied.", show_alert=True)
         return
     
@@ -1275,8 +4608,8 @@ async def edit_item_menu_callback(client: Client, callback_query):
     buttons = []
     for item in items:
         buttons.append([InlineKeyboardButton(
-            f"✏️ {item['display_name']}", 
-            callback_data=f"editsel_{item['id']}_{group_id}"
+            f"✏️ {item.display_name}", 
+            callback_data=f"editsel_{item.id}_{group_id}"
         )])
     buttons.append([InlineKeyboardButton("🔙 Back", callback_data=f"backgroup_{group_id}")])
     
@@ -1286,6 +4619,8 @@ async def edit_item_menu_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^editsel_"))
+@rate_limited("menu")
+@serialize_per_user
 async def edit_select_callback(client: Client, callback_query):
     """Show edit options for selected item."""
     parts = callback_query.data.split("_")
@@ -1299,8 +4634,8 @@ async def edit_select_callback(client: Client, callback_query):
         return
         
     await callback_query.message.edit_text(
-        f"✏️ **Editing: {item['display_name']}**\n"
-        f"URL: `{item['target_url']}`\n\n"
+        f"✏️ **Editing: {item.display_name}**\n"
+        f"URL: `{item.target_url}`\n\n"
         "What do you want to edit?",
         reply_markup=InlineKeyboardMarkup([
             [InlineKeyboardButton("Change Name", callback_data=f"editname_{item_id}_{group_id}")],
@@ -1310,6 +4645,8 @@ async def edit_select_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^editname_"))
+@rate_limited("menu")
+@serialize_per_user
 async def edit_name_callback(client: Client, callback_query):
     """Prepare to edit name."""
     parts = callback_query.data.split("_")
@@ -1331,6 +4668,8 @@ async def edit_name_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^editurl_"))
+@rate_limited("menu")
+@serialize_per_user
 async def edit_url_callback(client: Client, callback_query):
     """Prepare to edit URL."""
     parts = callback_query.data.split("_")
@@ -1352,6 +4691,8 @@ async def edit_url_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^additem_"))
+@rate_limited("menu")
+@serialize_per_user
 async def add_item_callback(client: Client, callback_query):
     """Handle add item button."""
     group_id = callback_query.data.split("_", 1)[1]
@@ -1359,7 +4700,7 @@ async def add_item_callback(client: Client, callback_query):
     
     # Verify ownership
     group_data = get_link_group(group_id)
-    if not group_data or group_data['owner_id'] != user_id:
+    if not group_data or group_data.owner_id != user_id:
         await callback_query.answer("Access denied.", show_alert=True)
         return
     
@@ -1367,7 +4708,7 @@ async def add_item_callback(client: Client, callback_query):
     user_states[user_id] = {
         'step': 'waiting_item_name',
         'group_id': group_id,
-        'group_name': group_data['group_name']
+        'group_name': group_data.group_name
     }
     
     await callback_query.message.edit_text(
@@ -1378,6 +4719,8 @@ async def add_item_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^delitem_"))
+@rate_limited("menu")
+@serialize_per_user
 async def delete_item_menu_callback(client: Client, callback_query):
     """Show menu to select item to delete."""
     group_id = callback_query.data.split("_", 1)[1]
@@ -1385,7 +4728,7 @@ async def delete_item_menu_callback(client: Client, callback_query):
     
     # Verify ownership
     group_data = get_link_group(group_id)
-    if not group_data or group_data['owner_id'] != user_id:
+    if not group_data or group_data.owner_id != user_id:
         await callback_query.answer("Access denied.", show_alert=True)
         return
     
@@ -1394,7 +4737,7 @@ async def delete_item_menu_callback(client: Client, callback_query):
     if not items:
         # Tidak ada link, tawarkan untuk hapus grup
         await callback_query.message.edit_text(
-            f"📂 **{group_data['group_name']}**\n\n"
+            f"📂 **{group_data.group_name}**\n\n"
             "This collection has no links.\n"
             "Do you want to delete the entire collection?",
             reply_markup=InlineKeyboardMarkup([
@@ -1408,8 +4751,8 @@ async def delete_item_menu_callback(client: Client, callback_query):
     buttons = []
     for item in items:
         buttons.append([InlineKeyboardButton(
-            f"🗑 {item['display_name']}", 
-            callback_data=f"rmitem_{item['id']}_{group_id}"
+            f"🗑 {item.display_name}", 
+            callback_data=f"rmitem_{item.id}_{group_id}"
         )])
     buttons.append([InlineKeyboardButton("🔙 Back", callback_data=f"backgroup_{group_id}")])
     
@@ -1419,6 +4762,8 @@ async def delete_item_menu_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^rmitem_"))
+@rate_limited("menu")
+@serialize_per_user
 async def remove_item_callback(client: Client, callback_query):
     """Handle item deletion."""
     parts = callback_query.data.split("_")
@@ -1428,7 +4773,7 @@ async def remove_item_callback(client: Client, callback_query):
     
     # Verify ownership
     group_data = get_link_group(group_id)
-    if not group_data or group_data['owner_id'] != user_id:
+    if not group_data or group_data.owner_id != user_id:
         await callback_query.answer("Access denied.", show_alert=True)
         return
     
@@ -1440,18 +4785,20 @@ async def remove_item_callback(client: Client, callback_query):
         client, 
         callback_query.message.chat.id, 
         group_id, 
-        group_data['group_name'],
+        group_data.group_name,
         message_to_edit=callback_query.message
     )
 
 @app.on_callback_query(filters.regex(r"^backgroup_"))
+@rate_limited("menu")
+@serialize_per_user
 async def back_to_group_callback(client: Client, callback_query):
     """Go back to group management menu."""
     group_id = callback_query.data.split("_", 1)[1]
     user_id = callback_query.from_user.id
     
     group_data = get_link_group(group_id)
-    if not group_data or group_data['owner_id'] != user_id:
+    if not group_data or group_data.owner_id != user_id:
         await callback_query.answer("Access denied.", show_alert=True)
         return
     
@@ -1459,11 +4806,13 @@ async def back_to_group_callback(client: Client, callback_query):
         client,
         callback_query.message.chat.id,
         group_id,
-        group_data['group_name'],
+        group_data.group_name,
         message_to_edit=callback_query.message
     )
 
 @app.on_callback_query(filters.regex(r"^donegroup_"))
+@rate_limited("menu")
+@serialize_per_user
 async def done_group_callback(client: Client, callback_query):
     """Finish group creation/editing."""
     group_id = callback_query.data.split("_", 1)[1]
@@ -1483,17 +4832,17 @@ async def done_group_callback(client: Client, callback_query):
     items_text = ""
     if items:
         for i, item in enumerate(items, 1):
-            items_text += f"{i}. {item['display_name']}\n"
+            items_text += f"{i}. {item.display_name}\n"
     else:
         items_text = "_No links_\n"
     
     
     # Redirect ke tampilan menu group (seperti showgroup_)
     await callback_query.message.edit_text(
-        f"📂 **{group_data['group_name']}**\n\n"
+        f"📂 **{group_data.group_name}**\n\n"
         f"**Links:**\n{items_text}\n"
         f"🔗 **Referral Link:**\n`{final_link}`\n   `[@NAME]({final_link})`\n"
-        f"� **Total Clicks:** {group_data['clicks']}\n\n"
+        f"� **Total Clicks:** {group_data.clicks}\n\n"
         f"💡 Add source: `{final_link}-fb`",
         reply_markup=InlineKeyboardMarkup([
             [InlineKeyboardButton("✏️ Edit Links", callback_data=f"editgroup_{group_id}")],
@@ -1519,8 +4868,8 @@ async def send_mylinks_menu(client: Client, chat_id: int, user_id: int, message_
     
     # Show link groups
     for g in groups:
-        display_text = f"📂 {g['group_name']} ({g['clicks']} clicks, {g['item_count']} links)"
-        buttons.append([InlineKeyboardButton(display_text, callback_data=f"showgroup_{g['group_id']}")])
+        display_text = f"📂 {g.group_name} ({g.clicks} clicks, {g.item_count} links)"
+        buttons.append([InlineKeyboardButton(display_text, callback_data=f"showgroup_{g.group_id}")])
     
     text = "📂 **Select a link collection to view info:**"
     markup = InlineKeyboardMarkup(buttons)
@@ -1531,6 +4880,8 @@ async def send_mylinks_menu(client: Client, chat_id: int, user_id: int, message_
         await client.send_message(chat_id, text, reply_markup=markup)
 
 @app.on_callback_query(filters.regex(r"^showgroup_"))
+@rate_limited("menu")
+@serialize_per_user
 async def show_group_callback(client: Client, callback_query):
     """Show link group details."""
     group_id = callback_query.data.split("_", 1)[1]
@@ -1538,7 +4889,7 @@ async def show_group_callback(client: Client, callback_query):
     
     group_data = get_link_group(group_id)
     
-    if not group_data or group_data['owner_id'] != user_id:
+    if not group_data or group_data.owner_id != user_id:
         await callback_query.answer("Group not found or access denied.", show_alert=True)
         return
     
@@ -1548,31 +4899,85 @@ async def show_group_callback(client: Client, callback_query):
     items_text = ""
     if items:
         for i, item in enumerate(items, 1):
-            items_text += f"{i}. {item['display_name']} → {item['target_url']}\n"
+            items_text += f"{i}. {item.display_name} → {item.target_url}\n"
     else:
         items_text = "_No links_\n"
     
+    # Merge sketch HLL seluruh hari bisa puluhan ms: dijalankan di thread agar update lain tidak tertahan
+    unique_users, joins = await asyncio.get_running_loop().run_in_executor(
+        None, get_group_reach, group_id
+    )
+    join_rate = min(joins / unique_users, 1.0) if unique_users else 0.0
+    
     await callback_query.message.edit_text(
-        f"📂 **{group_data['group_name']}**\n\n"
+        f"📂 **{group_data.group_name}**\n\n"
         f"**Links:**\n{items_text}\n"
         f"🔗 **Referral Link:**\n`{final_link}`\n   `[@NAME]({final_link})`\n"
-        f"📊 **Total Clicks:** {group_data['clicks']}\n\n"
+        f"📊 **Total Clicks:** {group_data.clicks}\n"
+        f"👥 **Unique Users:** ~{unique_users}\n"
+        f"🎯 **Joins:** {joins} ({join_rate:.1%} of unique users)\n\n"
         f"💡 Add source: `{final_link}-fb`",
         reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🏆 Top Sources / Active Users", callback_data=f"tophits_{group_id}")],
             [InlineKeyboardButton("✏️ Edit Links", callback_data=f"editgroup_{group_id}")],
             [InlineKeyboardButton("🔙 Back", callback_data="back_mylinks")]
         ]),
         disable_web_page_preview=True
     )
 
+@app.on_callback_query(filters.regex(r"^tophits_"))
+@rate_limited("menu")
+@serialize_per_user
+async def top_hits_callback(client: Client, callback_query):
+    """Show top sources and most active users from the streaming sketches."""
+    group_id = callback_query.data.split("_", 1)[1]
+    user_id = callback_query.from_user.id
+    
+    group_data = get_link_group(group_id)
+    if not group_data or group_data.owner_id != user_id:
+        await callback_query.answer("Access denied.", show_alert=True)
+        return
+    
+    top_sources = (await get_heavy_hitters(group_id, 'source')).ranking()
+    top_users = (await get_heavy_hitters(group_id, 'user')).ranking()
+    
+    # Nama pengguna dari data.db
+    usernames = {}
+    if top_users:
+        conn = sqlite3.connect(DATA_DB_PATH)
+        cursor = conn.cursor()
+        ids = [int(uid) for uid, _ in top_users]
+        cursor.execute(
+            f"SELECT user_id, username, first_name FROM users WHERE user_id IN ({','.join('?' for _ in ids)})",
+            ids
+        )
+        usernames = {str(uid): (f"@{uname}" if uname else (first_name or str(uid))) for uid, uname, first_name in cursor.fetchall()}
+        conn.close()
+    
+    sources_text = "".join(f"{i}. {src} — ~{count} clicks\n" for i, (src, count) in enumerate(top_sources, 1)) or "_No clicks yet_\n"
+    users_text = "".join(
+        f"{i}. {usernames.get(uid, uid)} — ~{count} messages\n" for i, (uid, count) in enumerate(top_users, 1)
+    ) or "_No activity yet_\n"
+    
+    await callback_query.message.edit_text(
+        f"🏆 **{group_data.group_name}**\n\n"
+        f"**Top Sources:**\n{sources_text}\n"
+        f"**Most Active Users:**\n{users_text}",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 Back", callback_data=f"showgroup_{group_id}")]
+        ])
+    )
+
 @app.on_callback_query(filters.regex(r"^editgroup_"))
+@rate_limited("menu")
+@serialize_per_user
 async def edit_group_callback(client: Client, callback_query):
     """Edit link group - show management menu."""
     group_id = callback_query.data.split("_", 1)[1]
     user_id = callback_query.from_user.id
     
     group_data = get_link_group(group_id)
-    if not group_data or group_data['owner_id'] != user_id:
+    if not group_data or group_data.owner_id != user_id:
         await callback_query.answer("Access denied.", show_alert=True)
         return
     
@@ -1580,18 +4985,20 @@ async def edit_group_callback(client: Client, callback_query):
     user_states[user_id] = {
         'step': 'managing_group',
         'group_id': group_id,
-        'group_name': group_data['group_name']
+        'group_name': group_data.group_name
     }
     
     await send_group_management_menu(
         client,
         callback_query.message.chat.id,
         group_id,
-        group_data['group_name'],
+        group_data.group_name,
         message_to_edit=callback_query.message
     )
 
 @app.on_message(filters.command("mylinks"))
+@rate_limited("menu")
+@serialize_per_user
 async def mylinks_handler(client: Client, message: Message):
     """List all target usernames to select from."""
     track_user(message.from_user)
@@ -1599,6 +5006,8 @@ async def mylinks_handler(client: Client, message: Message):
     await send_mylinks_menu(client, message.chat.id, user_id)
 
 @app.on_callback_query(filters.regex(r"^showlink_"))
+@rate_limited("menu")
+@serialize_per_user
 async def show_link_callback(client: Client, callback_query):
     target = callback_query.data.split("_", 1)[1]
     user_id = callback_query.from_user.id
@@ -1609,7 +5018,7 @@ async def show_link_callback(client: Client, callback_query):
     
     cursor.execute('''
         SELECT * FROM links 
-        WHERE owner_id = ? AND username_target = ?
+        WHERE owner_id = ? AND username_target = ? AND deleted_at IS NULL
     ''', (user_id, target))
     
     link = cursor.fetchone()
@@ -1637,6 +5046,8 @@ async def show_link_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^back_mylinks"))
+@rate_limited("menu")
+@serialize_per_user
 async def back_mylinks_callback(client: Client, callback_query):
     # Re-trigger mylinks logic using the helper
     # CORRECT FIX: Use callback_query.from_user.id for user_id
@@ -1647,189 +5058,369 @@ async def back_mylinks_callback(client: Client, callback_query):
         message_to_edit=callback_query.message
     )
 
-@app.on_message(filters.command("export"))
-async def export_handler(client: Client, message: Message):
-    """Export click stats to CSV."""
+@app.on_message(filters.command("export"))
+@rate_limited("menu")
+@serialize_per_user
+async def export_handler(client: Client, message: Message):
+    """Export click stats to CSV (or Parquet with `/export parquet`)."""
+    track_user(message.from_user)
+    user_id = message.from_user.id
+    
+    # Format opsional: /export parquet
+    use_parquet = len(message.command) > 1 and message.command[1].lower() == "parquet"
+    if use_parquet and not parquet_available():
+        await message.reply_text("❌ Parquet export is not available on this server (pyarrow is not installed).")
+        return
+    prefix = "exppq" if use_parquet else "export"
+    
+    # Get Link Groups
+    groups = get_user_link_groups(user_id)
+    
+    if not groups:
+        await message.reply_text("No link collections found to export.")
+        return
+
+    # Create buttons
+    buttons = []
+    for g in groups:
+        btn_text = f"📂 {g.group_name} ({g.clicks} clicks)"
+        buttons.append([InlineKeyboardButton(btn_text, callback_data=f"{prefix}_{g.group_id}")])
+
+    await message.reply_text(
+        "📊 **Select a link collection to export data:**",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
+
+
+@app.on_callback_query(filters.regex(r"^(export|exppq)_"))
+@rate_limited("menu")
+@serialize_per_user
+async def export_callback(client: Client, callback_query):
+    """Callback export click stats (Groups Only)."""
+    try:
+        prefix, doc_id = callback_query.data.split("_", 1)
+        export_format = 'parquet' if prefix == "exppq" else 'csv'
+        
+        # 1. Ensure target is Link Group
+        link_data = get_link_group(doc_id)
+        
+        if not link_data:
+             await callback_query.answer("Link collection not found.", show_alert=True)
+             return
+             
+        if link_data.owner_id != callback_query.from_user.id:
+             await callback_query.answer("Access denied.", show_alert=True)
+             return
+             
+        export_name = link_data.group_name
+
+        # Data belum berubah sejak export terakhir: kirim ulang via file_id
+        export_type = f"clicks_{export_format}"
+        watermark = get_export_watermark(doc_id, link_data.owner_code)
+        if await send_cached_export(client, callback_query, doc_id, export_type, watermark):
+            await callback_query.message.delete()
+            return
+
+        async def run(job: ExportJob):
+            writer, summary_bytes = await run_export_builder(
+                job,
+                f"⏳ Generating {export_format.upper()} & Summary...",
+                build_click_export, doc_id, link_data, export_format
+            )
+
+            if writer is None:
+                await job.status_message.edit_text("No clicks recorded for this group yet.")
+                return
+
+            try:
+                if job.cancel_event.is_set():
+                    raise ExportCancelled()
+                parts = writer.close()
+
+                # Ringkasan
+                date_str = datetime.now().strftime("%Y%m%d")
+                summary_filename = f"summary_{safe_export_name(export_name)}_{date_str}.txt"
+                bio_txt = io.BytesIO(summary_bytes)
+                bio_txt.name = summary_filename
+
+                # CSV
+                documents = await send_export_parts(
+                    client,
+                    callback_query,
+                    parts,
+                    f"📊 **Export Data for:** `{export_name}`\n\nIncluded: {export_format.upper()} (Detailed) and Summary Report."
+                )
+
+                sent = await client.send_document(
+                    chat_id=callback_query.message.chat.id,
+                    document=bio_txt,
+                    file_name=summary_filename,
+                    caption="📄 **Summary Report**",
+                    reply_to_message_id=callback_query.message.reply_to_message.id if callback_query.message.reply_to_message else None
+                )
+                documents.append([sent.document.file_id, "📄 **Summary Report**"])
+            finally:
+                writer.cleanup()
+
+            save_export_cache(doc_id, export_type, watermark, documents)
+
+            await job.status_message.delete()
+
+        job = await enqueue_export_job(
+            (doc_id, export_type), callback_query.from_user.id, callback_query.message, run, callback_query
+        )
+        if job is None:
+            await callback_query.answer("This export is already in progress.", show_alert=True)
+
+    except Exception as e:
+        print(f"Error in export_callback: {e}")
+        await callback_query.message.edit_text(f"❌ An error occurred during export: {e}")
+
+
+
+@app.on_message(filters.command("stats"))
+@rate_limited("menu")
+@serialize_per_user
+async def stats_handler(client: Client, message: Message):
+    """Show click charts for a link collection."""
     track_user(message.from_user)
     user_id = message.from_user.id
     
-    # Get Link Groups
     groups = get_user_link_groups(user_id)
     
     if not groups:
-        await message.reply_text("No link collections found to export.")
+        await message.reply_text("No link collections found.")
         return
 
-    # Create buttons
     buttons = []
     for g in groups:
-        btn_text = f"📂 {g['group_name']} ({g['clicks']} clicks)"
-        buttons.append([InlineKeyboardButton(btn_text, callback_data=f"export_{g['group_id']}")])
+        btn_text = f"📂 {g.group_name} ({g.clicks} clicks)"
+        buttons.append([InlineKeyboardButton(btn_text, callback_data=f"stats_{g.group_id}")])
 
     await message.reply_text(
-        "📊 **Select a link collection to export data:**",
+        "📈 **Select a link collection to view stats:**",
         reply_markup=InlineKeyboardMarkup(buttons)
     )
 
-
-@app.on_callback_query(filters.regex(r"^export_"))
-async def export_callback(client: Client, callback_query):
-    """Callback export click stats (Groups Only)."""
+@app.on_callback_query(filters.regex(r"^stats_"))
+@rate_limited("menu")
+@serialize_per_user
+async def stats_callback(client: Client, callback_query):
+    """Render time series, heatmap dan tren sumber sebagai PNG."""
     try:
-        doc_id = callback_query.data.split("_", 1)[1]
-        
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        group_id = callback_query.data.split("_", 1)[1]
+        group_data = get_link_group(group_id)
         
-        # 1. Ensure target is Link Group
-        cursor.execute('SELECT * FROM link_groups WHERE group_id = ?', (doc_id,))
-        group_row = cursor.fetchone()
+        if not group_data or group_data.owner_id != callback_query.from_user.id:
+            await callback_query.answer("Access denied.", show_alert=True)
+            return
         
-        if not group_row:
-             conn.close()
-             await callback_query.answer("Link collection not found.", show_alert=True)
-             return
-             
-        if group_row['owner_id'] != callback_query.from_user.id:
-             conn.close()
-             await callback_query.answer("Access denied.", show_alert=True)
-             return
-             
-        link_data = dict(group_row)
-        export_name = link_data.get('group_name', doc_id)
-
-        await callback_query.message.edit_text("⏳ Generating CSV & Summary...")
-
-        # Ambil statistik klik
-        cursor.execute('''
-            SELECT sumber, user_id, first_name, username, language_code, timestamp
-            FROM click_stats 
-            WHERE link_id = ? 
-            ORDER BY timestamp DESC
-        ''', (doc_id,))
+        await callback_query.message.edit_text("⏳ Building charts...")
+        await ensure_fresh_snapshot()
         
-        stats = cursor.fetchall()
-        conn.close()
+        loop = asyncio.get_running_loop()
+        png, stats = await loop.run_in_executor(
+            _export_executor, build_click_stats, group_id, group_data.group_name
+        )
         
-        if len(stats) == 0:
+        if png is None:
             await callback_query.message.edit_text("No clicks recorded for this group yet.")
             return
         
-        # 1. BUAT CSV (Pengguna Unik dengan Data Aktivitas)
-        output_csv = io.StringIO()
-        writer = csv.writer(output_csv)
-        # Menghapus 'Join Status' karena tidak relevan untuk grup
-        writer.writerow(['User ID', 'First Name', 'Username', 'Language', 'First Click', 'Activity Count'])
-
-        # Ambil pengguna unik
-        conn = sqlite3.connect(DB_PATH) # Buka kembali
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT user_id, first_name, username, language_code, MIN(timestamp) as first_click
-            FROM click_stats 
-            WHERE link_id = ? 
-            GROUP BY user_id
-            ORDER BY first_click DESC
-        ''', (doc_id,))
-        
-        unique_users = cursor.fetchall()
-        
-        # Hitung sumber lalu lintas dan user unik per sumber
-        cursor.execute('''
-            SELECT sumber, COUNT(*) as total, COUNT(DISTINCT user_id) as unique_users 
-            FROM click_stats 
-            WHERE link_id = ? 
-            GROUP BY sumber
-        ''', (doc_id,))
-        source_data = cursor.fetchall()
-
-        conn.close() 
-        
-        # Proses Data Pengayaan
-        for user in unique_users:
-            uid = user['user_id']
-            
-            # Hitung aktivitas pengguna
-            # Gunakan link_id (group_id) atau owner_code untuk mencocokkan aktivitas
-            conn_act = sqlite3.connect(DB_PATH)
-            cursor_act = conn_act.cursor()
-            cursor_act.execute('SELECT COUNT(*) FROM user_activity WHERE (link_id = ? OR owner_code = ?) AND user_id = ?', (doc_id, link_data.get('owner_code'), uid))
-            act_count = cursor_act.fetchone()[0]
-            conn_act.close()
-
-            writer.writerow([
-                uid, 
-                user['first_name'], 
-                user['username'] or "", 
-                user['language_code'], 
-                user['first_click'], 
-                act_count
-            ])
-            
-        output_csv.seek(0)
-        
-        # 2. BUAT RINGKASAN (File Teks)
-        output_txt = io.StringIO()
-        output_txt.write(f"Export Report for: {export_name}\n")
-        output_txt.write(f"Generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-        
-        output_txt.write(f"Total Clicks (All Time): {len(stats)}\n")
-        output_txt.write(f"Unique Users: {len(unique_users)}\n\n")
-        
-        output_txt.write("Traffic Sources (Total Clicks - Unique Users):\n")
-        for row in source_data:
-            src = row['sumber'] or "None"
-            output_txt.write(f"- {src}: {row['total']} ({row['unique_users']})\n")
-            
-        output_txt.seek(0)
-
-        # Kirim File
-        date_str = datetime.now().strftime("%Y%m%d")
-        safe_name = "".join(x for x in export_name if x.isalnum() or x in ('_','-'))
-        filename = f"export_{safe_name}_{date_str}.csv"
-        summary_filename = f"summary_{safe_name}_{date_str}.txt"
-        
-        # CSV
-        bio_csv = io.BytesIO(output_csv.getvalue().encode('utf-8'))
-        bio_csv.name = filename
-        
-        # Ringkasan
-        bio_txt = io.BytesIO(output_txt.getvalue().encode('utf-8'))
-        bio_txt.name = summary_filename
+        first = time.strftime('%Y-%m-%d', time.gmtime(stats['first_ts']))
+        last = time.strftime('%Y-%m-%d', time.gmtime(stats['last_ts']))
+        sources_text = ", ".join(f"{name} ({count})" for name, count in stats['top_sources'])
+        langs_text = ", ".join(f"{name} ({count})" for name, count in stats['top_langs'])
         
-        await client.send_document(
+        await client.send_photo(
             chat_id=callback_query.message.chat.id,
-            document=bio_csv,
-            file_name=filename,
-            caption=f"📊 **Export Data for:** `{export_name}`\n\nIncluded: CSV (Detailed) and Summary Report.",
-            reply_to_message_id=callback_query.message.reply_to_message.id if callback_query.message.reply_to_message else None
-        )
-        
-        await client.send_document(
-            chat_id=callback_query.message.chat.id,
-            document=bio_txt,
-            file_name=summary_filename,
-            caption="📄 **Summary Report**",
-            reply_to_message_id=callback_query.message.reply_to_message.id if callback_query.message.reply_to_message else None
+            photo=png,
+            caption=(
+                f"📈 **Stats for:** `{group_data.group_name}`\n\n"
+                f"📊 **Total Clicks:** {stats['total']}\n"
+                f"📅 **Range:** {first} → {last}\n"
+                f"🔗 **Top Sources:** {sources_text}\n"
+                f"🌐 **Languages:** {langs_text}\n"
+                f"{analytics_freshness()}"
+            )
         )
-        
         await callback_query.message.delete()
-
+    
     except Exception as e:
-        print(f"Error in export_callback: {e}")
-        await callback_query.message.edit_text(f"❌ An error occurred during export: {e}")
+        print(f"Error in stats_callback: {e}")
+        await callback_query.message.edit_text(f"❌ An error occurred while building stats: {e}")
+
+@app.on_message(filters.command("topposts"))
+@rate_limited("menu")
+@serialize_per_user
+async def top_posts_handler(client: Client, message: Message):
+    """Show the most commented channel posts for a link collection."""
+    track_user(message.from_user)
+    user_id = message.from_user.id
+    
+    groups = get_user_link_groups(user_id)
+    
+    if not groups:
+        await message.reply_text("No link collections found.")
+        return
+
+    buttons = [
+        [InlineKeyboardButton(f"📂 {g.group_name}", callback_data=f"topposts_{g.group_id}")]
+        for g in groups
+    ]
+
+    await message.reply_text(
+        "💬 **Select a link collection to view top posts:**",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
+
+@app.on_callback_query(filters.regex(r"^topposts_"))
+@rate_limited("menu")
+@serialize_per_user
+async def top_posts_callback(client: Client, callback_query):
+    """Daftar post teratas dari tabel agregat post_stats."""
+    group_id = callback_query.data.split("_", 1)[1]
+    group_data = get_link_group(group_id)
+    
+    if not group_data or group_data.owner_id != callback_query.from_user.id:
+        await callback_query.answer("Access denied.", show_alert=True)
+        return
+    
+    await ensure_fresh_snapshot()
+    posts = await asyncio.get_running_loop().run_in_executor(None, get_top_posts, group_id)
+    if not posts:
+        await callback_query.message.edit_text("No comments on channel posts recorded for this collection yet.")
+        return
+    
+    lines = []
+    for i, post in enumerate(posts, 1):
+        if post['channel_username']:
+            title = f"[Post {post['post_id']}](https://t.me/{post['channel_username']}/{post['post_id']})"
+        else:
+            title = f"Post {post['post_id']}"
+        first = time.strftime('%Y-%m-%d %H:%M', time.gmtime(post['first_comment_at']))
+        last = time.strftime('%Y-%m-%d %H:%M', time.gmtime(post['last_comment_at']))
+        lines.append(
+            f"{i}. {title} — {post['comments']} comments, {post['unique_commenters']} commenters\n"
+            f"   🔗 Top source: {post['top_source']} · 🕒 {first} → {last}"
+        )
+    
+    await callback_query.message.edit_text(
+        f"💬 **Top Posts for:** `{group_data.group_name}`\n\n" + "\n".join(lines) + f"\n\n{analytics_freshness()}",
+        disable_web_page_preview=True
+    )
 
+@app.on_message(filters.command("search"))
+@rate_limited("menu")
+@serialize_per_user
+async def search_handler(client: Client, message: Message):
+    """Search tracked activity messages: /search <words>."""
+    track_user(message.from_user)
+    user_id = message.from_user.id
+    
+    parts = message.text.split(maxsplit=1)
+    words = parts[1].strip() if len(parts) > 1 else ""
+    query = fts_query(words)
+    if not query:
+        await message.reply_text(
+            "🔎 **Usage:** `/search <words>`\n\n"
+            "All words must match. End a word with `*` to match prefixes, e.g. `/search airdrop*`."
+        )
+        return
+    
+    groups = get_user_link_groups(user_id)
+    
+    if not groups:
+        await message.reply_text("No link collections found.")
+        return
+    
+    search_queries[user_id] = query
+    
+    buttons = [
+        [InlineKeyboardButton(f"📂 {g.group_name}", callback_data=f"search_0_{g.group_id}")]
+        for g in groups
+    ]
+    
+    await message.reply_text(
+        f"🔎 **Search:** `{words}`\n\nSelect a link collection:",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
 
+@app.on_callback_query(filters.regex(r"^search_"))
+@rate_limited("menu")
+@serialize_per_user
+async def search_callback(client: Client, callback_query):
+    """Satu halaman hasil pencarian; tombol Next memakai id pesan terakhir sebagai kursor."""
+    _, before_id, group_id = callback_query.data.split("_", 2)
+    before_id = int(before_id)
+    user_id = callback_query.from_user.id
+    group_data = get_link_group(group_id)
+    
+    if not group_data or group_data.owner_id != user_id:
+        await callback_query.answer("Access denied.", show_alert=True)
+        return
+    
+    query = search_queries.get(user_id)
+    if not query:
+        await callback_query.answer("Search expired. Send /search again.", show_alert=True)
+        return
+    
+    await ensure_fresh_snapshot()
+    try:
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            None, search_activity, group_id, group_data.owner_code, query, before_id, SEARCH_PAGE_SIZE + 1
+        )
+    except sqlite3.OperationalError as e:
+        print(f"Error in search_callback: {e}")
+        await callback_query.message.edit_text("❌ Search is not available yet. Please try again in a few minutes.")
+        return
+    
+    has_more = len(results) > SEARCH_PAGE_SIZE
+    results = results[:SEARCH_PAGE_SIZE]
+    
+    if not results:
+        await callback_query.message.edit_text(
+            "No more results." if before_id else f"No messages matching `{query}` in `{group_data.group_name}`."
+        )
+        return
+    
+    lines = []
+    for row in results:
+        who = f"@{row['username']}" if row['username'] else f"`{row['user_id']}`"
+        chat = row['chat_title'] or (f"@{row['chat_username']}" if row['chat_username'] else "?")
+        post = f" · post {row['post_id']}" if row['post_id'] else ""
+        lines.append(f"👤 {who} · 💬 {chat}{post} · 🕒 {row['timestamp']}\n   {row['snippet']}")
+    
+    buttons = []
+    if has_more:
+        buttons.append([InlineKeyboardButton("Next ▶", callback_data=f"search_{results[-1]['id']}_{group_id}")])
+    if before_id:
+        buttons.append([InlineKeyboardButton("⏮ First page", callback_data=f"search_0_{group_id}")])
+    
+    await callback_query.message.edit_text(
+        f"🔎 **Results for** `{query}` **in** `{group_data.group_name}`\n\n" + "\n\n".join(lines) +
+        f"\n\n{analytics_freshness()}",
+        reply_markup=InlineKeyboardMarkup(buttons) if buttons else None,
+        disable_web_page_preview=True
+    )
 
 @app.on_message(filters.command("activity"))
+@rate_limited("menu")
+@serialize_per_user
 async def activity_handler(client: Client, message: Message):
-    """Export user activity data for tracked links."""
+    """Export user activity data for tracked links (Parquet with `/activity parquet`)."""
     try:
         track_user(message.from_user)
         user_id = message.from_user.id
         
+        # Format opsional: /activity parquet
+        use_parquet = len(message.command) > 1 and message.command[1].lower() == "parquet"
+        if use_parquet and not parquet_available():
+            await message.reply_text("❌ Parquet export is not available on this server (pyarrow is not installed).")
+            return
+        prefix = "actpq" if use_parquet else "activity"
+        
         # 1. Get Multi-Link Groups
         groups = get_user_link_groups(user_id)
         
@@ -1840,62 +5431,61 @@ async def activity_handler(client: Client, message: Message):
         # Membuat tombol
         buttons = []
         
-        # Tambahkan Grup
-        conn = sqlite3.connect(DB_PATH)
+        # Tambahkan Grup (jumlah aktivitas dari snapshot analitik)
+        await ensure_fresh_snapshot()
+        conn = connect_analytics()
         cursor = conn.cursor()
         for g in groups:
             # Ambil jumlah aktivitas untuk grup ini
-            cursor.execute('SELECT COUNT(*) FROM user_activity WHERE link_id = ? OR owner_code = ?', (g['group_id'], g['owner_code']))
+            cursor.execute(
+                'SELECT COUNT(DISTINCT activity_id) FROM activity_links WHERE link_id = ? OR owner_code = ?',
+                (g.group_id, g.owner_code)
+            )
             act_count = cursor.fetchone()[0]
             
-            btn_text = f"📂 {g['group_name']} ({act_count})"
-            buttons.append([InlineKeyboardButton(btn_text, callback_data=f"activity_{g['group_id']}")])
+            btn_text = f"📂 {g.group_name} ({act_count})"
+            buttons.append([InlineKeyboardButton(btn_text, callback_data=f"{prefix}_{g.group_id}")])
         conn.close()
 
         await message.reply_text(
-            "📊 **Select a link collection to export activity:**\n",
+            f"📊 **Select a link collection to export activity:**\n{analytics_freshness()}",
             reply_markup=InlineKeyboardMarkup(buttons)
         )
     except Exception as e:
         print(f"Error in activity handler: {e}")
         await message.reply_text("An error occurred. Please try again later.")
 
-@app.on_callback_query(filters.regex(r"^activity_"))
+@app.on_callback_query(filters.regex(r"^(activity|actpq)_"))
+@rate_limited("menu")
+@serialize_per_user
 async def activity_callback(client: Client, callback_query):
     """Callback untuk export data aktivitas (Advanced Tracking)."""
     try:
-        doc_id = callback_query.data.split("_", 1)[1]
+        prefix, doc_id = callback_query.data.split("_", 1)
+        export_format = 'parquet' if prefix == "actpq" else 'csv'
         user_id = callback_query.from_user.id
         
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # 1. Ensure target is Link Group
-        cursor.execute('SELECT * FROM link_groups WHERE group_id = ?', (doc_id,))
-        group_row = cursor.fetchone()
+        link_data = get_link_group(doc_id)
         
-        if not group_row:
-             conn.close()
+        if not link_data:
              await callback_query.answer("Link collection not found.", show_alert=True)
              return
              
-        if group_row['owner_id'] != user_id:
-             conn.close()
+        if link_data.owner_id != user_id:
              await callback_query.answer("Access denied.", show_alert=True)
              return
              
-        link_data = dict(group_row)
-        export_name = link_data.get('group_name', doc_id)
-        owner_code = link_data.get('owner_code')
-                
-        conn.close() # Tutup untuk operasi async
+        export_name = link_data.group_name
+        owner_code = link_data.owner_code
+
+        # Data belum berubah sejak export terakhir: kirim ulang via file_id
+        export_type = f"activity_{export_format}"
+        watermark = get_export_watermark(doc_id, owner_code)
+        if await send_cached_export(client, callback_query, doc_id, export_type, watermark):
+            await callback_query.message.delete()
+            return
 
-        await callback_query.message.edit_text("⏳ Analyzing channels & activity logs... (This may take a moment)")
-        
-        # 2. Resolusi Chat ID (Saluran Target & Grup Diskusi Tertaut)
-        target_chat_ids = set()
-        
         # Helper untuk ekstrak username
         def get_username_from_url(url):
             if not url: return None
@@ -1908,113 +5498,194 @@ async def activity_callback(client: Client, callback_query):
                 return url
             return None
 
-        # Kumpulkan username dari item grup
-        usernames_to_resolve = []
-        items = get_link_items(doc_id)
-        for item in items:
-            u = get_username_from_url(item['target_url'])
-            if u: usernames_to_resolve.append(u)
+        async def run(job: ExportJob):
+            await job.status_message.edit_text(
+                "⏳ Analyzing channels & activity logs... (This may take a moment)",
+                reply_markup=job.cancel_markup()
+            )
             
-        # Resolusi melalui Telegram API
-        for uname in usernames_to_resolve:
-            try:
-                chat = await client.get_chat(uname)
-                target_chat_ids.add(chat.id)
-                if chat.linked_chat:
-                    target_chat_ids.add(chat.linked_chat.id)
-            except Exception:
-                # Abaikan username tidak valid atau chat tidak dapat diakses
-                pass
+            # 2. Resolusi Chat ID (Saluran Target & Grup Diskusi Tertaut)
+            target_chat_ids = set()
+
+            # Kumpulkan username dari item grup
+            usernames_to_resolve = []
+            items = get_link_items(doc_id)
+            for item in items:
+                u = get_username_from_url(item.target_url)
+                if u: usernames_to_resolve.append(u)
                 
-        # 3. Kueri Data Aktivitas
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        if not target_chat_ids:
-            # Fallback jika tidak ada id yang berhasil di-resolve
-            cursor.execute('''
-                SELECT user_id, username, chat_id, chat_title, chat_username, 
-                       owner_code, message_text, message_id, timestamp, link_id, post_id
-                FROM user_activity 
-                WHERE link_id = ?
-                ORDER BY timestamp DESC
-            ''', (doc_id,))
-        else:
-            # Query Dinamis menggunakan IN clause
-            ids_list = list(target_chat_ids)
-            placeholders = ','.join('?' for _ in ids_list)
-            
-            # Logika Kueri:
-            # - Cocokkan link_id
-            # - ATAU Cocokkan owner_code DAN chat_id ada di target (aktivitas terdeteksi di grup relevan)
-            sql = f'''
-                SELECT user_id, username, chat_id, chat_title, chat_username, 
-                       owner_code, message_text, message_id, timestamp, link_id, post_id
-                FROM user_activity 
-                WHERE link_id = ? 
-                   OR (owner_code = ? AND chat_id IN ({placeholders}))
-                ORDER BY timestamp DESC
-            '''
-            params = [doc_id, owner_code] + ids_list
-            cursor.execute(sql, params)
+            # Resolusi melalui Telegram API
+            for uname in usernames_to_resolve:
+                try:
+                    chat = await client.get_chat(uname)
+                    target_chat_ids.add(chat.id)
+                    if chat.linked_chat:
+                        target_chat_ids.add(chat.linked_chat.id)
+                except Exception:
+                    # Abaikan username tidak valid atau chat tidak dapat diakses
+                    pass
+                    
+            # 3. Kueri Data Aktivitas & Buat CSV (di thread pool export)
+            writer = await run_export_builder(
+                job,
+                f"⏳ Generating activity {export_format.upper()}...",
+                build_activity_export, doc_id, link_data, target_chat_ids, export_format
+            )
+
+            if writer is None:
+                await job.status_message.edit_text("No activity recorded yet.")
+                return
+
+            # Kirim File
+            try:
+                if job.cancel_event.is_set():
+                    raise ExportCancelled()
+                documents = await send_export_parts(
+                    client,
+                    callback_query,
+                    writer.close(),
+                    f"📊 **Activity Log for:** `{export_name}`\n"
+                    f"Found {writer.row_count} activities across"
+                )
+            finally:
+                writer.cleanup()
+
+            save_export_cache(doc_id, export_type, watermark, documents)
+
+            await job.status_message.delete()
+
+        job = await enqueue_export_job((doc_id, export_type), user_id, callback_query.message, run, callback_query)
+        if job is None:
+            await callback_query.answer("This export is already in progress.", show_alert=True)
+
+    except Exception as e:
+        print(f"Error in activity_callback: {e}")
+        try:
+            await callback_query.message.edit_text(f"❌ An error occurred generating the file: {str(e)[:100]}")
+        except Exception as edit_error:
+            # Pesan status mungkin sudah dihapus atau isinya sama
+            print(f"Error reporting activity_callback failure: {edit_error}")
+
+@app.on_message(filters.command("members"))
+@rate_limited("menu")
+@serialize_per_user
+async def members_handler(client: Client, message: Message):
+    """Export members of the chats targeted by a link collection (`/members [parquet] [clicked]`)."""
+    track_user(message.from_user)
+    user_id = message.from_user.id
+    
+    # Opsi: parquet (format bertipe), clicked (hanya anggota yang datang lewat link owner)
+    options = [arg.lower() for arg in message.command[1:]]
+    use_parquet = 'parquet' in options
+    if use_parquet and not parquet_available():
+        await message.reply_text("❌ Parquet export is not available on this server (pyarrow is not installed).")
+        return
+    opts = ('p' if use_parquet else 'c') + ('k' if 'clicked' in options else '')
+    
+    groups = get_user_link_groups(user_id)
+    
+    if not groups:
+        await message.reply_text("No link collections found.")
+        return
+    
+    buttons = [
+        [InlineKeyboardButton(f"📂 {g.group_name}", callback_data=f"members_{opts}_{g.group_id}")]
+        for g in groups
+    ]
+    
+    await message.reply_text(
+        "👥 **Select a link collection to export members of its target chats:**",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
 
+@app.on_callback_query(filters.regex(r"^members_"))
+@rate_limited("menu")
+@serialize_per_user
+async def members_callback(client: Client, callback_query):
+    """Export anggota chat target koleksi, streaming dari data.db."""
+    try:
+        _, opts, group_id = callback_query.data.split("_", 2)
+        export_format = 'parquet' if opts.startswith('p') else 'csv'
+        clicked_only = opts.endswith('k')
+        user_id = callback_query.from_user.id
         
-        activities = cursor.fetchall()
-        conn.close()
+        group_data = get_link_group(group_id)
         
-        if len(activities) == 0:
-            await callback_query.message.edit_text("No activity recorded yet.")
+        if not group_data or group_data.owner_id != user_id:
+            await callback_query.answer("Access denied.", show_alert=True)
             return
         
-        # 4. Buat CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['User ID', 'Username', 'Chat ID', 'Chat Title', 'ID Post', 'Timestamp', 'Message'])
-        
-        for activity in activities:
-            # Potong pesan untuk pratinjau
-            msg_text = activity['message_text'][:200] if activity['message_text'] else ""
-            
-            writer.writerow([
-                activity['user_id'],
-                activity['username'],
-                activity['chat_id'],
-                activity['chat_title'],
-                activity['post_id'] or "",
-                activity['timestamp'],
-                msg_text
-            ])
-            
-        output.seek(0)
-        
-        # Kirim File
-        safe_name = "".join(x for x in export_name if x.isalnum() or x in ('_','-'))
-        filename = f"activity_{safe_name}.csv"
-        
-        bio = io.BytesIO(output.getvalue().encode('utf-8'))
-        bio.name = filename
-        
-        await client.send_document(
-            chat_id=callback_query.message.chat.id,
-            document=bio,
-            file_name=filename,
-            caption=f"📊 **Activity Log for:** `{export_name}`\n"
-                    f"Found {len(activities)} activities across",
-            reply_to_message_id=callback_query.message.reply_to_message.id if callback_query.message.reply_to_message else None
+        chat_ids = get_target_chat_ids(group_id)
+        if not chat_ids:
+            await callback_query.message.edit_text(
+                "No target chats resolved for this collection yet. Add a Telegram link to it first."
+            )
+            return
+
+        async def run(job: ExportJob):
+            writer = await run_export_builder(
+                job,
+                f"⏳ Generating members {export_format.upper()}...",
+                build_members_export, group_id, group_data.group_name, chat_ids, export_format, clicked_only
+            )
+
+            if writer is None:
+                await job.status_message.edit_text("No members recorded for these chats yet.")
+                return
+
+            try:
+                if job.cancel_event.is_set():
+                    raise ExportCancelled()
+                await send_export_parts(
+                    client,
+                    callback_query,
+                    writer.close(),
+                    f"👥 **Members for:** `{group_data.group_name}`\n"
+                    f"Found {writer.row_count} members in {len(chat_ids)} chat(s)"
+                    + (" who arrived through your links" if clicked_only else ""),
+                    dated=False
+                )
+            finally:
+                writer.cleanup()
+
+            await job.status_message.delete()
+
+        job = await enqueue_export_job(
+            (group_id, f"members_{opts}"), user_id, callback_query.message, run, callback_query
         )
-        
-        await callback_query.message.delete()
+        if job is None:
+            await callback_query.answer("This export is already in progress.", show_alert=True)
 
     except Exception as e:
-        print(f"Error in activity_callback: {e}")
-        try:
-            await callback_query.message.edit_text(f"❌ Error: {str(e)[:100]}")
-        except:
-            pass
-        await callback_query.message.edit_text("An error occurred generating the file.")
+        print(f"Error in members_callback: {e}")
+        await callback_query.message.edit_text(f"❌ An error occurred during export: {e}")
+
+@app.on_callback_query(filters.regex(r"^expcancel_"))
+@rate_limited("menu")
+@serialize_per_user
+async def export_cancel_callback(client: Client, callback_query):
+    """Batalkan job export yang sedang antri atau berjalan."""
+    job_id = int(callback_query.data.split("_", 1)[1])
+    job = export_jobs.get(job_id)
+    
+    if not job:
+        await callback_query.answer("This export has already finished.", show_alert=True)
+        return
+    
+    if job.owner_id != callback_query.from_user.id:
+        await callback_query.answer("Access denied.", show_alert=True)
+        return
+    
+    job.cancel_event.set()
+    await callback_query.answer("Cancelling export...")
+    
+    # Job yang masih antri langsung ditandai batal; worker akan melewatinya
+    if not job.started:
+        await job.status_message.edit_text("❌ Export cancelled.")
 
 @app.on_message(filters.command("deletegroup"))
+@rate_limited("menu")
+@serialize_per_user
 async def deletegroup_handler(client: Client, message: Message):
     """Delete a link group or legacy link."""
     track_user(message.from_user)
@@ -2027,7 +5698,7 @@ async def deletegroup_handler(client: Client, message: Message):
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM links WHERE owner_id = ?', (user_id,))
+    cursor.execute('SELECT * FROM links WHERE owner_id = ? AND deleted_at IS NULL', (user_id,))
     legacy_links = {row['link_id']: dict(row) for row in cursor.fetchall()}
     conn.close()
     
@@ -2039,8 +5710,8 @@ async def deletegroup_handler(client: Client, message: Message):
     
     # Tombol untuk link groups
     for g in groups:
-        btn_text = f"📂 {g['group_name']} ({g['item_count']} links)"
-        buttons.append([InlineKeyboardButton(btn_text, callback_data=f"delgrpsel_{g['group_id']}")])
+        btn_text = f"📂 {g.group_name} ({g.item_count} links)"
+        buttons.append([InlineKeyboardButton(btn_text, callback_data=f"delgrpsel_{g.group_id}")])
     
     # Tombol untuk legacy links
     for doc_id, data in legacy_links.items():
@@ -2053,6 +5724,8 @@ async def deletegroup_handler(client: Client, message: Message):
     )
 
 @app.on_callback_query(filters.regex(r"^delgrpsel_"))
+@rate_limited("menu")
+@serialize_per_user
 async def delete_group_select_callback(client: Client, callback_query):
     """Handle link group selection for deletion - show confirmation."""
     group_id = callback_query.data.split("_", 1)[1]
@@ -2060,7 +5733,7 @@ async def delete_group_select_callback(client: Client, callback_query):
     
     group_data = get_link_group(group_id)
     
-    if not group_data or group_data['owner_id'] != user_id:
+    if not group_data or group_data.owner_id != user_id:
         await callback_query.answer("Group not found or access denied.", show_alert=True)
         return
     
@@ -2074,14 +5747,16 @@ async def delete_group_select_callback(client: Client, callback_query):
     await callback_query.message.edit_text(
         f"⚠️ **Confirm Deletion**\n\n"
         f"Are you sure you want to delete this link group?\n\n"
-        f"📂 **Name:** {group_data['group_name']}\n"
+        f"📂 **Name:** {group_data.group_name}\n"
         f"🔗 **Links:** {len(items)}\n"
-        f"📊 **Clicks:** {group_data['clicks']}\n\n"
+        f"📊 **Clicks:** {group_data.clicks}\n\n"
         f"This will delete the group and all its links.",
         reply_markup=keyboard
     )
 
 @app.on_callback_query(filters.regex(r"^delgrpconf_"))
+@rate_limited("menu")
+@serialize_per_user
 async def delete_group_confirm_callback(client: Client, callback_query):
     """Handle group deletion confirmation."""
     group_id = callback_query.data.split("_", 1)[1]
@@ -2089,34 +5764,32 @@ async def delete_group_confirm_callback(client: Client, callback_query):
     
     group_data = get_link_group(group_id)
     
-    if not group_data or group_data['owner_id'] != user_id:
+    if not group_data or group_data.owner_id != user_id:
         await callback_query.answer("Access denied.", show_alert=True)
         return
     
-    group_name = group_data['group_name']
+    group_name = group_data.group_name
     
-    # Hapus grup dan semua items
+    # Tandai dihapus; items, klik dan aktivitas dibersihkan reaper di latar belakang
     delete_link_group(group_id)
-    
-    # Hapus juga click_stats yang terkait
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM click_stats WHERE link_id = ?', (group_id,))
-    conn.commit()
-    conn.close()
+    reaper_wakeup.set()
     
     await callback_query.message.edit_text(
         f"✅ **Link Group Deleted**\n\n"
         f"📂 **{group_name}** has been removed.\n"
-        f"All links and click stats have been deleted."
+        f"Its links and click stats are being cleaned up in the background."
     )
 
 @app.on_callback_query(filters.regex(r"^delgrpcanc_"))
+@rate_limited("menu")
+@serialize_per_user
 async def delete_group_cancel_callback(client: Client, callback_query):
     """Handle group deletion cancellation."""
     await callback_query.message.edit_text("❌ Deletion cancelled.")
 
 @app.on_callback_query(filters.regex(r"^delsel_"))
+@rate_limited("menu")
+@serialize_per_user
 async def delete_select_callback(client: Client, callback_query):
     """Handle link selection for deletion - show confirmation."""
     doc_id = callback_query.data.split("_", 1)[1]
@@ -2126,7 +5799,7 @@ async def delete_select_callback(client: Client, callback_query):
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM links WHERE link_id = ?', (doc_id,))
+    cursor.execute('SELECT * FROM links WHERE link_id = ? AND deleted_at IS NULL', (doc_id,))
     link_row = cursor.fetchone()
     conn.close()
     
@@ -2152,6 +5825,8 @@ async def delete_select_callback(client: Client, callback_query):
     )
 
 @app.on_callback_query(filters.regex(r"^delconf_"))
+@rate_limited("menu")
+@serialize_per_user
 async def delete_confirm_callback(client: Client, callback_query):
     """Handle deletion confirmation."""
     doc_id = callback_query.data.split("_", 1)[1]
@@ -2161,7 +5836,7 @@ async def delete_confirm_callback(client: Client, callback_query):
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM links WHERE link_id = ?', (doc_id,))
+    cursor.execute('SELECT * FROM links WHERE link_id = ? AND deleted_at IS NULL', (doc_id,))
     link_row = cursor.fetchone()
     
     if not link_row or link_row['owner_id'] != callback_query.from_user.id:
@@ -2171,21 +5846,21 @@ async def delete_confirm_callback(client: Client, callback_query):
     
     link_data = dict(link_row)
     
-    # Delete cascading: user_activity -> click_stats -> links
-    cursor.execute('DELETE FROM user_activity WHERE link_id = ?', (doc_id,))
-    cursor.execute('DELETE FROM click_stats WHERE link_id = ?', (doc_id,))
-    cursor.execute('DELETE FROM links WHERE link_id = ?', (doc_id,))
-    
-    conn.commit()
     conn.close()
     
+    # Tandai dihapus; klik dan aktivitas dibersihkan reaper di latar belakang
+    delete_link(doc_id)
+    reaper_wakeup.set()
+    
     await callback_query.message.edit_text(
         f"✅ **Link Deleted Successfully**\\n\\n"
         f"🎯 @{link_data.get('username_target')} has been removed.\\n"
-        f"All associated data (clicks and activity logs) have also been deleted."
+        f"Associated clicks and activity logs are being cleaned up in the background."
     )
 
 @app.on_callback_query(filters.regex(r"^delcanc_"))
+@rate_limited("menu")
+@serialize_per_user
 async def delete_cancel_callback(client: Client, callback_query):
     """Handle deletion cancellation."""
     await callback_query.message.edit_text("❌ Deletion cancelled.")
@@ -2193,62 +5868,111 @@ async def delete_cancel_callback(client: Client, callback_query):
 # --- Activity Monitoring Handlers ---
 @app.on_message(filters.group & ~filters.bot & ~filters.service)
 async def monitor_group_activity(client: Client, message: Message):
-    """Monitor user activity in groups."""
+    """Monitor user activity in groups (diproses di antrean pasif berprioritas rendah)."""
     try:
-        track_user(message.from_user)
-        # Skip if no user
-        if not message.from_user:
-            return
-        
-        # Save group info (passive tracking)
-        save_group_to_db(message.chat)
-        
-        # Save member info (passive tracking)
-        save_member_to_db(message.chat.id, message.from_user)
-        
-        # Skip if no text (for activity logging)
-        if not (message.text or message.caption):
-            return
-        
-        user_id = message.from_user.id
-        chat_id = message.chat.id
-        chat_username = message.chat.username
+        enqueue_passive_message(message)
+    except Exception as e:
+        print(f"Error monitoring group activity: {e}")
 
-        if not (chat_username or chat_id):
-            # Cannot track without username since we rely on username_target
-            return
+@app.on_message(filters.group & filters.new_chat_members)
+async def track_new_members(client: Client, message: Message):
+    """Catat member baru untuk atribusi konversi klik -> join."""
+    joined_at = int(message.date.timestamp()) if message.date else int(time.time())
+    for member in message.new_chat_members:
+        if not member.is_bot:
+            queue_conversion(message.chat.id, message.chat.username, member.id, joined_at)
 
-        # Get tracked links for this user in this chat
-        tracked_links = await get_user_tracked_links(user_id, chat_username, chat_id)
-        if not tracked_links:
-            return
+@app.on_chat_member_updated()
+async def track_chat_member_join(client: Client, update):
+    """Join via chat_member update (channel tidak punya service message new_chat_members)."""
+    new_member = update.new_chat_member
+    old_member = update.old_chat_member
+    if not new_member or not new_member.user or new_member.user.is_bot:
+        return
+    if new_member.status != ChatMemberStatus.MEMBER:
+        return
+    if old_member and old_member.status not in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED):
+        return
+    joined_at = int(update.date.timestamp()) if update.date else int(time.time())
+    queue_conversion(update.chat.id, update.chat.username, new_member.user.id, joined_at)
 
-        # Log activity for the first tracked link (or all if needed)
-        for link in tracked_links:
-            # Cek apakah ini komentar dia sendiri (reply to message)
-            # Biasanya di discussion group, message adalah reply ke channel post.
-            post_id = None
-            if message.reply_to_message and message.reply_to_message.forward_from_message_id:
-                post_id = message.reply_to_message.forward_from_message_id
-            
-            log_user_activity(
-                user_id=user_id,
-                username=message.from_user.username or "",
-                chat_id=chat_id,
-                chat_title=message.chat.title or "",
-                chat_username=chat_username,
-                owner_code=link['owner_code'],
-                link_id=link['link_id'],
-                message_text=message.text or message.caption,
-                message_id=message.id,
-                post_id=post_id
-            )
 
-    except Exception as e:
-        print(f"Error monitoring group activity: {e}")
+@app.on_raw_update(group=-1)
+async def log_first_update(client: Client, update, users, chats):
+    """Catat waktu dari start hingga update pertama diproses (ukuran kecepatan restart)."""
+    global first_update_logged
+    if first_update_logged or startup_started is None:
+        return
+    first_update_logged = True
+    print(f"First update handled {time.monotonic() - startup_started:.2f}s after start")
+
+async def start_background_tasks():
+    """Jalankan tugas latar belakang di event loop bot (sekali per proses, tidak ikut restart client)."""
+    loop = asyncio.get_running_loop()
+    replay_click_journal()
+    loop.create_task(click_journal_sync_loop())
+    loop.create_task(click_journal_apply_loop())
+    loop.create_task(passive_worker())
+    if SNAPSHOT_INTERVAL > 0:
+        loop.create_task(analytics_snapshot_loop())
+    if BACKUP_INTERVAL > 0:
+        loop.create_task(backup_loop())
+    loop.create_task(heavy_hitters_persist_loop())
+    loop.create_task(conversion_flush_loop())
+    loop.create_task(reaper_loop())
+    loop.create_task(gc_loop())
+    loop.create_task(admission_sweep_loop())
+
+async def start_client():
+    """Start client Pyrogram lalu jadwalkan pemanasan peer. Dipakai main() dan supervisor di main.py."""
+    global startup_started, first_update_logged
+    startup_started = time.monotonic()
+    first_update_logged = False
+    await app.start()
+    print(f"Client started in {time.monotonic() - startup_started:.2f}s (session: {SESSION_DIR}/{SESSION_NAME}.session)")
+    asyncio.get_running_loop().create_task(warm_up_peers(app))
+
+async def flush_state():
+    """Simpan state yang masih di memori (antrean pasif, jurnal klik, buffer konversi, heavy hitters) sebelum proses berhenti."""
+    await drain_passive_queue()
+    await flush_click_journal()
+    await flush_conversions()
+    click_journal.close()
+    await persist_heavy_hitters()
 
+async def main():
+    # Replay jurnal klik sebelum update pertama diterima
+    await start_background_tasks()
+    await start_client()
+    await idle()
+    await flush_state()
+    await app.stop()
 
 if __name__ == "__main__":
+    # `python link_tracker_bot.py restore` memulihkan kedua database dari backup terbaru (bot harus berhenti)
+    if len(sys.argv) > 1 and sys.argv[1] == "restore":
+        for db_path in (DB_PATH, DATA_DB_PATH):
+            backup_path = restore_database(db_path)
+            print(f"Restored {db_path} from {backup_path}" if backup_path else f"No usable backup for {db_path}")
+        sys.exit(0)
+
+    # `python link_tracker_bot.py migrate` hanya menjalankan migrasi skema (plus VACUUM satu kali
+    # untuk incremental vacuum pada database lama) lalu keluar,
+    # `python link_tracker_bot.py backup` membuat backup kedua database sekarang lalu keluar
+    try:
+        init_databases()
+    except Exception as e:
+        print(f"Failed to initialize database: {e}")
+        sys.exit(1)
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        vacuum_database(DB_PATH)
+        vacuum_database(DATA_DB_PATH)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "backup":
+        backup_databases(force=True)
+        sys.exit(0)
+
+    validate_config()
     print("Starting Link Tracker Bot...")
-    app.run()
+    app.run(main())
 
@@ -1,17 +1,201 @@
-from flask import Flask
-import subprocess
 import os
+import sys
+import time
+import signal
+import asyncio
 
-app = Flask(__name__)
+import link_tracker_bot as bot
 
-@app.route('/')
-@app.route('/health')
-def health():
-    return "✅ Link Tracker Bot LIVE!"
+# Konfigurasi
+PORT = int(os.environ.get("PORT", 8080))
+
+# Supervisi client: jeda restart awal & maksimum (detik, backoff eksponensial),
+# interval cek liveness (detik) dan jumlah gagal berturut-turut sebelum client di-restart
+RESTART_DELAY = float(os.getenv("RESTART_DELAY", "5"))
+RESTART_MAX_DELAY = float(os.getenv("RESTART_MAX_DELAY", "300"))
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "60"))
+WATCHDOG_FAILURES = int(os.getenv("WATCHDOG_FAILURES", "3"))
+
+process_started = time.monotonic()
+client_up = False
+client_restarts = 0
+
+# --- Health & Metrics HTTP ---
+
+def rss_bytes() -> int:
+    """RSS proses saat ini (Linux), 0 jika tidak tersedia."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def render_metrics() -> str:
+    """Metrik dalam format teks Prometheus."""
+    metrics = [
+        ("link_tracker_client_up", "gauge", int(client_up)),
+        ("link_tracker_client_restarts_total", "counter", client_restarts),
+        ("link_tracker_uptime_seconds", "gauge", round(time.monotonic() - process_started, 1)),
+        ("link_tracker_rss_bytes", "gauge", rss_bytes()),
+        ("link_tracker_export_jobs", "gauge", len(bot.export_jobs)),
+        ("link_tracker_conversion_buffer", "gauge", len(bot.conversion_buffer)),
+        ("link_tracker_passive_backlog", "gauge", bot.passive_queue.qsize()),
+        ("link_tracker_busy_users", "gauge", len(bot.user_queues)),
+        ("link_tracker_rate_limited_users", "gauge", sum(map(len, bot.admission_buckets.values()))),
+    ]
+    metrics += [
+        (f"link_tracker_passive_{name}_total", "counter", value)
+        for name, value in bot.passive_stats.items()
+    ]
+    metrics += [
+        (f"link_tracker_click_journal_{name}_total", "counter", value)
+        for name, value in bot.click_journal_stats.items()
+    ]
+    metrics += [
+        (f"link_tracker_backup_{name}_total", "counter", value)
+        for name, value in bot.backup_stats.items()
+    ]
+    metrics += [
+        (f"link_tracker_admission_{command_class}_{name}_total", "counter", value)
+        for command_class, stats in bot.admission_stats.items()
+        for name, value in stats.items()
+    ]
+    lines = []
+    for name, kind, value in metrics:
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+async def handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Server HTTP minimal: GET / dan /health (status client), GET /metrics."""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Header tidak dipakai, cukup dibaca sampai baris kosong
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        method, path = (parts[0], parts[1].split('?')[0]) if len(parts) >= 2 else ('', '')
+
+        if method not in ('GET', 'HEAD'):
+            status, body, content_type = "405 Method Not Allowed", "Method not allowed\n", "text/plain"
+        elif path in ('/', '/health'):
+            if client_up:
+                status, body = "200 OK", "✅ Link Tracker Bot LIVE!\n"
+            else:
+                status, body = "503 Service Unavailable", "⏳ Link Tracker Bot starting/restarting\n"
+            content_type = "text/plain; charset=utf-8"
+        elif path == '/metrics':
+            status, body, content_type = "200 OK", render_metrics(), "text/plain; version=0.0.4"
+        else:
+            status, body, content_type = "404 Not Found", "Not found\n", "text/plain"
+
+        payload = body.encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1')
+        )
+        if method != 'HEAD':
+            writer.write(payload)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+# --- Supervisi Client ---
+
+async def watch_client(stop: asyncio.Event):
+    """Tunggu sampai stop; lempar error jika client berulang kali tidak merespons."""
+    failures = 0
+    while True:
+        try:
+            await asyncio.wait_for(stop.wait(), WATCHDOG_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await asyncio.wait_for(bot.app.get_me(), WATCHDOG_INTERVAL)
+            failures = 0
+        except Exception as e:
+            failures += 1
+            print(f"Watchdog: client check failed ({failures}/{WATCHDOG_FAILURES}): {e!r}")
+            if failures >= WATCHDOG_FAILURES:
+                raise RuntimeError("client unresponsive")
+
+async def stop_client():
+    """Hentikan client, baik yang sudah berjalan penuh maupun yang baru setengah start."""
+    try:
+        if bot.app.is_initialized:
+            await bot.app.stop()
+        elif bot.app.is_connected:
+            await bot.app.disconnect()
+    except Exception as e:
+        print(f"Error stopping client: {e!r}")
+
+async def supervise_client(stop: asyncio.Event):
+    """Jalankan client Pyrogram dan restart dengan backoff jika gagal start atau mati."""
+    global client_up, client_restarts
+    delay = RESTART_DELAY
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            await bot.start_client()
+            client_up = True
+            await watch_client(stop)
+        except Exception as e:
+            client_up = False
+            print(f"Client failed: {e!r}")
+            await stop_client()
+            # Client yang sempat berjalan lama mulai lagi dari jeda awal
+            if time.monotonic() - started > RESTART_MAX_DELAY:
+                delay = RESTART_DELAY
+            client_restarts += 1
+            print(f"Restarting client in {delay:g}s")
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, RESTART_MAX_DELAY)
+
+    client_up = False
+
+async def serve():
+    """Satu proses, satu event loop: client Pyrogram + server health/metrics + tugas latar belakang."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    server = await asyncio.start_server(handle_http, "0.0.0.0", PORT)
+    print(f"Health server listening on port {PORT} ({time.monotonic() - process_started:.2f}s after start)")
+    await bot.start_background_tasks()
+    supervisor = loop.create_task(supervise_client(stop))
+
+    def request_stop():
+        stop.set()
+        # Percobaan start (koneksi atau jeda backoff) yang sedang berjalan tidak perlu ditunggu
+        if not client_up:
+            supervisor.cancel()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, request_stop)
+
+    try:
+        await supervisor
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await stop_client()
+        server.close()
+        await server.wait_closed()
+        await bot.flush_state()
 
 if __name__ == "__main__":
-    # BOT DI PROSES TERPISAH = 100% WORK!
-    subprocess.Popen(["python", "link_tracker_bot.py"])
-    
-    port = int(os.environ.get("PORT", 8080))
-    app.run(host="0.0.0.0", port=port)
+    try:
+        bot.init_databases()
+    except Exception as e:
+        print(f"Failed to initialize database: {e}")
+        sys.exit(1)
+    bot.validate_config()
+
+    print("Starting Link Tracker Bot...")
+    # app.run memakai event loop yang sama dengan Client (dibuat saat import)
+    bot.app.run(serve())
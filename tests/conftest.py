@@ -0,0 +1,70 @@
+"""Fixture bersama untuk test link_tracker_bot.
+
+Modul bot membaca konfigurasi dari environment saat di-import, jadi environment minimal di-set
+di sini sebelum import pertama. Setiap test mendapat database baru di tmp_path.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_env_dir = tempfile.mkdtemp(prefix="link_tracker_tests_")
+for _name, _value in {
+    "API_ID": "1",
+    "API_HASH": "test",
+    "BOT_TOKEN": "1:test",
+    "DB_PATH": os.path.join(_env_dir, "link_tracker.db"),
+    "DATA_DB_PATH": os.path.join(_env_dir, "data.db"),
+    "ANALYTICS_DB_PATH": os.path.join(_env_dir, "analytics.db"),
+    "SNAPSHOT_INTERVAL": "0",
+    "BACKUP_INTERVAL": "0",
+    "RATE_CLICK_BURST": "0",
+    "RATE_MENU_BURST": "0",
+    "RATE_EXPORT_BURST": "0",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """Modul link_tracker_bot dengan database kosong di tmp_path dan state global bersih."""
+    import link_tracker_bot
+
+    for name, filename in (
+        ("DB_PATH", "link_tracker.db"),
+        ("DATA_DB_PATH", "data.db"),
+        ("ANALYTICS_DB_PATH", "analytics.db"),
+        ("CLICK_JOURNAL_DIR", "click_journal"),
+        ("BACKUP_DIR", "backups"),
+    ):
+        monkeypatch.setattr(link_tracker_bot, name, str(tmp_path / filename))
+
+    # State per proses; primitif asyncio terikat ke event loop pertama yang memakainya
+    for name, value in (
+        ("source_ids", {}),
+        ("heavy_hitters", OrderedDict()),
+        ("heavy_hitters_pending", {}),
+        ("heavy_hitters_loads", {}),
+        ("conversion_buffer", []),
+        ("search_queries", {}),
+        ("export_jobs", {}),
+        ("active_export_keys", {}),
+        ("_export_queue", None),
+        ("user_states", {}),
+        ("user_queues", {}),
+        ("click_journal", link_tracker_bot.ClickJournal()),
+        ("click_journal_lock", asyncio.Lock()),
+        ("conversion_flush_lock", asyncio.Lock()),
+        ("reaper_wakeup", asyncio.Event()),
+        ("passive_queue", asyncio.Queue(maxsize=link_tracker_bot.PASSIVE_QUEUE_SIZE)),
+    ):
+        monkeypatch.setattr(link_tracker_bot, name, value)
+
+    link_tracker_bot.init_databases()
+    return link_tracker_bot
@@ -0,0 +1,75 @@
+"""Pengganti minimal objek Pyrogram (Message, CallbackQuery, Client) untuk memanggil handler langsung."""
+import asyncio
+import itertools
+import random
+from types import SimpleNamespace
+
+_file_ids = itertools.count(1)
+
+
+async def network_delay():
+    """Simulasi latensi API Telegram agar handler benar-benar saling menyela."""
+    await asyncio.sleep(random.uniform(0.001, 0.01))
+
+
+def make_user(user_id: int):
+    return SimpleNamespace(
+        id=user_id, first_name="User", last_name=None, username=f"user{user_id}",
+        language_code="en", is_bot=False,
+    )
+
+
+class FakeMessage:
+    def __init__(self, user, text=None):
+        self.from_user = user
+        self.text = text
+        self.chat = SimpleNamespace(id=user.id, type="private")
+        self.id = 1
+        self.reply_to_message = None
+        self.edits = []
+        self.replies = []
+        self.deleted = False
+
+    async def reply_text(self, text, **kwargs):
+        await network_delay()
+        self.replies.append(text)
+
+    async def edit_text(self, text, **kwargs):
+        await network_delay()
+        self.edits.append(text)
+
+    async def delete(self):
+        await network_delay()
+        self.deleted = True
+
+
+class FakeCallbackQuery:
+    def __init__(self, user, data):
+        self.from_user = user
+        self.data = data
+        self.message = FakeMessage(user)
+        self.answers = []
+
+    async def answer(self, text=None, **kwargs):
+        await network_delay()
+        self.answers.append(text)
+
+
+class FakeClient:
+    def __init__(self):
+        self.documents = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await network_delay()
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await network_delay()
+        self.documents.append((chat_id, kwargs.get("file_name")))
+        return SimpleNamespace(document=SimpleNamespace(file_id=f"file{next(_file_ids)}"))
+
+    async def get_chat(self, username):
+        await network_delay()
+        return SimpleNamespace(
+            type="ChatType.CHANNEL",
+            linked_chat=SimpleNamespace(username=f"{username}_chat", id=-100_000_000 - len(username)),
+        )
@@ -0,0 +1,47 @@
+"""Snapshot analitik: bacaan interaktif me-refresh snapshot yang sudah basi."""
+import asyncio
+import os
+import sqlite3
+import time
+
+
+def count_groups(path: str) -> int:
+    conn = sqlite3.connect(path)
+    count = conn.execute('SELECT COUNT(*) FROM link_groups').fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_stale_snapshot_is_refreshed_once(bot, monkeypatch):
+    monkeypatch.setattr(bot, "SNAPSHOT_INTERVAL", 3600)
+    monkeypatch.setattr(bot, "SNAPSHOT_MAX_AGE", 300)
+    monkeypatch.setattr(bot, "snapshot_signature", None)
+    monkeypatch.setattr(bot, "snapshot_refresh", None)
+
+    bot.create_link_group(1, "First", "first")
+    assert bot.refresh_analytics_snapshot()
+
+    # Snapshot masih segar: tidak ada salinan baru
+    bot.create_link_group(1, "Second", "second")
+    asyncio.run(bot.ensure_fresh_snapshot())
+    assert count_groups(bot.ANALYTICS_DB_PATH) == 1
+
+    # Basi: pembaca serentak menunggu satu salinan yang sama
+    stale = time.time() - 600
+    os.utime(bot.ANALYTICS_DB_PATH, (stale, stale))
+    copies = []
+    refresh = bot.refresh_analytics_snapshot
+
+    def counting_refresh():
+        copies.append(1)
+        return refresh()
+
+    monkeypatch.setattr(bot, "refresh_analytics_snapshot", counting_refresh)
+
+    async def readers():
+        await asyncio.gather(*(bot.ensure_fresh_snapshot() for _ in range(5)))
+
+    asyncio.run(readers())
+    assert len(copies) == 1
+    assert count_groups(bot.ANALYTICS_DB_PATH) == 2
+    assert "min ago" in bot.analytics_freshness()
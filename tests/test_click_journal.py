@@ -0,0 +1,118 @@
+"""Jurnal klik: pemulihan setelah kill -9 dan jalur klik /start."""
+import asyncio
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+from conftest import ROOT
+from fakes import FakeClient, FakeMessage, make_user
+
+RUNS = 8
+RUN_STRIDE = 10**7
+
+# Anak mencatat klik tanpa henti; setiap klik yang kembali dari record_click di-ack ke file.
+# Sesekali jurnal diterapkan ke SQLite dan di-fsync, seperti loop apply/sync di bot.
+CHILD = """
+import asyncio, os, sys
+import link_tracker_bot as b
+run, ack_path = int(sys.argv[1]), sys.argv[2]
+b.init_databases()
+
+async def replay():
+    # Seperti start_background_tasks: replay berjalan di event loop bot
+    b.replay_click_journal()
+
+asyncio.run(replay())
+ack = os.open(ack_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+i = 0
+while True:
+    b.record_click(b.ClickEvent('g1', run * %d + i, ['ig', 'fb', None][i %% 3], 1760000000 + i,
+                                'Fírst', None, f'u{i}', 'id'))
+    os.write(ack, b'%%d\\n' %% i)
+    i += 1
+    if i %% 700 == 0:
+        b.apply_click_journal((b.click_journal.segment, b.click_journal.offset))
+    if i %% 97 == 0:
+        b.ClickJournal.sync_fds(*b.click_journal.take_sync())
+""" % RUN_STRIDE
+
+
+def test_journal_survives_sigkill(bot, tmp_path):
+    conn = sqlite3.connect(bot.DB_PATH)
+    conn.execute(
+        "INSERT INTO link_groups (group_id, owner_id, group_name, owner_code) VALUES ('g1', 1, 'T', 'oc')"
+    )
+    conn.commit()
+    conn.close()
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        DB_PATH=bot.DB_PATH,
+        DATA_DB_PATH=bot.DATA_DB_PATH,
+        ANALYTICS_DB_PATH=bot.ANALYTICS_DB_PATH,
+        CLICK_JOURNAL_DIR=bot.CLICK_JOURNAL_DIR,
+        # Segmen kecil agar rotasi segmen ikut terpotong kill
+        CLICK_JOURNAL_SEGMENT_SIZE=str(64 * 1024),
+    )
+    rng = random.Random(7)
+    for run in range(RUNS):
+        ack_path = tmp_path / f"ack_{run}"
+        child = subprocess.Popen([sys.executable, "-c", CHILD, str(run), str(ack_path)],
+                                 env=env, cwd=tmp_path)
+        deadline = time.monotonic() + 30
+        while not ack_path.exists() and child.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert child.poll() is None, "child exited before recording clicks"
+        time.sleep(rng.uniform(0.1, 0.6))
+        os.kill(child.pid, signal.SIGKILL)
+        child.wait()
+
+    # Restart terakhir: hanya replay
+    async def replay():
+        bot.replay_click_journal()
+
+    asyncio.run(replay())
+
+    conn = sqlite3.connect(bot.DB_PATH)
+    total = 0
+    for run in range(RUNS):
+        acked = len((tmp_path / f"ack_{run}").read_text().split())
+        ids = [row[0] - run * RUN_STRIDE for row in conn.execute(
+            'SELECT user_id FROM clicks WHERE user_id >= ? AND user_id < ? ORDER BY user_id',
+            (run * RUN_STRIDE, (run + 1) * RUN_STRIDE),
+        )]
+        # Klik yang sudah di-ack tidak boleh hilang; paling banyak satu klik terakhir tertulis sebelum ack
+        assert ids == list(range(len(ids))), f"run {run}: clicks are not contiguous"
+        assert acked <= len(ids) <= acked + 1, f"run {run}: acked {acked}, applied {len(ids)}"
+        total += len(ids)
+
+    assert conn.execute("SELECT clicks FROM link_groups WHERE group_id = 'g1'").fetchone()[0] == total
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    conn.close()
+    assert len(bot.list_journal_segments()) <= 1
+
+
+def test_start_deep_link_records_click(bot):
+    owner = make_user(1)
+    clicker = make_user(2)
+    group_id = bot.create_link_group(owner.id, "Promo", "promo")
+    bot.add_link_item(group_id, "Channel", "@channel")
+
+    message = FakeMessage(clicker, f"/start {group_id}-ig")
+    message.command = ["start", f"{group_id}-ig"]
+    asyncio.run(bot.start_handler(FakeClient(), message))
+
+    assert message.replies and "Promo" in message.replies[0]
+    bot.apply_click_journal((bot.click_journal.segment, bot.click_journal.offset))
+
+    conn = sqlite3.connect(bot.DB_PATH)
+    assert conn.execute('SELECT user_id FROM clicks WHERE link_id = ?', (group_id,)).fetchall() == [(clicker.id,)]
+    conn.close()
+    conn = sqlite3.connect(bot.DATA_DB_PATH)
+    assert conn.execute('SELECT user_id FROM users').fetchall() == [(clicker.id,)]
+    conn.close()
@@ -0,0 +1,33 @@
+"""Writer export: part Parquet tidak melewati batas ukuran part."""
+import os
+import random
+import string
+
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def member_rows(count: int, first_id: int) -> list:
+    rng = random.Random(first_id)
+    return [
+        (-100, first_id + i, "".join(rng.choices(string.ascii_letters, k=12)),
+         "".join(rng.choices(string.ascii_letters, k=30)), None,
+         "2024-01-01 00:00:00", "2024-02-01 00:00:00", rng.randint(1, 999), 1, "2024-01-01 00:00:00", "fb", 0)
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize("part_size", [200_000, 1_000_000])
+def test_parquet_parts_stay_under_part_size(bot, part_size):
+    writer = bot.ParquetPartWriter("members", bot.MEMBERS_EXPORT_COLUMNS, part_size=part_size)
+    try:
+        for batch in range(60):
+            writer.write_rows(member_rows(1000, batch * 1000))
+        parts = writer.close()
+
+        assert len(parts) > 1
+        assert all(os.path.getsize(path) <= part_size for path, _ in parts)
+        assert sum(pq.ParquetFile(path).metadata.num_rows for path, _ in parts) == writer.row_count == 60_000
+    finally:
+        writer.cleanup()
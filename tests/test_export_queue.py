@@ -0,0 +1,94 @@
+"""Stress test antrian export: 50 export serentak lewat export_callback."""
+import asyncio
+import sqlite3
+import threading
+import time
+
+from fakes import FakeCallbackQuery, FakeClient, make_user
+
+COLLECTIONS = 50
+CLICKS_PER_COLLECTION = 2000
+
+
+def seed_collections(bot) -> list:
+    """Buat satu koleksi per owner, masing-masing dengan klik dari user berbeda."""
+    group_ids = []
+    conn = sqlite3.connect(bot.DB_PATH)
+    cursor = conn.cursor()
+    now = int(time.time())
+    for owner_id in range(1, COLLECTIONS + 1):
+        group_id = bot.create_link_group(owner_id, f"Collection {owner_id}", f"c{owner_id:02d}")
+        group_ids.append(group_id)
+        bot.apply_clicks(cursor, [
+            bot.ClickEvent(group_id, 10_000 + n, "fb", now - n, "Clicker", None, f"clicker{n}", "en")
+            for n in range(CLICKS_PER_COLLECTION)
+        ])
+        conn.commit()
+    conn.close()
+    return group_ids
+
+
+def test_fifty_concurrent_exports(bot, monkeypatch):
+    group_ids = seed_collections(bot)
+    monkeypatch.setattr(bot, "EXPORT_PROGRESS_INTERVAL", 0.01)
+
+    # Hitung builder yang berjalan bersamaan di thread pool export
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+    build_click_export = bot.build_click_export
+
+    def counting_build(*args, **kwargs):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        try:
+            time.sleep(0.01)
+            return build_click_export(*args, **kwargs)
+        finally:
+            with lock:
+                running["now"] -= 1
+
+    monkeypatch.setattr(bot, "build_click_export", counting_build)
+
+    client = FakeClient()
+    queries = [
+        FakeCallbackQuery(make_user(owner_id), f"export_{group_id}")
+        for owner_id, group_id in enumerate(group_ids, start=1)
+    ]
+    # Owner pertama menekan tombol yang sama dua kali dari pesan lain
+    duplicate = FakeCallbackQuery(make_user(1), f"export_{group_ids[0]}")
+
+    async def scenario():
+        await asyncio.gather(*(bot.export_callback(client, query) for query in queries))
+        await bot.export_callback(client, duplicate)
+
+        # Job terakhir masih antre di belakang 49 job lain: batalkan sebelum diambil worker
+        last_job = bot.export_jobs[bot.active_export_keys[(group_ids[-1], "clicks_csv")]]
+        assert not last_job.started
+        last_job.cancel_event.set()
+
+        await asyncio.wait_for(bot._export_queue.join(), timeout=120)
+
+    asyncio.run(scenario())
+
+    assert duplicate.answers == ["This export is already in progress."]
+    assert running["peak"] <= bot.EXPORT_WORKERS
+    assert not bot.export_jobs and not bot.active_export_keys
+
+    cancelled = queries[-1]
+    assert cancelled.message.edits[-1] == "❌ Export cancelled."
+    assert not cancelled.message.deleted
+
+    completed = queries[:-1]
+    for query in completed:
+        assert query.message.deleted, query.message.edits
+        assert query.message.edits[0].startswith("⏳ Export queued (position ")
+    # Setiap export selesai mengirim file data + ringkasan
+    assert len(client.documents) == 2 * len(completed)
+    assert {chat_id for chat_id, _ in client.documents} == {query.from_user.id for query in completed}
+
+    # file_id setiap export selesai tersimpan untuk dikirim ulang tanpa membangun file lagi
+    conn = sqlite3.connect(bot.DB_PATH)
+    cached = conn.execute("SELECT COUNT(*) FROM export_cache").fetchone()[0]
+    conn.close()
+    assert cached == len(completed)
@@ -0,0 +1,85 @@
+"""Heavy hitters: pemuatan sketch dari data yang sudah ada dan koleksi yang dihapus saat dimuat."""
+import asyncio
+import sqlite3
+import time
+
+SOURCES = {"fb": 30, "ig": 12}
+
+
+def commit_clicks(bot, group_id: str, sources: dict, first_user: int = 0) -> list:
+    conn = sqlite3.connect(bot.DB_PATH)
+    now = int(time.time())
+    clicks = [
+        bot.ClickEvent(group_id, first_user + n, source, now, "Clicker", None, None, "en")
+        for source, count in sources.items() for n in range(count)
+    ]
+    hits = bot.apply_clicks(conn.cursor(), clicks)
+    conn.commit()
+    conn.close()
+    return hits
+
+
+def test_cold_load_does_not_double_count(bot):
+    group_id = bot.create_link_group(1, "Promo", "promo")
+    commit_clicks(bot, group_id, {"fb": 100})
+
+    async def scenario():
+        # Batch yang sudah di-commit sebelum sketch dimuat ikut terbaca oleh GROUP BY
+        bot.count_source_hits(commit_clicks(bot, group_id, SOURCES, first_user=1000))
+        sketch = await bot.get_heavy_hitters(group_id, "source")
+        assert dict(sketch.ranking()) == {"fb": 130, "ig": 12}
+
+        # Setelah dimuat, hitungan baru langsung masuk
+        bot.count_source_hits(commit_clicks(bot, group_id, {"ig": 5}, first_user=2000))
+        assert dict(sketch.ranking())["ig"] == 17
+
+    asyncio.run(scenario())
+
+
+def test_pending_counts_after_snapshot_are_applied(bot, monkeypatch):
+    group_id = bot.create_link_group(1, "Promo", "promo")
+    commit_clicks(bot, group_id, {"fb": 10})
+    load = bot.load_heavy_hitters
+
+    def slow_load(link_id, kind):
+        result = load(link_id, kind)
+        # Batch baru di-commit setelah GROUP BY membaca snapshot-nya
+        time.sleep(0.2)
+        return result
+
+    monkeypatch.setattr(bot, "load_heavy_hitters", slow_load)
+
+    async def scenario():
+        bot.count_source_hits(commit_clicks(bot, group_id, {"ig": 3}, first_user=100))
+        await asyncio.sleep(0.1)
+        bot.count_source_hits(commit_clicks(bot, group_id, {"ig": 4}, first_user=200))
+        sketch = await bot.get_heavy_hitters(group_id, "source")
+        assert dict(sketch.ranking()) == {"fb": 10, "ig": 7}
+
+    asyncio.run(scenario())
+
+
+def test_deleted_collection_is_not_reloaded(bot, monkeypatch):
+    group_id = bot.create_link_group(1, "Promo", "promo")
+    commit_clicks(bot, group_id, SOURCES)
+    load = bot.load_heavy_hitters
+
+    def slow_load(link_id, kind):
+        time.sleep(0.1)
+        return load(link_id, kind)
+
+    monkeypatch.setattr(bot, "load_heavy_hitters", slow_load)
+
+    async def scenario():
+        bot.count_source_hits(commit_clicks(bot, group_id, {"fb": 1}, first_user=500))
+        task = bot.heavy_hitters_loads[(group_id, "source")]
+        bot.delete_link_group(group_id)
+        await task
+        assert (group_id, "source") not in bot.heavy_hitters
+        await bot.persist_heavy_hitters()
+
+    asyncio.run(scenario())
+
+    conn = sqlite3.connect(bot.DB_PATH)
+    assert conn.execute('SELECT COUNT(*) FROM heavy_hitters WHERE link_id = ?', (group_id,)).fetchone()[0] == 0
+    conn.close()
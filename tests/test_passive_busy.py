@@ -0,0 +1,60 @@
+"""Monitoring pasif: pesan yang menabrak lock tulis dicoba ulang, bukan dibuang diam-diam."""
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+from fakes import make_user
+
+CHAT = SimpleNamespace(id=-100123, username="group", title="Group", type="ChatType.SUPERGROUP", description=None)
+
+
+def hold_write_lock(bot):
+    conn = sqlite3.connect(bot.DATA_DB_PATH, isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    return conn
+
+
+def member_count(bot) -> int:
+    conn = sqlite3.connect(bot.DATA_DB_PATH)
+    count = conn.execute('SELECT COUNT(*) FROM members WHERE chat_id = ?', (CHAT.id,)).fetchone()[0]
+    conn.close()
+    return count
+
+
+def fresh_stats(bot, monkeypatch):
+    monkeypatch.setattr(bot, "PASSIVE_DB_TIMEOUT", 0.05)
+    monkeypatch.setattr(bot, "PASSIVE_BUSY_BACKOFF", 0.05)
+    monkeypatch.setattr(bot, "passive_stats", dict.fromkeys(bot.passive_stats, 0))
+    # Koneksi thread pasif dibuka ulang dengan timeout test
+    bot.passive_executor.submit(bot.close_passive_connection).result()
+
+
+def test_busy_message_is_retried(bot, monkeypatch):
+    fresh_stats(bot, monkeypatch)
+    lock = hold_write_lock(bot)
+
+    async def scenario():
+        asyncio.get_running_loop().call_later(0.2, lock.rollback)
+        await bot.process_group_message(CHAT, make_user(7), None, 1, None, None)
+
+    asyncio.run(scenario())
+    lock.close()
+
+    assert member_count(bot) == 1
+    assert bot.passive_stats['busy'] >= 1
+    assert bot.passive_stats['busy_dropped'] == 0
+
+
+def test_busy_drop_is_counted(bot, monkeypatch, capsys):
+    fresh_stats(bot, monkeypatch)
+    monkeypatch.setattr(bot, "PASSIVE_BUSY_RETRIES", 2)
+    lock = hold_write_lock(bot)
+
+    asyncio.run(bot.process_group_message(CHAT, make_user(7), None, 1, None, None))
+    lock.rollback()
+    lock.close()
+
+    assert member_count(bot) == 0
+    assert bot.passive_stats['busy'] == 3
+    assert bot.passive_stats['busy_dropped'] == 1
+    assert "database busy" in capsys.readouterr().out
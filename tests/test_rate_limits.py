@@ -0,0 +1,50 @@
+"""Admission control: budget export hanya dipakai oleh export yang benar-benar membangun file."""
+import asyncio
+import sqlite3
+import time
+
+from fakes import FakeCallbackQuery, FakeClient, make_user
+
+
+def seed_collection(bot, owner_id: int, code: str) -> str:
+    group_id = bot.create_link_group(owner_id, f"Collection {code}", code)
+    conn = sqlite3.connect(bot.DB_PATH)
+    bot.apply_clicks(conn.cursor(), [
+        bot.ClickEvent(group_id, 100 + n, "fb", int(time.time()), "Clicker", None, None, "en") for n in range(20)
+    ])
+    conn.commit()
+    conn.close()
+    return group_id
+
+
+def test_cached_resend_does_not_use_export_budget(bot, monkeypatch):
+    monkeypatch.setitem(bot.ADMISSION_LIMITS, "export", (1, 120))
+    monkeypatch.setattr(bot, "admission_buckets", {name: {} for name in bot.ADMISSION_LIMITS})
+    monkeypatch.setattr(bot, "admission_notified", set())
+    owner = make_user(1)
+    first = seed_collection(bot, owner.id, "aaa")
+    second = seed_collection(bot, owner.id, "bbb")
+
+    async def scenario():
+        client = FakeClient()
+
+        # Export pertama membangun file dan memakai satu-satunya token export
+        built = FakeCallbackQuery(owner, f"export_{first}")
+        await bot.export_callback(client, built)
+        await bot._export_queue.join()
+        sent = len(client.documents)
+        assert sent > 0
+
+        # Data belum berubah: dikirim ulang dari cache tanpa token export
+        resend = FakeCallbackQuery(owner, f"export_{first}")
+        await bot.export_callback(client, resend)
+        assert resend.answers == []
+        assert len(client.documents) == 2 * sent
+
+        # Export baru yang harus dibangun ditolak sampai budget terisi lagi
+        rejected = FakeCallbackQuery(owner, f"export_{second}")
+        await bot.export_callback(client, rejected)
+        assert rejected.answers and rejected.answers[0].startswith("⏳ Too many requests")
+        assert not bot.export_jobs
+
+    asyncio.run(scenario())
@@ -0,0 +1,126 @@
+"""Stress test serialize_per_user: burst tambah/ubah/hapus item dari banyak user sekaligus.
+
+Setiap user mengirim langkah percakapannya beruntun tanpa menunggu balasan (double-tap, mengetik
+cepat), sementara dispatcher menjalankan update dari banyak user secara paralel. Hasil akhir di
+database harus sama dengan menjalankan langkah setiap user satu per satu.
+"""
+import asyncio
+import random
+import re
+
+from fakes import FakeCallbackQuery, FakeClient, FakeMessage, make_user
+
+USERS = 60
+ITEMS_PER_USER = 4
+WORKERS = 16
+
+
+def route(bot, update):
+    """Pilih handler seperti filter Pyrogram untuk update callback / pesan teks."""
+    if isinstance(update, FakeCallbackQuery):
+        for pattern, handler in (
+            (r"^additem_", bot.add_item_callback),
+            (r"^editname_", bot.edit_name_callback),
+            (r"^editurl_", bot.edit_url_callback),
+            (r"^rmitem_", bot.remove_item_callback),
+        ):
+            if re.match(pattern, update.data):
+                return handler
+    return bot.text_handler
+
+
+async def dispatch(bot, client, scripts: dict):
+    """Jalankan burst setiap user lewat pool worker bersama, urutan antar user diacak."""
+    queue = asyncio.Queue()
+    errors = []
+
+    async def worker():
+        while True:
+            update = await queue.get()
+            try:
+                await route(bot, update)(client, update)
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                queue.task_done()
+
+    # Urutan per user dipertahankan, burst antar user saling berselang-seling
+    pending = {user_id: list(updates) for user_id, updates in scripts.items()}
+    while pending:
+        user_id = random.choice(list(pending))
+        queue.put_nowait(pending[user_id].pop(0))
+        if not pending[user_id]:
+            del pending[user_id]
+
+    workers = [asyncio.create_task(worker()) for _ in range(WORKERS)]
+    await asyncio.wait_for(queue.join(), timeout=120)
+    for task in workers:
+        task.cancel()
+    return errors
+
+
+def test_item_bursts_are_serialized_per_user(bot):
+    random.seed(43)
+    client = FakeClient()
+    users = {user_id: make_user(user_id) for user_id in range(1000, 1000 + USERS)}
+    groups = {}
+    for user_id in users:
+        group_id = bot.create_link_group(user_id, f"Collection {user_id}", f"u{user_id}")
+        groups[user_id] = group_id
+        bot.user_states[user_id] = {'step': 'managing_group', 'group_id': group_id, 'group_name': f"Collection {user_id}"}
+
+    async def scenario():
+        # 1. Tambah item: tombol, nama, lalu username target, semuanya beruntun
+        errors = await dispatch(bot, client, {
+            user_id: [
+                update
+                for k in range(ITEMS_PER_USER)
+                for update in (
+                    FakeCallbackQuery(user, f"additem_{groups[user_id]}"),
+                    FakeMessage(user, f"Item {k}"),
+                    FakeMessage(user, f"@chan_{user_id}_{k}"),
+                )
+            ]
+            for user_id, user in users.items()
+        })
+        assert not errors
+        items = {}
+        for user_id in users:
+            items[user_id] = bot.get_link_items(groups[user_id])
+            assert sorted((i.display_name, i.target_url) for i in items[user_id]) == [
+                (f"Item {k}", f"chan_{user_id}_{k}") for k in range(ITEMS_PER_USER)
+            ]
+
+        # 2. Ganti nama dan URL setiap item
+        errors = await dispatch(bot, client, {
+            user_id: [
+                update
+                for item in items[user_id]
+                for update in (
+                    FakeCallbackQuery(user, f"editname_{item.id}_{groups[user_id]}"),
+                    FakeMessage(user, f"Renamed {item.id}"),
+                    FakeCallbackQuery(user, f"editurl_{item.id}_{groups[user_id]}"),
+                    FakeMessage(user, f"@new_{item.id}"),
+                )
+            ]
+            for user_id, user in users.items()
+        })
+        assert not errors
+        for user_id in users:
+            edited = bot.get_link_items(groups[user_id])
+            assert len(edited) == ITEMS_PER_USER
+            for item in edited:
+                assert (item.display_name, item.target_url) == (f"Renamed {item.id}", f"@new_{item.id}")
+
+        # 3. Hapus semua item
+        errors = await dispatch(bot, client, {
+            user_id: [FakeCallbackQuery(user, f"rmitem_{item.id}_{groups[user_id]}") for item in items[user_id]]
+            for user_id, user in users.items()
+        })
+        assert not errors
+        for user_id in users:
+            assert bot.get_link_items(groups[user_id]) == []
+
+    asyncio.run(scenario())
+    # Antrean per user dibuang begitu kosong
+    assert bot.user_queues == {}